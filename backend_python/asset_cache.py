@@ -0,0 +1,107 @@
+from PIL import Image
+import os
+import threading
+
+from caching import LRUCache
+from packaging_catalog import packaging_catalog, PACKAGES_DIR, IMAGE_EXTENSIONS
+
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), "assets")
+STICKERS_DIR = os.path.join(ASSETS_DIR, "stickers")
+
+# Number of resized/rotated variants kept in memory per process
+VARIANT_CACHE_SIZE = int(os.getenv("STICKER_CACHE_SIZE", "256"))
+# Rotations are snapped to this many degrees so near-identical angles share a variant (0 disables snapping)
+ROTATION_BUCKET_DEGREES = float(os.getenv("STICKER_ROTATION_BUCKET", "1"))
+
+def sticker_key(filename: str) -> str:
+    return f"stickers/{filename}"
+
+def package_key(source: str, filename: str) -> str:
+    subdir = "builtin" if source == "builtin" else "custom"
+    return f"packages/{subdir}/{filename}"
+
+class AssetCache:
+    """
+    Process-wide cache of decoded sticker and packaging images.
+
+    Source files are decoded to RGBA once (packaging images by the packaging catalog);
+    resized (and rotated) variants are kept in a bounded LRU keyed by
+    (asset key, width, height, rotation bucket).
+    """
+
+    def __init__(self, assets_dir: str = ASSETS_DIR, max_variants: int = VARIANT_CACHE_SIZE,
+                 rotation_bucket: float = ROTATION_BUCKET_DEGREES):
+        self.assets_dir = assets_dir
+        self.rotation_bucket = rotation_bucket
+        self.variants = LRUCache(max_variants)
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._preloaded = False
+
+    def preload(self, label_heights=()):
+        # Decode every sticker, and every packaging image with its labels pre-scaled to `label_heights`
+        directory = os.path.join(self.assets_dir, "stickers")
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    self.source(sticker_key(filename))
+        packaging_catalog.preload(label_heights)
+        self._preloaded = True
+
+    def source(self, key: str) -> Image.Image | None:
+        if key.startswith("packages/"):
+            _, source, filename = key.split("/", 2)
+            return packaging_catalog.image(source, filename)
+
+        img = self._sources.get(key)
+        if img is not None:
+            return img
+
+        filepath = os.path.join(self.assets_dir, *key.split("/"))
+        if not os.path.isfile(filepath):
+            return None
+        try:
+            with Image.open(filepath) as raw:
+                img = raw.convert("RGBA")
+        except Exception as e:
+            print(f"Error loading asset {filepath}: {e}")
+            return None
+
+        with self._lock:
+            self._sources[key] = img
+        return img
+
+    def rotation_bucket_for(self, rotation: float) -> float:
+        if self.rotation_bucket <= 0:
+            return rotation % 360
+        return (round(rotation / self.rotation_bucket) * self.rotation_bucket) % 360
+
+    def sticker(self, key: str, width: int, height: int, rotation: float = 0) -> Image.Image | None:
+        """Returns the asset resized to (width, height) and rotated clockwise by `rotation` degrees."""
+        if not self._preloaded:
+            self.preload()
+
+        bucket = self.rotation_bucket_for(rotation)
+        variant_key = (key, width, height, bucket)
+        variant = self.variants.get(variant_key)
+        if variant is not None:
+            return variant
+
+        src = self.source(key)
+        if src is None:
+            return None
+
+        # Use LANCZOS for high quality downscaling/upscaling
+        variant = src.resize((width, height), resample=Image.Resampling.LANCZOS)
+        if bucket:
+            # expand=True allows the image to grow to fit the rotated content
+            variant = variant.rotate(-bucket, resample=Image.Resampling.BICUBIC, expand=True)
+        self.variants.set(variant_key, variant)
+        return variant
+
+    def stats(self) -> dict:
+        stats = self.variants.stats()
+        stats["sources"] = len(self._sources)
+        return stats
+
+asset_cache = AssetCache()
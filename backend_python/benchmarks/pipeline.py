@@ -0,0 +1,360 @@
+"""
+Benchmarks the photo pipeline on synthetic photos.
+
+Generates JPEGs at several resolutions with varied sticker counts, packaging
+labels and comments, then reports:
+
+  - per-stage timings of image_processing.composite_image (decode, EXIF transpose,
+    resize, stickers, text, encode, write, derivatives) and of the DB insert
+  - peak memory of one composite per resolution, each in a fresh process
+  - throughput and latency of POST /api/photos through the ASGI app at several
+    concurrency levels
+
+Runs against a throwaway SQLite database unless --database-url points at
+Postgres, where the benchmark project is deleted afterwards. Needs the packages
+in requirements-dev.txt.
+
+    pip install -r requirements-dev.txt
+    python benchmarks/pipeline.py
+    python benchmarks/pipeline.py --resolutions 12,48 --concurrency 1,4,16 --json pipeline.json
+"""
+import argparse
+import asyncio
+import dataclasses
+import io
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import get_context
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import PIL
+from PIL import Image
+
+import image_processing
+
+STICKER_TYPES = ["arrow", "circle", "circle-filled", "crosshair", "arrow-3d"]
+STICKER_COLORS = ["red", "yellow", "green", "blue", "cyan", "gray", "black"]
+BUILTIN_PACKAGINGS = ["red.png", "blue.png", "stripes.png", "yellow.png"]
+COMMENTS = [
+    None,
+    "Dent on the left corner",
+    "Упаковка повреждена при доставке, коробка вскрыта, не хватает двух единиц товара",
+    "Pallet 14 / row B. Wrapping torn on two sides, moisture marks at the bottom, label partly unreadable.",
+]
+
+def synthetic_jpeg(megapixels: float, seed: int, orientation: int = 1) -> bytes:
+    """A 4:3 JPEG with gradients and noise, so it encodes to a camera-like size."""
+    width = int(math.sqrt(megapixels * 1_000_000 * 4 / 3))
+    height = int(width * 3 / 4)
+    noise = Image.effect_noise((width, height), 48)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.ROTATE_180)))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif[0x0132] = f"2024:01:{1 + seed % 28:02d} 12:00:00"
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90, exif=exif)
+    return out.getvalue()
+
+def synthetic_fields(seed: int, width: int, height: int) -> dict:
+    """Varied overlay inputs: 0-12 stickers, an optional packaging label and comment."""
+    rng = random.Random(seed)
+    stickers = []
+    for i in range(rng.choice([0, 1, 3, 6, 12])):
+        size = rng.uniform(0.05, 0.2) * min(width, height)
+        stickers.append({
+            "id": f"s{i}",
+            "type": rng.choice(STICKER_TYPES),
+            "x": rng.uniform(0, width - size),
+            "y": rng.uniform(0, height - size),
+            "width": size,
+            "height": size,
+            "rotation": rng.choice([0, 0, 15, 45, 90, 200]),
+            "color": rng.choice(STICKER_COLORS),
+        })
+    packaging = rng.choice([None] + BUILTIN_PACKAGINGS)
+    if packaging:
+        size = 0.25 * min(width, height)
+        stickers.append({
+            "id": "pkg", "type": "packaging", "x": width - size, "y": 0, "width": size, "height": size,
+            "rotation": 0, "packagingId": f"builtin:{packaging}", "packagingFilename": packaging,
+        })
+    return {
+        "comment": COMMENTS[seed % len(COMMENTS)],
+        "stickers": stickers,
+        "latitude": rng.choice([None, 55.7558]),
+        "longitude": 37.6173,
+        "packaging_id": f"builtin:{packaging}" if packaging else None,
+        "hide_date": seed % 5 == 4,
+    }
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def summarize(values: list) -> dict:
+    return {
+        "mean_ms": round(sum(values) / len(values), 3),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "max_ms": round(max(values), 3),
+    }
+
+def packaging_info(packaging_id: str | None) -> dict | None:
+    # Same label routers.photos.resolve_packaging builds for builtin packagings
+    if not packaging_id:
+        return None
+    filename = packaging_id.split(":", 1)[1]
+    return {"name": os.path.splitext(filename)[0].capitalize(), "color": filename, "type": "builtin"}
+
+def composite_args(path: str, fields: dict, output_path: str) -> dict:
+    return dict(
+        image_source=path,
+        comment=fields["comment"],
+        stickers=fields["stickers"],
+        latitude=fields["latitude"],
+        longitude=fields["longitude"],
+        project_name="Pipeline benchmark",
+        captured_at=None,
+        packaging_info=packaging_info(fields["packaging_id"]),
+        hide_date=fields["hide_date"],
+        output_path=output_path,
+        derivative_sizes=image_processing.DERIVATIVE_SIZES,
+    )
+
+def bench_stages(samples: list, workdir: str) -> dict:
+    """Composites every sample in this process, collecting composite_image's stage timings."""
+    stages, totals = {}, []
+    image_processing.composite_image(**composite_args(samples[0]["path"], samples[0]["fields"], os.path.join(workdir, "warmup.jpg")))
+    for i, sample in enumerate(samples):
+        timings = {}
+        start = time.perf_counter()
+        image_processing.composite_image(
+            **composite_args(sample["path"], sample["fields"], os.path.join(workdir, f"out-{i}.jpg")), timings=timings
+        )
+        totals.append((time.perf_counter() - start) * 1000)
+        for name, ms in timings.items():
+            stages.setdefault(name, []).append(ms)
+    return {
+        "photos": len(samples),
+        "source_mb": round(sum(os.path.getsize(s["path"]) for s in samples) / len(samples) / 1e6, 2),
+        "total": summarize(totals),
+        "stages": {name: summarize(values) for name, values in stages.items()},
+    }
+
+def _max_rss() -> int:
+    # VmHWM is reset by exec; ru_maxrss is inherited from the forking parent on Linux
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # KiB on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def _peak_memory(kwargs: dict) -> dict:
+    # Runs in a fresh spawn process so earlier photos don't raise the high-water mark
+    before = _max_rss()
+    image_processing.composite_image(**kwargs)
+    peak = _max_rss()
+    return {"peak_rss_mb": round(peak / 2**20, 1), "growth_mb": round((peak - before) / 2**20, 1)}
+
+def bench_memory(sample: dict, workdir: str) -> dict:
+    ctx = get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(_peak_memory, (composite_args(sample["path"], sample["fields"], os.path.join(workdir, "memory.jpg")),))
+
+async def bench_db_insert(count: int, project_id: str, user_id: int) -> dict:
+    import crud_async
+    import schemas
+    from database import AsyncSessionLocal
+
+    durations = []
+    async with AsyncSessionLocal() as db:
+        for i in range(count):
+            fields = synthetic_fields(i, 4000, 3000)
+            photo = schemas.PhotoCreate(
+                filename=f"bench-{i}.jpg",
+                project_id=project_id,
+                comment=fields["comment"],
+                latitude=fields["latitude"],
+                longitude=fields["longitude"],
+                stickers=[schemas.StickerBase(**s) for s in fields["stickers"] if s["type"] != "packaging"],
+                packaging_id=fields["packaging_id"],
+            )
+            start = time.perf_counter()
+            await crud_async.create_photo(db=db, photo=photo, filename=photo.filename, user_id=user_id)
+            durations.append((time.perf_counter() - start) * 1000)
+    return {"rows": count, **summarize(durations)}
+
+async def bench_throughput(app, upload: bytes, fields: dict, project_id: str, levels: list, requests: int) -> list:
+    import httpx
+
+    data = {
+        "project_id": project_id,
+        "comment": fields["comment"] or "",
+        "stickers": json.dumps(fields["stickers"]),
+        "latitude": str(fields["latitude"] or ""),
+        "longitude": str(fields["longitude"]),
+        "packaging_id": fields["packaging_id"] or "",
+        "hide_date": str(fields["hide_date"]).lower(),
+    }
+    data = {key: value for key, value in data.items() if value}
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # One request first so worker startup isn't counted against the lowest level
+        await client.post("/api/photos?ingest=sync", data=data, files={"photo": ("bench.jpg", upload, "image/jpeg")})
+        for concurrency in levels:
+            slots = asyncio.Semaphore(concurrency)
+            latencies, statuses = [], {}
+
+            async def one():
+                async with slots:
+                    start = time.perf_counter()
+                    response = await client.post(
+                        "/api/photos?ingest=sync", data=data, files={"photo": ("bench.jpg", upload, "image/jpeg")}
+                    )
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            total = max(requests, concurrency)
+            start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(total)))
+            elapsed = time.perf_counter() - start
+            results.append({
+                "concurrency": concurrency,
+                "requests": total,
+                "statuses": {str(code): n for code, n in sorted(statuses.items())},
+                "req_per_s": round(total / elapsed, 2),
+                "latency": summarize(latencies),
+            })
+            print(f"  concurrency {concurrency}: {results[-1]['req_per_s']} req/s, p95 {results[-1]['latency']['p95_ms']} ms, {statuses}")
+    return results
+
+async def run_api(args, uploads: dict) -> dict:
+    from fastapi import FastAPI
+
+    import crud_async
+    import schemas
+    from compositing import compositing_executor
+    from database import AsyncSessionLocal, async_engine
+    from routers import photos
+
+    async with AsyncSessionLocal() as db:
+        project = await crud_async.create_project(db, schemas.ProjectCreate(name="Pipeline benchmark"), photos.HARDCODED_USER_ID)
+    try:
+        print("DB insert...")
+        db_insert = await bench_db_insert(args.inserts, project.id, photos.HARDCODED_USER_ID)
+
+        app = FastAPI()
+        app.include_router(photos.router)
+        print(f"POST /api/photos with a {args.upload_resolution} MP photo...")
+        throughput = await bench_throughput(
+            app, uploads["data"], uploads["fields"], project.id, args.concurrency, args.requests
+        )
+        return {
+            "database": async_engine.dialect.name,
+            "compositing_workers": compositing_executor.workers,
+            "compositing_queue_depth": compositing_executor.queue_depth,
+            "db_insert": db_insert,
+            "throughput": throughput,
+        }
+    finally:
+        compositing_executor.shutdown()
+        async with AsyncSessionLocal() as db:
+            await crud_async.delete_project(db, project.id, photos.HARDCODED_USER_ID)
+        await async_engine.dispose()
+
+def parse_list(value: str, cast) -> list:
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", default="2,12,48", help="comma-separated megapixel sizes (default: 2,12,48)")
+    parser.add_argument("--photos", type=int, default=8, help="synthetic photos per resolution")
+    parser.add_argument("--inserts", type=int, default=200, help="rows inserted for the DB timing")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=16, help="uploads per concurrency level")
+    parser.add_argument("--upload-resolution", type=float, default=12, help="megapixels of the uploaded photo")
+    parser.add_argument("--render-mode", choices=["eager", "lazy"], default="eager",
+                        help="PHOTO_RENDER_MODE of the API run; lazy uploads only store the original")
+    parser.add_argument("--database-url", help="SQLAlchemy URL (default: a throwaway SQLite file)")
+    parser.add_argument("--skip-api", action="store_true", help="only benchmark composite_image")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    args.resolutions = parse_list(args.resolutions, float)
+    args.concurrency = parse_list(args.concurrency, int)
+
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="pipeline-bench-")
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "output_policy": dataclasses.asdict(image_processing.OUTPUT_POLICY),
+        },
+        "params": {key: value for key, value in vars(args).items() if key not in ("database_url", "json")},
+        "resolutions": {},
+    }
+    try:
+        for megapixels in args.resolutions:
+            print(f"Generating {args.photos} photos at {megapixels} MP...")
+            samples = []
+            for i in range(args.photos):
+                path = os.path.join(workdir, f"src-{megapixels}-{i}.jpg")
+                with open(path, "wb") as f:
+                    # Every fourth photo is rotated via EXIF so exif_transpose has work to do
+                    f.write(synthetic_jpeg(megapixels, i, orientation=6 if i % 4 == 3 else 1))
+                with Image.open(path) as img:
+                    samples.append({"path": path, "fields": synthetic_fields(i, *img.size)})
+
+            label = f"{megapixels:g}MP"
+            result = bench_stages(samples, workdir)
+            result["memory"] = bench_memory(samples[-1], workdir)
+            report["resolutions"][label] = result
+            print(f"  total p50 {result['total']['p50_ms']} ms, peak RSS {result['memory']['peak_rss_mb']} MB")
+            for name, stats in result["stages"].items():
+                print(f"    {name:<15} p50 {stats['p50_ms']:>9} ms  p95 {stats['p95_ms']:>9} ms")
+
+        if not args.skip_api:
+            # The app modules read their configuration at import time, so set it up first;
+            # uploads/ is created relative to the working directory
+            os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+            os.environ.pop("ASYNC_DATABASE_URL", None)
+            os.environ["INSTANCE_CONNECTION_NAME"] = ""
+            os.environ["PHOTO_RENDER_MODE"] = args.render_mode
+            os.chdir(workdir)
+            import seed
+            seed.init_db()
+
+            upload = synthetic_jpeg(args.upload_resolution, 0)
+            with Image.open(io.BytesIO(upload)) as img:
+                fields = synthetic_fields(1, *img.size)
+            report.update(asyncio.run(run_api(args, {"data": upload, "fields": fields})))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
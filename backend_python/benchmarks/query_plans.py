@@ -0,0 +1,146 @@
+"""
+Shows the Postgres query plans of the hot listing queries before and after the
+indexes declared in models.py exist.
+
+Seeds a throwaway schema (dropped afterwards unless --keep) with users, projects
+and photos, where one heavy user owns a large share of the photos, then runs
+EXPLAIN (ANALYZE, BUFFERS) on each query without and with the indexes.
+
+    python benchmarks/query_plans.py --photos 1000000
+    python benchmarks/query_plans.py --database-url postgresql://... --json plans.json
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, text
+
+import models
+from pagination import keyset
+
+SCHEMA = "query_plan_bench"
+HEAVY_USER = 1
+
+SEED_SQL = [
+    """
+    INSERT INTO users (id, telegram_id, first_name, last_name, username, phone, is_bot, language_code)
+    SELECT u, 'bench-' || u, '', '', '', '', false, 'en' FROM generate_series(1, :users) u
+    """,
+    """
+    INSERT INTO projects (id, user_id, name, created_at, updated_at)
+    SELECT 'p-' || u || '-' || p, u, 'Project ' || p, now() - (p || ' days')::interval, now()
+    FROM generate_series(1, :users) u, generate_series(1, :projects) p
+    """,
+    # 30% of the photos belong to the heavy user, the rest are spread over everyone else
+    """
+    INSERT INTO photos (id, user_id, project_id, filename, created_at, status)
+    SELECT 'ph-' || g, x.u, 'p-' || x.u || '-' || (1 + g % :projects), 'bench-' || g || '.jpg',
+           now() - (g || ' seconds')::interval, 'ready'
+    FROM generate_series(1, :photos) g,
+         LATERAL (SELECT CASE WHEN g % 10 < 3 THEN 1 ELSE 2 + g % (:users - 1) END AS u) x
+    """,
+]
+
+def hot_queries(conn):
+    """The statements crud.py issues for the main listings, built the same way."""
+    Photo, Project = models.Photo, models.Project
+    project_id = f"p-{HEAVY_USER}-3"
+    # A cursor a few thousand rows deep into the heavy user's gallery
+    deep = conn.execute(
+        keyset(select(Photo.created_at, Photo.id).where(Photo.user_id == HEAVY_USER), Photo).offset(5000).limit(1)
+    ).first()
+    return {
+        "gallery first page": keyset(select(Photo).where(Photo.user_id == HEAVY_USER), Photo).limit(101),
+        "gallery deep page (cursor)": keyset(select(Photo).where(Photo.user_id == HEAVY_USER), Photo, tuple(deep)).limit(101),
+        "gallery deep page (offset)": keyset(select(Photo).where(Photo.user_id == HEAVY_USER), Photo).offset(5000).limit(101),
+        "project photos": keyset(
+            select(Photo).where(Photo.user_id == HEAVY_USER, Photo.project_id == project_id), Photo
+        ).limit(101),
+        "projects list": keyset(select(Project).where(Project.user_id == HEAVY_USER), Project).limit(101),
+        "project lookup": select(Project).where(Project.id == project_id, Project.user_id == HEAVY_USER),
+    }
+
+def explain(conn, statement):
+    compiled = statement.compile(dialect=conn.dialect)
+    rows = conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS) " + str(compiled), compiled.params).scalars().all()
+    match = re.search(r"Execution Time: ([\d.]+) ms", rows[-1])
+    return "\n".join(rows), float(match.group(1)) if match else None
+
+def run_plans(engine, label):
+    results = {}
+    with engine.connect() as conn:
+        for name, statement in hot_queries(conn).items():
+            explain(conn, statement) # Warm the buffer cache so both runs compare plans, not disk reads
+            plan, ms = explain(conn, statement)
+            results[name] = {"plan": plan, "execution_ms": ms}
+            print(f"\n--- {label}: {name} ({ms} ms)\n{plan}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="Postgres URL (default: DATABASE_URL)")
+    parser.add_argument("--photos", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--projects", type=int, default=10, help="projects per user")
+    parser.add_argument("--json", help="also write the plans and timings to this file")
+    parser.add_argument("--keep", action="store_true", help=f"keep the {SCHEMA} schema afterwards")
+    args = parser.parse_args()
+
+    if not args.database_url or not args.database_url.startswith("postgresql"):
+        parser.error("a PostgreSQL --database-url (or DATABASE_URL) is required")
+
+    admin = create_engine(args.database_url, isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+    engine = create_engine(args.database_url, connect_args={"options": f"-csearch_path={SCHEMA}"})
+    try:
+        tables = [models.User.__table__, models.Project.__table__, models.Packaging.__table__, models.Photo.__table__]
+        models.Base.metadata.create_all(engine, tables=tables)
+        indexes = [index for table in tables for index in table.indexes]
+        with engine.begin() as conn:
+            for index in indexes:
+                index.drop(conn)
+
+        print(f"Seeding {args.photos} photos for {args.users} users...")
+        start = time.perf_counter()
+        params = {"users": args.users, "projects": args.projects, "photos": args.photos}
+        with engine.begin() as conn:
+            for sql in SEED_SQL:
+                conn.execute(text(sql), params)
+            conn.execute(text("ANALYZE"))
+        print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+        before = run_plans(engine, "without indexes")
+
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            for index in indexes:
+                index.create(conn)
+            conn.execute(text("ANALYZE"))
+        print(f"\nCreated {len(indexes)} indexes in {time.perf_counter() - start:.1f}s")
+
+        after = run_plans(engine, "with indexes")
+
+        print(f"\n{'query':<30} {'before ms':>12} {'after ms':>12}")
+        for name in before:
+            print(f"{name:<30} {before[name]['execution_ms']:>12} {after[name]['execution_ms']:>12}")
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"params": params, "before": before, "after": after}, f, indent=2)
+    finally:
+        engine.dispose()
+        if not args.keep:
+            with admin.connect() as conn:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        admin.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+
+import metrics
+
+# Worker processes used for compositing (defaults to the number of cores)
+COMPOSITE_WORKERS = int(os.getenv("COMPOSITE_WORKERS", "0")) or os.cpu_count() or 1
+# Jobs allowed to wait for a free worker before uploads are rejected with 503
+COMPOSITE_QUEUE_DEPTH = int(os.getenv("COMPOSITE_QUEUE_DEPTH", str(COMPOSITE_WORKERS * 2)))
+# Seconds clients are asked to wait before retrying a rejected upload
+COMPOSITE_RETRY_AFTER = int(os.getenv("COMPOSITE_RETRY_AFTER", "5"))
+
+class CompositingBusy(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+def _init_worker():
+    # Decode sticker assets and scale packaging labels once per worker instead of on the first photo
+    from asset_cache import asset_cache
+    from image_processing import common_label_heights
+    asset_cache.preload(common_label_heights())
+
+class CompositingExecutor:
+    """
+    Runs CPU-bound Pillow work in a process pool so it never blocks the event loop.
+
+    At most `workers + queue_depth` jobs are admitted at once; further submissions
+    raise CompositingBusy so the caller can answer 503 instead of queueing unboundedly.
+    A job holds its slot until the worker finishes it, even if the request that
+    submitted it has gone away.
+    """
+
+    def __init__(self, workers: int = COMPOSITE_WORKERS, queue_depth: int = COMPOSITE_QUEUE_DEPTH):
+        self.workers = max(1, workers)
+        self.queue_depth = max(0, queue_depth)
+        self.in_flight = 0
+        self.rejected = 0
+        self._pool = None
+        # Slots are released from the pool's result thread, so the counters are shared across threads
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_depth
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn avoids forking the DB connector's background threads into workers
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._pool
+
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        # A worker died (e.g. OOM on a huge image); the next job starts a fresh pool
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, future=None):
+        with self._lock:
+            self.in_flight -= 1
+            self._slot_freed.notify()
+
+    def _submit(self, fn, *args) -> tuple[Future, ProcessPoolExecutor]:
+        # The caller has taken a slot; it is given back when the job finishes or is cancelled before starting
+        pool = self._get_pool()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._discard_pool(pool)
+            raise
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future, pool
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.rejected += 1
+                raise CompositingBusy(f"Compositing queue is full ({self.capacity} jobs)")
+            self.in_flight += 1
+
+        future, pool = self._submit(fn, *args)
+        try:
+            # Cancelling the request cancels the job only if it hasn't started
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+    def run_sync(self, fn, *args):
+        """Runs a job from a plain thread (e.g. an export), waiting for a free slot instead of raising CompositingBusy."""
+        with self._slot_freed:
+            while self.in_flight >= self.capacity:
+                self._slot_freed.wait()
+            self.in_flight += 1
+
+        future, pool = self._submit(fn, *args)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.workers),
+            "rejected": self.rejected,
+        }
+
+compositing_executor = CompositingExecutor()
+
+# Jobs import image_processing inside the worker, so Pillow is never loaded by the API process itself
+def _composite(*args, **kwargs):
+    from image_processing import composite_image
+    return composite_image(*args, **kwargs)
+
+def _composite_timed(*args, **kwargs):
+    # Runs in a worker, so the stage timings travel back with the result
+    timings = {}
+    return _composite(*args, timings=timings, **kwargs), timings
+
+def _generate_derivatives(*args, **kwargs):
+    from image_processing import generate_derivatives
+    return generate_derivatives(*args, **kwargs)
+
+async def run_composite(*args, **kwargs) -> dict:
+    """Awaitable wrapper around image_processing.composite_image running in the pool."""
+    if not metrics.METRICS_ENABLED:
+        return await compositing_executor.run(functools.partial(_composite, *args, **kwargs))
+    result, timings = await compositing_executor.run(functools.partial(_composite_timed, *args, **kwargs))
+    metrics.record_stages("composite", timings)
+    return result
+
+async def run_generate_derivatives(*args, **kwargs) -> dict:
+    """Awaitable wrapper around image_processing.generate_derivatives running in the pool."""
+    return await compositing_executor.run(functools.partial(_generate_derivatives, *args, **kwargs))
+
+def run_composite_sync(*args, **kwargs) -> dict:
+    """Blocking counterpart of run_composite for plain threads; waits for a free slot."""
+    return compositing_executor.run_sync(functools.partial(_composite, *args, **kwargs))
@@ -1,5 +1,8 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, update, delete
+from sqlalchemy.orm import Session, selectinload
 import models, schemas
+from pagination import keyset
+from response_cache import response_cache
 import json
 
 # --- User ---
@@ -26,8 +29,55 @@ def get_project(db: Session, project_id: str):
 def get_user_project(db: Session, project_id: str, user_id: int):
     return db.query(models.Project).filter(models.Project.id == project_id, models.Project.user_id == user_id).first()
 
-def get_projects(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Project).filter(models.Project.user_id == user_id).offset(skip).limit(limit).all()
+def get_projects(db: Session, user_id: int, skip: int = 0, limit: int = 100, cursor: tuple = None):
+    query = keyset(db.query(models.Project).filter(models.Project.user_id == user_id), models.Project, cursor)
+    return query.offset(skip).limit(limit).all()
+
+def project_summary_query(user_id: int, include_photos: bool = False):
+    """
+    Selects (Project, photo_count, last_photo_at, cover_photo_id) for the user's projects.
+    The aggregates are correlated subqueries, so they only run for the projects on the
+    requested page and each is answered from the (project_id, user_id, created_at) index.
+    """
+    Photo, Project = models.Photo, models.Project
+    in_project = (Photo.project_id == Project.id) & (Photo.user_id == user_id)
+    photo_count = select(func.count(Photo.id)).where(in_project).scalar_subquery()
+    last_photo_at = select(func.max(Photo.created_at)).where(in_project).scalar_subquery()
+    cover_photo_id = (
+        select(Photo.id)
+        .where(in_project, Photo.status == "ready")
+        .order_by(Photo.created_at.desc(), Photo.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    query = select(Project, photo_count, last_photo_at, cover_photo_id).where(Project.user_id == user_id)
+    if include_photos:
+        query = query.options(selectinload(Project.photos))
+    return query
+
+def project_summary(row, include_photos: bool = False) -> schemas.ProjectSummary:
+    project, photo_count, last_photo_at, cover_photo_id = row
+    return schemas.ProjectSummary(
+        id=project.id,
+        user_id=project.user_id,
+        name=project.name,
+        description=project.description,
+        created_at=project.created_at,
+        updated_at=project.updated_at,
+        photo_count=photo_count,
+        last_photo_at=last_photo_at,
+        cover_photo_id=cover_photo_id,
+        photos=project.photos if include_photos else None,
+    )
+
+def get_project_summaries(db: Session, user_id: int, skip: int = 0, limit: int = 100, cursor: tuple = None, include_photos: bool = False):
+    query = keyset(project_summary_query(user_id, include_photos), models.Project, cursor)
+    rows = db.execute(query.offset(skip).limit(limit)).all()
+    return [project_summary(row, include_photos) for row in rows]
+
+def get_project_summary(db: Session, project_id: str, user_id: int, include_photos: bool = False):
+    row = db.execute(project_summary_query(user_id, include_photos).where(models.Project.id == project_id)).first()
+    return project_summary(row, include_photos) if row else None
 
 def create_project(db: Session, project: schemas.ProjectCreate, user_id: int):
     project_data = project.model_dump()
@@ -38,38 +88,94 @@ def create_project(db: Session, project: schemas.ProjectCreate, user_id: int):
     db.add(db_project)
     db.commit()
     db.refresh(db_project)
+    response_cache.invalidate_sync("projects", user_id)
     return db_project
 
+def bump_photo_revisions(project_id: str):
+    # The project name is drawn on photos rendered from their originals, so a rename gives them new versions.
+    # Eager photos have it baked into their stored JPEG; their versions (and browser caches) stay put
+    return (
+        update(models.Photo)
+        .where(models.Photo.project_id == project_id, models.Photo.overlay.isnot(None))
+        .values(revision=models.Photo.revision + 1)
+        .returning(models.Photo.id)
+    )
+
 def update_project(db: Session, project_id: str, project: schemas.ProjectCreate, user_id: int):
     db_project = get_user_project(db, project_id, user_id)
     if db_project:
         project_data = project.model_dump()
         project_data.pop('user_id', None)
+        if project_data["name"] != db_project.name:
+            db.execute(bump_photo_revisions(project_id))
         
         for key, value in project_data.items():
             setattr(db_project, key, value)
         db.commit()
         db.refresh(db_project)
+        response_cache.invalidate_sync("projects", user_id)
     return db_project
 
-def delete_project(db: Session, project_id: str, user_id: int):
-    db_project = get_user_project(db, project_id, user_id)
-    if db_project:
-        db.delete(db_project)
-        db.commit()
+def project_delete_statements(project_id: str, user_id: int, transfer_project_id: str = None):
+    """
+    Set-based statements deleting a project: move its photos to `transfer_project_id`
+    (if given), delete whatever photos remain, then delete the project. The photo
+    DELETE returns the ids and files to remove. Run them in order in one transaction.
+    """
+    Photo = models.Photo
+    statements = []
+    if transfer_project_id:
+        statements.append(
+            update(Photo)
+            .where(Photo.project_id == project_id, Photo.user_id == user_id)
+            .values(project_id=transfer_project_id)
+            .execution_options(synchronize_session=False)
+        )
+    statements.append(
+        delete(Photo)
+        .where(Photo.project_id == project_id, Photo.user_id == user_id)
+        .returning(Photo.id, Photo.filename, Photo.derivatives)
+        .execution_options(synchronize_session=False)
+    )
+    statements.append(
+        delete(models.Project)
+        .where(models.Project.id == project_id, models.Project.user_id == user_id)
+        .execution_options(synchronize_session=False)
+    )
+    return statements
+
+def project_delete_result(results: list, transfer_project_id: str = None) -> dict:
+    """Turns the results of project_delete_statements into counts and the deleted photos' files."""
+    transferred = results[0].rowcount if transfer_project_id else 0
+    deleted_rows = results[-2].all()
+    filenames = [name for _, filename, derivatives in deleted_rows for name in (filename, *(derivatives or {}).values())]
+    return {
+        "transferred_photos": transferred,
+        "deleted_photos": len(deleted_rows),
+        "filenames": filenames,
+        "photo_ids": [photo_id for photo_id, _, _ in deleted_rows],
+    }
+
+def delete_project(db: Session, project_id: str, user_id: int, transfer_project_id: str = None):
+    results = [db.execute(statement) for statement in project_delete_statements(project_id, user_id, transfer_project_id)]
+    # Consume the RETURNING rows before committing
+    result = project_delete_result(results, transfer_project_id)
+    db.commit()
+    response_cache.invalidate_sync("projects", user_id)
+    return result
 
 # --- Photos ---
 
-def get_photos(db: Session, user_id: int, project_id: str = None, skip: int = 0, limit: int = 100):
+def get_photos(db: Session, user_id: int, project_id: str = None, skip: int = 0, limit: int = 100, cursor: tuple = None):
     query = db.query(models.Photo).filter(models.Photo.user_id == user_id)
     if project_id:
         query = query.filter(models.Photo.project_id == project_id)
-    return query.order_by(models.Photo.created_at.desc()).offset(skip).limit(limit).all()
+    return keyset(query, models.Photo, cursor).offset(skip).limit(limit).all()
 
 def get_photo(db: Session, photo_id: str, user_id: int):
     return db.query(models.Photo).filter(models.Photo.id == photo_id, models.Photo.user_id == user_id).first()
 
-def create_photo(db: Session, photo: schemas.PhotoCreate, filename: str, user_id: int):
+def build_photo(photo: schemas.PhotoCreate, filename: str, user_id: int, photo_id: str = None, status: str = "ready", derivatives: dict = None):
     # stickers needs to be serialized if it's not already handled by SQLAlchemy JSON type
     stickers_data = [s.model_dump() for s in photo.stickers]
     
@@ -83,6 +189,7 @@ def create_photo(db: Session, photo: schemas.PhotoCreate, filename: str, user_id
             pass
 
     db_photo = models.Photo(
+        id=photo_id,
         project_id=photo.project_id,
         user_id=user_id,
         filename=filename,
@@ -91,11 +198,50 @@ def create_photo(db: Session, photo: schemas.PhotoCreate, filename: str, user_id
         longitude=photo.longitude,
         stickers=stickers_data,
         created_at=created_at,
-        packaging_id=photo.packaging_id
+        packaging_id=photo.packaging_id,
+        status=status,
+        derivatives=derivatives,
+        content_hash=photo.content_hash,
+        idempotency_key=photo.idempotency_key,
+        overlay=photo.overlay
     )
+    return db_photo
+
+def create_photo(db: Session, photo: schemas.PhotoCreate, filename: str, user_id: int, photo_id: str = None, status: str = "ready", derivatives: dict = None):
+    db_photo = build_photo(photo, filename, user_id, photo_id=photo_id, status=status, derivatives=derivatives)
     db.add(db_photo)
     db.commit()
     db.refresh(db_photo)
+    # Project summaries carry photo counts and cover photos
+    response_cache.invalidate_sync("projects", user_id)
+    return db_photo
+
+def get_photo_by_id(db: Session, photo_id: str):
+    # Unscoped lookup for background jobs
+    return db.query(models.Photo).filter(models.Photo.id == photo_id).first()
+
+def set_photo_status(db: Session, photo_id: str, status: str, derivatives: dict = None):
+    db_photo = get_photo_by_id(db, photo_id)
+    if db_photo:
+        db_photo.status = status
+        if derivatives is not None:
+            db_photo.derivatives = derivatives
+        if status == "failed":
+            # Frees the Idempotency-Key (unique per user) for the client's retry
+            db_photo.idempotency_key = None
+        db.commit()
+        db.refresh(db_photo)
+        response_cache.invalidate_sync("projects", db_photo.user_id)
+    return db_photo
+
+def set_photo_derivatives(db: Session, photo_id: str, derivatives: dict):
+    db_photo = get_photo_by_id(db, photo_id)
+    if db_photo:
+        # Reassign a new dict so the JSON column is flagged as changed
+        db_photo.derivatives = {**(db_photo.derivatives or {}), **derivatives}
+        db.commit()
+        db.refresh(db_photo)
+        response_cache.invalidate_sync("projects", db_photo.user_id)
     return db_photo
 
 def delete_photo(db: Session, photo_id: str, user_id: int):
@@ -103,6 +249,7 @@ def delete_photo(db: Session, photo_id: str, user_id: int):
     if db_photo:
         db.delete(db_photo)
         db.commit()
+        response_cache.invalidate_sync("projects", user_id)
 
 # --- Packaging ---
 
@@ -124,6 +271,7 @@ def create_packaging(db: Session, packaging: schemas.PackagingCreate, user_id: i
     db.add(db_packaging)
     db.commit()
     db.refresh(db_packaging)
+    response_cache.invalidate_sync("packagings", user_id)
     return db_packaging
 
 def update_packaging(db: Session, packaging_id: str, packaging: schemas.PackagingCreate, user_id: int):
@@ -137,6 +285,7 @@ def update_packaging(db: Session, packaging_id: str, packaging: schemas.Packagin
             setattr(db_packaging, key, value)
         db.commit()
         db.refresh(db_packaging)
+        response_cache.invalidate_sync("packagings", user_id)
         return db_packaging
     return None
 
@@ -146,3 +295,27 @@ def delete_packaging(db: Session, packaging_id: str, user_id: int):
     if db_packaging and db_packaging.user_id == user_id:
         db.delete(db_packaging)
         db.commit()
+        response_cache.invalidate_sync("packagings", user_id)
+
+def upsert_builtin_packagings(db: Session, packagings: list):
+    """Inserts or renames the system packagings in one statement instead of a query per file."""
+    if not packagings:
+        return
+    rows = [{"id": p["id"], "user_id": None, "name": p["name"], "color": p["color"]} for p in packagings]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(models.Packaging).values(rows)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[models.Packaging.id],
+            set_={"name": statement.excluded.name, "color": statement.excluded.color},
+        ))
+    else:
+        existing = set(db.scalars(select(models.Packaging.id).where(models.Packaging.id.in_([row["id"] for row in rows]))))
+        db.add_all(models.Packaging(**row) for row in rows if row["id"] not in existing)
+    db.commit()
+    # System packagings are part of every user's list
+    response_cache.invalidate_sync("packagings")
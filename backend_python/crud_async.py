@@ -0,0 +1,256 @@
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+import models, schemas
+from crud import build_photo, bump_photo_revisions, project_summary_query, project_summary, project_delete_statements, project_delete_result
+from pagination import keyset
+from response_cache import response_cache
+
+# Async counterparts of crud.py for handlers running on the event loop.
+# Relationships can't lazy-load under asyncio, so anything serialized with them is loaded eagerly.
+
+# --- User ---
+
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+async def get_user_by_telegram_id(db: AsyncSession, telegram_id: str):
+    result = await db.execute(select(models.User).where(models.User.telegram_id == telegram_id))
+    return result.scalars().first()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    db_user = models.User(**user.model_dump())
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+# --- Project ---
+
+def _project_query():
+    return select(models.Project).options(selectinload(models.Project.photos))
+
+async def get_project(db: AsyncSession, project_id: str):
+    result = await db.execute(_project_query().where(models.Project.id == project_id))
+    return result.scalars().first()
+
+async def get_user_project(db: AsyncSession, project_id: str, user_id: int, load_photos: bool = True):
+    # load_photos=False for ownership checks that never touch project.photos
+    query = _project_query() if load_photos else select(models.Project)
+    result = await db.execute(
+        query.where(models.Project.id == project_id, models.Project.user_id == user_id)
+    )
+    return result.scalars().first()
+
+async def get_projects(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100, cursor: tuple = None):
+    query = keyset(_project_query().where(models.Project.user_id == user_id), models.Project, cursor)
+    result = await db.execute(query.offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def get_project_summaries(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100, cursor: tuple = None, include_photos: bool = False):
+    query = keyset(project_summary_query(user_id, include_photos), models.Project, cursor)
+    result = await db.execute(query.offset(skip).limit(limit))
+    return [project_summary(row, include_photos) for row in result.all()]
+
+async def get_project_summary(db: AsyncSession, project_id: str, user_id: int, include_photos: bool = False):
+    result = await db.execute(project_summary_query(user_id, include_photos).where(models.Project.id == project_id))
+    row = result.first()
+    return project_summary(row, include_photos) if row else None
+
+async def create_project(db: AsyncSession, project: schemas.ProjectCreate, user_id: int):
+    project_data = project.model_dump()
+    # Remove user_id if present in input (since we force it)
+    project_data.pop('user_id', None)
+
+    db_project = models.Project(**project_data, user_id=user_id, photos=[])
+    db.add(db_project)
+    await db.commit()
+    await db.refresh(db_project, ["created_at", "updated_at", "photos"])
+    await response_cache.invalidate("projects", user_id)
+    return db_project
+
+async def update_project(db: AsyncSession, project_id: str, project: schemas.ProjectCreate, user_id: int):
+    """Returns the project (photos not loaded) and the ids of the photos a rename gave new versions."""
+    db_project = await get_user_project(db, project_id, user_id, load_photos=False)
+    renamed_photo_ids = []
+    if db_project:
+        project_data = project.model_dump()
+        project_data.pop('user_id', None)
+        if project_data["name"] != db_project.name:
+            renamed_photo_ids = (await db.execute(bump_photo_revisions(project_id))).scalars().all()
+
+        for key, value in project_data.items():
+            setattr(db_project, key, value)
+        await db.commit()
+        await db.refresh(db_project, ["updated_at"])
+        await response_cache.invalidate("projects", user_id)
+    return db_project, renamed_photo_ids
+
+async def get_rendered_photo_specs(db: AsyncSession, project_id: str, user_id: int):
+    """The render_spec columns of a project's photos kept as originals, without loading whole rows."""
+    Photo = models.Photo
+    result = await db.execute(
+        select(Photo.id, Photo.filename, Photo.comment, Photo.latitude, Photo.longitude, Photo.packaging_id, Photo.overlay)
+        .where(Photo.project_id == project_id, Photo.user_id == user_id, Photo.overlay.isnot(None))
+    )
+    return result.all()
+
+async def delete_project(db: AsyncSession, project_id: str, user_id: int, transfer_project_id: str = None):
+    results = [await db.execute(statement) for statement in project_delete_statements(project_id, user_id, transfer_project_id)]
+    # Consume the RETURNING rows before committing
+    result = project_delete_result(results, transfer_project_id)
+    await db.commit()
+    await response_cache.invalidate("projects", user_id)
+    return result
+
+# --- Photos ---
+
+async def get_photos(db: AsyncSession, user_id: int, project_id: str = None, skip: int = 0, limit: int = 100, cursor: tuple = None):
+    query = select(models.Photo).where(models.Photo.user_id == user_id)
+    if project_id:
+        query = query.where(models.Photo.project_id == project_id)
+    result = await db.execute(keyset(query, models.Photo, cursor).offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def create_photos(db: AsyncSession, photos: list, user_id: int):
+    """Inserts many photos in one transaction; `photos` holds (PhotoCreate, filename, derivatives) tuples."""
+    db_photos = [
+        build_photo(photo, filename, user_id, derivatives=derivatives)
+        for photo, filename, derivatives in photos
+    ]
+    db.add_all(db_photos)
+    # The flush batches the INSERTs and fetches server defaults (created_at) via RETURNING
+    await db.commit()
+    await response_cache.invalidate("projects", user_id)
+    return db_photos
+
+async def get_photo(db: AsyncSession, photo_id: str, user_id: int):
+    result = await db.execute(
+        select(models.Photo).where(models.Photo.id == photo_id, models.Photo.user_id == user_id)
+    )
+    return result.scalars().first()
+
+async def create_photo(db: AsyncSession, photo: schemas.PhotoCreate, filename: str, user_id: int, photo_id: str = None, status: str = "ready", derivatives: dict = None):
+    db_photo = build_photo(photo, filename, user_id, photo_id=photo_id, status=status, derivatives=derivatives)
+    db.add(db_photo)
+    await db.commit()
+    await db.refresh(db_photo)
+    # Project summaries carry photo counts and cover photos
+    await response_cache.invalidate("projects", user_id)
+    return db_photo
+
+async def get_photo_by_idempotency_key(db: AsyncSession, idempotency_key: str, user_id: int):
+    # Failed ingests give up their key (see set_photo_status), so a retry with it creates a new photo
+    result = await db.execute(
+        select(models.Photo)
+        .where(models.Photo.user_id == user_id, models.Photo.idempotency_key == idempotency_key, models.Photo.status != "failed")
+    )
+    return result.scalars().first()
+
+async def get_photo_by_content_hash(db: AsyncSession, content_hash: str, user_id: int):
+    # Failed ingests don't count, so the upload can be retried
+    result = await db.execute(
+        select(models.Photo)
+        .where(models.Photo.user_id == user_id, models.Photo.content_hash == content_hash, models.Photo.status != "failed")
+        .order_by(models.Photo.created_at)
+        .limit(1)
+    )
+    return result.scalars().first()
+
+async def get_photo_by_id(db: AsyncSession, photo_id: str):
+    # Unscoped lookup for background jobs
+    return await db.get(models.Photo, photo_id)
+
+async def set_photo_status(db: AsyncSession, photo_id: str, status: str, derivatives: dict = None):
+    db_photo = await get_photo_by_id(db, photo_id)
+    if db_photo:
+        db_photo.status = status
+        if derivatives is not None:
+            db_photo.derivatives = derivatives
+        if status == "failed":
+            # Frees the Idempotency-Key (unique per user) for the client's retry
+            db_photo.idempotency_key = None
+        await db.commit()
+        await response_cache.invalidate("projects", db_photo.user_id)
+    return db_photo
+
+async def set_photo_derivatives(db: AsyncSession, photo_id: str, derivatives: dict):
+    db_photo = await get_photo_by_id(db, photo_id)
+    if db_photo:
+        # Reassign a new dict so the JSON column is flagged as changed
+        db_photo.derivatives = {**(db_photo.derivatives or {}), **derivatives}
+        await db.commit()
+        await response_cache.invalidate("projects", db_photo.user_id)
+    return db_photo
+
+async def update_photo(db: AsyncSession, db_photo: models.Photo, columns: dict, overlay: dict):
+    """Sets photo columns and overlay spec entries, bumping the revision so the photo gets a new version."""
+    for key, value in columns.items():
+        setattr(db_photo, key, value)
+    # Reassign a new dict so the JSON column is flagged as changed
+    db_photo.overlay = {**(db_photo.overlay or {}), **overlay}
+    db_photo.revision = (db_photo.revision or 0) + 1
+    await db.commit()
+    await db.refresh(db_photo)
+    await response_cache.invalidate("projects", db_photo.user_id)
+    return db_photo
+
+async def delete_photo(db: AsyncSession, photo_id: str, user_id: int):
+    db_photo = await get_photo(db, photo_id, user_id)
+    if db_photo:
+        await db.delete(db_photo)
+        await db.commit()
+        await response_cache.invalidate("projects", user_id)
+
+# --- Packaging ---
+
+async def get_packagings(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100):
+    # Retrieve system packagings (user_id is NULL) OR user's packagings
+    result = await db.execute(
+        select(models.Packaging).where(
+            (models.Packaging.user_id == None) | (models.Packaging.user_id == user_id)
+        ).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
+
+async def get_packaging(db: AsyncSession, packaging_id: str):
+    return await db.get(models.Packaging, packaging_id)
+
+async def create_packaging(db: AsyncSession, packaging: schemas.PackagingCreate, user_id: int):
+    packaging_data = packaging.model_dump()
+    packaging_data.pop('user_id', None)
+
+    db_packaging = models.Packaging(**packaging_data, user_id=user_id)
+    db.add(db_packaging)
+    await db.commit()
+    await db.refresh(db_packaging)
+    await response_cache.invalidate("packagings", user_id)
+    return db_packaging
+
+async def update_packaging(db: AsyncSession, packaging_id: str, packaging: schemas.PackagingCreate, user_id: int):
+    db_packaging = await get_packaging(db, packaging_id)
+    # Only allow updating if it belongs to the user
+    if db_packaging and db_packaging.user_id == user_id:
+        packaging_data = packaging.model_dump()
+        packaging_data.pop('user_id', None)
+
+        for key, value in packaging_data.items():
+            setattr(db_packaging, key, value)
+        await db.commit()
+        await db.refresh(db_packaging)
+        await response_cache.invalidate("packagings", user_id)
+        return db_packaging
+    return None
+
+async def delete_packaging(db: AsyncSession, packaging_id: str, user_id: int):
+    db_packaging = await get_packaging(db, packaging_id)
+    # Only allow deleting if it belongs to the user
+    if db_packaging and db_packaging.user_id == user_id:
+        await db.delete(db_packaging)
+        await db.commit()
+        await response_cache.invalidate("packagings", user_id)
+
+async def delete_user_packagings(db: AsyncSession, user_id: int):
+    await db.execute(delete(models.Packaging).where(models.Packaging.user_id == user_id))
+    await db.commit()
+    await response_cache.invalidate("packagings", user_id)
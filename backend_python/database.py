@@ -1,23 +1,104 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from google.cloud.sql.connector import Connector, IPTypes
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+import asyncio
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # Get database URL from environment variable
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional override for the asyncio engine (defaults to DATABASE_URL with the asyncpg/aiosqlite driver)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
 INSTANCE_CONNECTION_NAME = os.getenv("INSTANCE_CONNECTION_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 DB_NAME = os.getenv("DB_NAME")
 
-# Initialize connector globally to keep background refresh threads alive
-connector = Connector()
+# Connection pool tuning, shared by the Cloud SQL connector and DATABASE_URL engines
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle connections before Cloud SQL / proxies drop them for being idle
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Connections opened at startup so the first requests don't pay for the TLS handshake
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", "0"))
+
+class PoolStats:
+    """Time spent waiting for a pooled connection (including opening new ones)."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += int(timed_out)
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+# Module-level so the numbers survive the pool being recreated after a dispose()
+pool_stats = PoolStats()
+async_pool_stats = PoolStats()
+
+class _TimedPoolMixin:
+    stats = pool_stats
+
+    def connect(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.stats.record(time.perf_counter() - start, timed_out)
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    stats = pool_stats
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    stats = async_pool_stats
+
+POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+# Created on the first connection, so importing this module (or using DATABASE_URL) never
+# loads the Cloud SQL package; kept global to keep its background refresh threads alive
+connector = None
+_connector_lock = threading.Lock()
 
 def getconn():
+    global connector
+    from google.cloud.sql.connector import Connector, IPTypes
+    with _connector_lock:
+        if connector is None:
+            connector = Connector()
     conn = connector.connect(
         INSTANCE_CONNECTION_NAME,
         "pg8000",
@@ -28,21 +109,77 @@ def getconn():
     )
     return conn
 
+# The async connector is bound to the running event loop, so it is created on first use
+async_connector = None
+_async_connector_lock = asyncio.Lock()
+
+async def getconn_async():
+    global async_connector
+    from google.cloud.sql.connector import IPTypes, create_async_connector
+    async with _async_connector_lock:
+        if async_connector is None:
+            async_connector = await create_async_connector()
+    return await async_connector.connect_async(
+        INSTANCE_CONNECTION_NAME,
+        "asyncpg",
+        user=DB_USER,
+        password=DB_PASS,
+        db=DB_NAME,
+        ip_type=IPTypes.PUBLIC
+    )
+
+def to_async_url(url: str) -> str:
+    # postgresql://... or postgresql+psycopg2://... -> postgresql+asyncpg://..., sqlite://... -> sqlite+aiosqlite://...
+    scheme, _, rest = url.partition("://")
+    if scheme.startswith("sqlite"):
+        return f"sqlite+aiosqlite://{rest}"
+    return f"postgresql+asyncpg://{rest}"
+
 if INSTANCE_CONNECTION_NAME and DB_USER and DB_PASS and DB_NAME:
     # Use Cloud SQL Connector
     engine = create_engine(
         "postgresql+pg8000://",
         creator=getconn,
+        poolclass=TimedQueuePool,
+        **POOL_OPTIONS
+    )
+    async_engine = create_async_engine(
+        "postgresql+asyncpg://",
+        async_creator=getconn_async,
+        poolclass=TimedAsyncQueuePool,
+        **POOL_OPTIONS
     )
 elif SQLALCHEMY_DATABASE_URL and SQLALCHEMY_DATABASE_URL.startswith("postgresql"):
      # Standard Postgres connection string
     engine = create_engine(
-        SQLALCHEMY_DATABASE_URL
+        SQLALCHEMY_DATABASE_URL,
+        poolclass=TimedQueuePool,
+        **POOL_OPTIONS
+    )
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL or to_async_url(SQLALCHEMY_DATABASE_URL),
+        poolclass=TimedAsyncQueuePool,
+        **POOL_OPTIONS
+    )
+elif SQLALCHEMY_DATABASE_URL and SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    # Local stand-in for development and benchmarks (the async engine needs aiosqlite)
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=TimedQueuePool,
+        **POOL_OPTIONS
+    )
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL or to_async_url(SQLALCHEMY_DATABASE_URL),
+        poolclass=TimedAsyncQueuePool,
+        **POOL_OPTIONS
     )
 else:
-    raise ValueError("No PostgreSQL database configuration found. Please set DATABASE_URL or Cloud SQL environment variables.")
+    raise ValueError("No database configuration found. Please set DATABASE_URL (PostgreSQL, or SQLite for local use) or Cloud SQL environment variables.")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: expired attributes would need an implicit (blocking) reload under asyncio
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -52,3 +189,42 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def warm_pool(count: int = DB_POOL_WARMUP) -> int:
+    """Opens up to `count` connections and returns them to the pool; returns how many were opened."""
+    # Connections beyond pool_size would be closed again on return
+    count = min(count, DB_POOL_SIZE)
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for conn in connections:
+            conn.close()
+    return len(connections)
+
+def _pool_status(pool, stats: PoolStats) -> dict:
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        **stats.snapshot(),
+    }
+
+def pool_status() -> dict:
+    status = _pool_status(engine.pool, pool_stats)
+    status["async"] = _pool_status(async_engine.pool, async_pool_stats)
+    return status
+
+async def close_connectors():
+    """Stops the Cloud SQL connectors' refresh tasks, if they were ever created."""
+    if async_connector is not None:
+        await async_connector.close_async()
+    if connector is not None:
+        await asyncio.to_thread(connector.close)
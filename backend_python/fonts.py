@@ -0,0 +1,65 @@
+from PIL import ImageFont
+import os
+import threading
+
+from asset_cache import ASSETS_DIR
+from caching import LRUCache
+
+FONTS_DIR = os.path.join(ASSETS_DIR, "fonts")
+# Bundled so captions render identically on every host
+BUNDLED_FONT = os.path.join(FONTS_DIR, "DejaVuSans.ttf")
+# Optional override, e.g. a font covering scripts DejaVu lacks
+FONT_PATH = os.getenv("PHOTO_FONT_PATH") or BUNDLED_FONT
+# Font sizes are rounded to a multiple of this so nearby photo sizes share a loaded font
+FONT_SIZE_BUCKET = max(1, int(os.getenv("PHOTO_FONT_SIZE_BUCKET", "4")))
+# Measured (text, size) pairs kept per process
+TEXT_LAYOUT_CACHE_SIZE = int(os.getenv("TEXT_LAYOUT_CACHE_SIZE", "1024"))
+
+class FontManager:
+    """
+    Loads the caption font once per process, keeps a FreeTypeFont per bucketed size
+    and memoizes text measurements, which repeat across photos (project names,
+    packaging names, timestamps with the same layout).
+    """
+
+    def __init__(self, path: str = FONT_PATH, bucket: int = FONT_SIZE_BUCKET, layout_cache_size: int = TEXT_LAYOUT_CACHE_SIZE):
+        self.path = path
+        self.bucket = bucket
+        self.layouts = LRUCache(layout_cache_size)
+        self._fonts = {}
+        self._lock = threading.Lock()
+
+    def bucket_size(self, size: float) -> int:
+        return max(self.bucket, int(round(size / self.bucket)) * self.bucket)
+
+    def font(self, size: int) -> ImageFont.FreeTypeFont:
+        size = self.bucket_size(size)
+        font = self._fonts.get(size)
+        if font is None:
+            with self._lock:
+                font = self._fonts.get(size)
+                if font is None:
+                    try:
+                        font = ImageFont.truetype(self.path, size)
+                    except OSError as e:
+                        # Only reachable with a bad PHOTO_FONT_PATH; keep rendering with the bundled font
+                        print(f"Error loading font {self.path}: {e}")
+                        font = ImageFont.truetype(BUNDLED_FONT, size)
+                    self._fonts[size] = font
+        return font
+
+    def text_size(self, text: str, size: int) -> tuple:
+        """Returns (width, height) of `text`'s bounding box at the bucketed `size`."""
+        size = self.bucket_size(size)
+        key = (text, size)
+        measured = self.layouts.get(key)
+        if measured is None:
+            left, top, right, bottom = self.font(size).getbbox(text)
+            measured = (right - left, bottom - top)
+            self.layouts.set(key, measured)
+        return measured
+
+    def stats(self) -> dict:
+        return {"fonts": sorted(self._fonts), "layouts": self.layouts.stats()}
+
+font_manager = FontManager()
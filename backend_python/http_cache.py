@@ -0,0 +1,90 @@
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+import os
+
+from storage import file_version
+
+# For URLs whose content can never change (versioned or uniquely named files)
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# For stable URLs: clients may keep the file but must revalidate it with the ETag
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+def etag_for(filename: str) -> str:
+    return f'"{file_version(filename)}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+def _parse_range(range_header: str, size: int):
+    """Parses a single `bytes=` range; returns (start, end) inclusive, None if unsatisfiable, or False to ignore it."""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        # Multiple ranges are allowed to be answered with the full body
+        return False
+    start_str, _, end_str = spec.strip().partition("-")
+    try:
+        if start_str == "":
+            # Suffix range: the last N bytes
+            length = int(end_str)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(start_str)
+        end = int(end_str) if end_str else size - 1
+    except ValueError:
+        return False
+    if start >= size or start > end:
+        return None
+    return start, min(end, size - 1)
+
+def cached_file_response(request: Request, store, name: str, stat, etag: str, cache_control: str, media_type: str = "image/jpeg") -> Response:
+    """
+    Serves the stored file `name` (whose `stat` the caller looked up off the event loop)
+    with a strong ETag, Last-Modified and Cache-Control, answering If-None-Match /
+    If-Modified-Since with 304 and single byte ranges with 206.
+    """
+    if etag_matches(request, etag):
+        return not_modified(etag, cache_control)
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and "if-none-match" not in request.headers:
+        try:
+            if int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp():
+                return not_modified(etag, cache_control)
+        except (TypeError, ValueError):
+            pass
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == etag):
+        byte_range = _parse_range(range_header, stat.st_size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(store.iter_range(name, start, end), status_code=206, headers=headers, media_type=media_type)
+
+    path = store.local_path(name)
+    if path and isinstance(stat, os.stat_result):
+        # Local files go out through FileResponse (sendfile where the server supports it)
+        return FileResponse(path, headers=headers, media_type=media_type, stat_result=stat)
+    headers["Content-Length"] = str(stat.st_size)
+    return StreamingResponse(store.iter_range(name, 0, stat.st_size - 1), headers=headers, media_type=media_type)
@@ -1,13 +1,82 @@
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+from PIL import Image, ImageDraw, ImageOps
 import io
 from datetime import datetime
 from typing import List, Dict, Any, Tuple
 import math
 import os
+import time
 import schemas
+from storage import atomic_path
+from output_policy import OutputPolicy, OUTPUT_POLICY, DERIVATIVE_SIZES, derivative_filename
+from asset_cache import asset_cache, package_key, sticker_key, STICKERS_DIR, PACKAGES_DIR
+from packaging_catalog import packaging_catalog
+from fonts import font_manager
 
-# Path to stickers directory
-STICKERS_DIR = os.path.join(os.path.dirname(__file__), "assets", "stickers")
+def lap(timings: Dict[str, float] | None, name: str, start: float) -> float:
+    """Adds the ms since `start` to timings[name] (if given) and returns the current time."""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + (now - start) * 1000
+    return now
+
+def load_scaled(img: Image.Image, max_edge: int, timings: Dict[str, float] | None = None) -> Image.Image:
+    """
+    EXIF-transposes `img` and shrinks it so its long edge fits `max_edge`.
+    JPEGs are decoded with draft() at a reduced DCT scale when the target is smaller than the source.
+    """
+    mark = time.perf_counter()
+    src_w, src_h = img.size
+    if max_edge and max(src_w, src_h) > max_edge:
+        scale = max_edge / max(src_w, src_h)
+        # Picks the smallest 1/2, 1/4 or 1/8 decode scale that still covers the target size
+        img.draft("RGB", (math.ceil(src_w * scale), math.ceil(src_h * scale)))
+    img.load()
+    mark = lap(timings, "decode", mark)
+
+    # Handle EXIF orientation
+    img = ImageOps.exif_transpose(img)
+    mark = lap(timings, "exif_transpose", mark)
+    if max_edge and max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    lap(timings, "resize", mark)
+    return img
+
+def write_derivatives(img: Image.Image, output_path: str, sizes: Dict[str, int], policy: OutputPolicy | None = None) -> Dict[str, str]:
+    """Writes a downscaled copy of `img` next to `output_path` for each size; returns {name: filename}."""
+    policy = policy or OUTPUT_POLICY
+    directory, filename = os.path.split(output_path)
+    written = {}
+    # Largest first, so each rendition is reduced from the previous one
+    current = img
+    for name, edge in sorted(sizes.items(), key=lambda item: -item[1]):
+        if max(current.size) > edge:
+            current = current.copy()
+            current.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        derivative = derivative_filename(filename, name)
+        with atomic_path(os.path.join(directory, derivative)) as tmp_path:
+            current.save(tmp_path, **policy.save_kwargs())
+        written[name] = derivative
+    return written
+
+def generate_derivatives(source_path: str, sizes: Dict[str, int] | None = None, policy: OutputPolicy | None = None, output_path: str | None = None) -> Dict[str, str]:
+    """
+    Backfills derivatives for an already processed photo on disk. They are named and
+    placed after `output_path` when given, otherwise next to `source_path`.
+    """
+    sizes = DERIVATIVE_SIZES if sizes is None else sizes
+    if not sizes:
+        return {}
+    with Image.open(source_path) as img:
+        img = load_scaled(img, max(sizes.values()))
+        return write_derivatives(img.convert("RGB"), output_path or source_path, sizes, policy)
+
+def scale_sticker(sticker_data: Dict[str, Any], factor: float) -> Dict[str, Any]:
+    # Sticker geometry is sent in source pixel coordinates
+    scaled = dict(sticker_data)
+    for key in ("x", "y", "width", "height"):
+        if key in scaled:
+            scaled[key] = scaled[key] * factor
+    return scaled
 
 def draw_sticker(base_img: Image.Image, sticker_data: Dict[str, Any]):
     # Extract data
@@ -27,54 +96,56 @@ def draw_sticker(base_img: Image.Image, sticker_data: Dict[str, Any]):
             print(f"Packaging sticker missing required fields: packagingId={packaging_id}, packagingFilename={packaging_filename}")
             return
             
-        # Determine path based on packaging type
-        if packaging_id.startswith("builtin:"):
-            filepath = os.path.join(PACKAGES_DIR, "builtin", packaging_filename)
-        else:
-            # Custom packaging
-            filepath = os.path.join(PACKAGES_DIR, "custom", packaging_filename)
+        # Determine asset based on packaging type
+        source = "builtin" if packaging_id.startswith("builtin:") else "custom"
+        key = package_key(source, packaging_filename)
     else:
         # Determine image filename for arrow/dpt stickers
         filename = "arrow.png" if s_type == "arrow" else "dpt.png"
-        filepath = os.path.join(STICKERS_DIR, filename)
-    
-    if not os.path.exists(filepath):
-        print(f"Sticker file not found: {filepath}")
+        key = sticker_key(filename)
+
+    if w <= 0 or h <= 0:
         return
 
     try:
-        with Image.open(filepath) as sticker_img:
-            sticker_img = sticker_img.convert("RGBA")
-            
-            # Resize
-            # Use LANCZOS for high quality downscaling/upscaling
-            sticker_img = sticker_img.resize((w, h), resample=Image.Resampling.LANCZOS)
-            
-            # Rotate
-            # expand=True allows the image to grow to fit the rotated content
-            rotated = sticker_img.rotate(-rot, resample=Image.Resampling.BICUBIC, expand=True)
-            
-            # Calculate paste position (centered)
-            # The rotated image size might be different from original w,h
-            rw, rh = rotated.size
-            
-            # Original center was at x + w/2, y + h/2
-            cx = x + w/2
-            cy = y + h/2
-            
-            paste_x = int(cx - rw/2)
-            paste_y = int(cy - rh/2)
+        # Resized and rotated variants come from the shared asset cache
+        rotated = asset_cache.sticker(key, w, h, rot)
+        if rotated is None:
+            print(f"Sticker file not found: {key}")
+            return
             
-            # Paste with alpha composite
-            base_img.alpha_composite(rotated, (paste_x, paste_y))
+        # Calculate paste position (centered)
+        # The rotated image size might be different from original w,h
+        rw, rh = rotated.size
+        
+        # Original center was at x + w/2, y + h/2
+        cx = x + w/2
+        cy = y + h/2
+        
+        paste_x = int(cx - rw/2)
+        paste_y = int(cy - rh/2)
+        
+        # Paste through the sticker's alpha; only its bounding box is touched
+        base_img.paste(rotated, (paste_x, paste_y), rotated)
             
     except Exception as e:
         print(f"Error drawing sticker {s_type}: {e}")
 
-PACKAGES_DIR = os.path.join(os.path.dirname(__file__), "assets", "packages")
+def caption_font_size(height: int) -> int:
+    # Double the font size for the strip; bucketed so similar photo sizes share a cached font
+    return font_manager.bucket_size(max(32, height / 30))
+
+def label_height(font_size: int) -> int:
+    # Packaging labels are 1.3x the font size
+    return int(font_size * 1.3)
+
+def common_label_heights(policy: OutputPolicy | None = None) -> List[int]:
+    """Label heights for photos at the output size in 4:3, 3:4 and 16:9, which workers pre-scale."""
+    edge = (policy or OUTPUT_POLICY).max_edge or 4032
+    return sorted({label_height(caption_font_size(h)) for h in (edge, edge * 3 // 4, edge * 9 // 16)})
 
-async def composite_image(
-    image_data: bytes,
+def composite_image(
+    image_source: str | bytes,
     comment: str | None,
     stickers: List[Dict[str, Any]],
     latitude: float | None,
@@ -82,39 +153,49 @@ async def composite_image(
     project_name: str,
     captured_at: str | None,
     packaging_info: Dict[str, str] | None = None,
-    hide_date: bool = False
-) -> bytes:
-    
-    # Load image
-    with Image.open(io.BytesIO(image_data)) as img:
-        # Handle EXIF orientation
-        img = ImageOps.exif_transpose(img)
+    hide_date: bool = False,
+    output_path: str | None = None,
+    policy: OutputPolicy | None = None,
+    derivative_sizes: Dict[str, int] | None = None,
+    timings: Dict[str, float] | None = None
+) -> bytes | Dict[str, str]:
+    """
+    Renders stickers and the text strip onto the photo at `image_source` (a path or raw bytes).
+    Writes the JPEG atomically to `output_path` when given, together with any `derivative_sizes`,
+    and returns the derivative filenames; otherwise returns the JPEG bytes.
+    Per-stage durations in ms are added to `timings` when a dict is passed.
+    """
+    policy = policy or OUTPUT_POLICY
+    if isinstance(image_source, (bytes, bytearray)):
+        image_source = io.BytesIO(image_source)
+
+    # Load image (Pillow reads lazily from the file on disk)
+    with Image.open(image_source) as img:
+        source_edge = max(img.size)
+        img = load_scaled(img, policy.max_edge, timings)
+
+        # Stickers were placed on the full-size photo
+        factor = max(img.size) / source_edge
+        if factor != 1:
+            stickers = [scale_sticker(s, factor) for s in stickers]
         
-        # Convert to RGBA for compositing
-        img = img.convert("RGBA")
+        # Everything is drawn in place on the RGB photo: stickers and labels are pasted through
+        # their own alpha, so no full-frame RGBA copy or overlay layer is needed
+        if img.mode != "RGB":
+            img = img.convert("RGB")
         width, height = img.size
-        
-        # Create overlay layer
-        overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(overlay)
+        draw = ImageDraw.Draw(img)
         
         # --- Stickers ---
+        mark = time.perf_counter()
         for sticker_data in stickers:
             draw_sticker(img, sticker_data)
+        mark = lap(timings, "stickers", mark)
         
         # --- Text Overlays ---
         # Font setup
-        # Double the font size for the strip
-        font_size = int(max(32, height / 30))
-        try:
-            # Try to load a standard font, fallback to default
-            font = ImageFont.truetype("Arial.ttf", font_size)
-        except IOError:
-            try:
-                font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", font_size)
-            except IOError:
-                 # Fallback for linux/docker if needed, or just default
-                font = ImageFont.load_default()
+        font_size = caption_font_size(height)
+        font = font_manager.font(font_size)
         
         # Helper to draw text box with mixed content (text + images)
         def draw_text_box(content_parts: list, bottom_y: int, align: str = "left"):
@@ -131,35 +212,24 @@ async def composite_image(
             for part in content_parts:
                 if part['type'] == 'text':
                     text = part['value']
-                    bbox = draw.textbbox((0, 0), text, font=font)
-                    w = bbox[2] - bbox[0]
-                    h = bbox[3] - bbox[1]
+                    w, h = font_manager.text_size(text, font_size)
                     # Ensure minimum height for text (based on font size)
                     h = max(h, font_size)
                     items.append({'type': 'text', 'obj': text, 'w': w, 'h': h})
                     total_width += w
                     max_height = max(max_height, h)
                 elif part['type'] == 'image':
-                    filename = part['value']
-                    source = part.get('source', 'custom')
-                    subdir = "builtin" if source == "builtin" else "custom"
-                    path = os.path.join(PACKAGES_DIR, subdir, filename)
-                    
-                    if os.path.exists(path):
-                        try:
-                            p_img = Image.open(path).convert("RGBA")
-                            # Target height: 1.3x font size
-                            target_h = int(font_size * 1.3)
-                            aspect = p_img.width / p_img.height
-                            target_w = int(target_h * aspect)
-                            
-                            p_img = p_img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-                            items.append({'type': 'image', 'obj': p_img, 'w': target_w, 'h': target_h})
-                            total_width += target_w
-                            max_height = max(max_height, target_h)
-                        except Exception as e:
-                            print(f"Error loading package image: {e}")
-                            pass
+                    source = "builtin" if part.get('source') == "builtin" else "custom"
+                    try:
+                        # Pre-scaled by the catalog for the usual photo sizes
+                        p_img = packaging_catalog.label(source, part['value'], label_height(font_size))
+                    except Exception as e:
+                        print(f"Error loading package image: {e}")
+                        p_img = None
+                    if p_img is not None:
+                        items.append({'type': 'image', 'obj': p_img, 'w': p_img.width, 'h': p_img.height})
+                        total_width += p_img.width
+                        max_height = max(max_height, p_img.height)
 
             if len(items) > 1:
                 total_width += spacing * (len(items) - 1)
@@ -192,7 +262,7 @@ async def composite_image(
                 if item['type'] == 'text':
                     draw.text((current_x, item_y), item['obj'], font=font, fill=(255, 255, 255, 255))
                 elif item['type'] == 'image':
-                    overlay.alpha_composite(item['obj'], (int(current_x), int(item_y)))
+                    img.paste(item['obj'], (int(current_x), int(item_y)), item['obj'])
                 
                 current_x += item['w']
                 if i < len(items) - 1:
@@ -241,11 +311,21 @@ async def composite_image(
             h_used = draw_text_box([{'type': 'text', 'value': loc_str}], current_y, align="left")
             current_y -= h_used
 
-        # Composite
-        img.alpha_composite(overlay)
-        
+        mark = lap(timings, "text", mark)
+
+        if output_path:
+            # Encode straight into the destination directory, then rename into place
+            with atomic_path(output_path) as tmp_path:
+                img.save(tmp_path, **policy.save_kwargs())
+                mark = lap(timings, "encode", mark)
+            mark = lap(timings, "write", mark)
+            # Downscaling the in-memory composite is far cheaper than decoding the JPEG again
+            derivatives = write_derivatives(img, output_path, derivative_sizes or {}, policy)
+            lap(timings, "derivatives", mark)
+            return derivatives
+
         # Save to buffer
         output = io.BytesIO()
-        img = img.convert("RGB") # Convert back to RGB for JPEG
-        img.save(output, format="JPEG", quality=95)
+        img.save(output, **policy.save_kwargs())
+        lap(timings, "encode", mark)
         return output.getvalue()
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import time
+
+import crud_async
+from database import AsyncSessionLocal
+from compositing import run_composite, CompositingBusy, COMPOSITE_RETRY_AFTER
+from storage import write_stream, remove_files, photo_storage
+from output_policy import DERIVATIVE_SIZES
+
+# "sync" composites during the upload request, "async" stores the raw upload and answers 202
+PHOTO_INGEST_MODE = os.getenv("PHOTO_INGEST_MODE", "sync")
+# Directory holding raw uploads and their job files until they are composited
+INGEST_DIR = os.getenv("INGEST_DIR", os.path.join("uploads", "incoming"))
+# Number of jobs processed concurrently by this process
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Claimed jobs not touched for this long are assumed orphaned by a crashed or restarted process
+# and retried; the process running a job refreshes its claim every quarter of this
+INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", "60"))
+# Seconds between scans of INGEST_DIR for orphaned jobs and jobs queued by other processes
+INGEST_RECOVER_INTERVAL = int(os.getenv("INGEST_RECOVER_INTERVAL", "30"))
+
+class IngestQueue:
+    """
+    Durable local job queue for deferred compositing.
+
+    Each job is a `<photo_id>.raw` upload plus a `<photo_id>.json` spec written atomically
+    to INGEST_DIR. A worker claims a job by renaming the spec to `.working` and keeps its
+    mtime fresh while it runs; jobs left on disk, and claims that went stale, are picked
+    up again by the periodic recovery scan.
+    """
+
+    def __init__(self, directory: str = INGEST_DIR, workers: int = INGEST_WORKERS):
+        self.directory = directory
+        self.workers = max(1, workers)
+        self._queue = None
+        self._tasks = []
+        self._events = {}
+        self._queued = set()
+
+    def raw_path(self, photo_id: str) -> str:
+        return os.path.join(self.directory, f"{photo_id}.raw")
+
+    def _job_path(self, photo_id: str, suffix: str = ".json") -> str:
+        return os.path.join(self.directory, f"{photo_id}{suffix}")
+
+    def store_raw(self, photo_id: str, src, hasher=None) -> int:
+        """Streams the file-like upload `src` to the job's raw path."""
+        return write_stream(src, self.raw_path(photo_id), hasher=hasher)
+
+    def write_job(self, photo_id: str, job: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._job_path(photo_id, ".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._job_path(photo_id))
+
+    def discard(self, photo_id: str):
+        """Removes a job that was written but never committed (its upload turned out to be a duplicate)."""
+        remove_files([self._job_path(photo_id), self.raw_path(photo_id)])
+
+    def enqueue(self, photo_id: str):
+        if self._queue is not None and photo_id not in self._queued:
+            self._queued.add(photo_id)
+            self._queue.put_nowait(photo_id)
+
+    def _recover(self):
+        if not os.path.isdir(self.directory):
+            return []
+        now = time.time()
+        jobs = []
+        for entry in os.scandir(self.directory):
+            photo_id, ext = os.path.splitext(entry.name)
+            if ext not in (".json", ".working"):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+                if ext == ".working" and now - mtime > INGEST_STALE_SECONDS:
+                    os.replace(entry.path, self._job_path(photo_id))
+                    ext = ".json"
+            except FileNotFoundError:
+                # Claimed or finished by another process meanwhile
+                continue
+            # A fresh spec may belong to an upload whose row isn't committed yet; its request enqueues it
+            if ext == ".json" and now - mtime > INGEST_STALE_SECONDS / 4:
+                jobs.append((mtime, photo_id))
+        return [photo_id for _, photo_id in sorted(jobs)]
+
+    async def _recover_periodically(self):
+        while True:
+            await asyncio.sleep(INGEST_RECOVER_INTERVAL)
+            try:
+                recovered = await asyncio.to_thread(self._recover)
+            except Exception as e:
+                print(f"Error scanning ingest jobs: {e}")
+                continue
+            for photo_id in recovered:
+                self.enqueue(photo_id)
+
+    async def start(self):
+        await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+        self._queue = asyncio.Queue()
+        recovered = await asyncio.to_thread(self._recover)
+        if recovered:
+            print(f"Recovered {len(recovered)} pending ingest jobs")
+        for photo_id in recovered:
+            self.enqueue(photo_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recover_periodically()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._queued.clear()
+
+    async def wait_for(self, photo_id: str, timeout: float):
+        """Waits until the job for `photo_id` finishes in this process, or the timeout expires."""
+        # Shared by the long-polls of one photo and dropped by the last of them to leave, so
+        # jobs finished elsewhere (or never) leave nothing behind
+        waiting = self._events.setdefault(photo_id, [asyncio.Event(), 0])
+        waiting[1] += 1
+        try:
+            await asyncio.wait_for(waiting[0].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiting[1] -= 1
+            if not waiting[1]:
+                del self._events[photo_id]
+
+    def _notify(self, photo_id: str):
+        # Only long-polls in progress have an event to set
+        waiting = self._events.get(photo_id)
+        if waiting:
+            waiting[0].set()
+
+    async def _worker(self):
+        while True:
+            photo_id = await self._queue.get()
+            self._queued.discard(photo_id)
+            try:
+                await self._process(photo_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ingest job {photo_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _claim(self, photo_id: str):
+        """Claims the job and returns its spec, or None if another worker got it first."""
+        working_path = self._job_path(photo_id, ".working")
+        try:
+            # Claiming by rename keeps other processes from running the same job; the rename keeps
+            # the spec's mtime, so the claim is refreshed at once or a backlogged job would look stale
+            os.replace(self._job_path(photo_id), working_path)
+            os.utime(working_path)
+        except FileNotFoundError:
+            return None
+        with open(working_path) as f:
+            return json.load(f)
+
+    def _unclaim(self, photo_id: str):
+        os.replace(self._job_path(photo_id, ".working"), self._job_path(photo_id))
+
+    async def _process(self, photo_id: str):
+        job = await asyncio.to_thread(self._claim, photo_id)
+        if job is None:
+            return
+
+        photo = await _get_photo(photo_id)
+        if photo is None:
+            # Upload was never committed or the photo was deleted meanwhile
+            await asyncio.to_thread(self._cleanup, photo_id)
+            return
+
+        filename = job["filename"]
+        heartbeat = asyncio.create_task(self._heartbeat(self._job_path(photo_id, ".working")))
+        try:
+            derivatives = await run_composite(
+                self.raw_path(photo_id),
+                job["comment"],
+                job["stickers"],
+                job["latitude"],
+                job["longitude"],
+                job["project_name"],
+                job["captured_at"],
+                job["packaging_info"],
+                job["hide_date"],
+                output_path=photo_storage.staging_path(filename),
+                derivative_sizes=DERIVATIVE_SIZES
+            )
+            await asyncio.to_thread(photo_storage.publish, [filename, *derivatives.values()])
+        except CompositingBusy:
+            # Pool is saturated by synchronous uploads; put the job back and retry later
+            await asyncio.to_thread(self._unclaim, photo_id)
+            await asyncio.sleep(COMPOSITE_RETRY_AFTER)
+            self.enqueue(photo_id)
+            return
+        except Exception as e:
+            print(f"Error compositing photo {photo_id}: {e}")
+            await _set_status(photo_id, "failed")
+            await asyncio.to_thread(self._cleanup, photo_id)
+            self._notify(photo_id)
+            return
+        finally:
+            heartbeat.cancel()
+
+        await _set_status(photo_id, "ready", derivatives)
+        await asyncio.to_thread(self._cleanup, photo_id)
+        self._notify(photo_id)
+
+    async def _heartbeat(self, working_path: str):
+        # Keeps the claim fresh so recovery scans don't hand a running job to another worker
+        while True:
+            await asyncio.sleep(INGEST_STALE_SECONDS / 4)
+            try:
+                await asyncio.to_thread(os.utime, working_path)
+            except OSError:
+                return
+
+    def _cleanup(self, photo_id: str):
+        for path in (self._job_path(photo_id, ".working"), self.raw_path(photo_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+async def _get_photo(photo_id: str):
+    async with AsyncSessionLocal() as db:
+        return await crud_async.get_photo_by_id(db, photo_id)
+
+async def _set_status(photo_id: str, status: str, derivatives: dict = None):
+    async with AsyncSessionLocal() as db:
+        await crud_async.set_photo_status(db, photo_id, status, derivatives)
+
+ingest_queue = IngestQueue()
@@ -1,21 +1,65 @@
+import time
+
+# Measured from the first line so the startup report includes importing the app
+IMPORT_START = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+import asyncio
 import os
 
-import models
+import metrics
 import seed
-from database import engine
+from database import engine, async_engine, warm_pool, pool_status, close_connectors, DB_POOL_WARMUP
+from compositing import compositing_executor
+from http_cache import cached_file_response, etag_for, IMMUTABLE_CACHE_CONTROL
+from storage import photo_storage
+from ingest_queue import ingest_queue
 from routers import projects, photos, packagings, auth
 
-# Create tables
-models.Base.metadata.create_all(bind=engine)
+# Create tables and apply column/index migrations at startup. Turn off on autoscaled replicas
+# and run `python seed.py` once per release instead, so new instances skip the schema checks
+STARTUP_MIGRATE = os.getenv("STARTUP_MIGRATE", "true").lower() in ("1", "true", "yes")
+# Create the default user and builtin packagings at startup
+STARTUP_SEED = os.getenv("STARTUP_SEED", "true").lower() in ("1", "true", "yes")
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_START
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Importing main has no side effects; the database and queue work happens here, timed per step
+    timings = {"import": IMPORT_SECONDS * 1000}
+    steps = [
+        ("migrate", STARTUP_MIGRATE, lambda: asyncio.to_thread(seed.migrate)),
+        ("seed", STARTUP_SEED, lambda: asyncio.to_thread(seed.seed_data)),
+        # Pre-open DB connections so the first requests skip the connection handshake
+        ("warm_pool", DB_POOL_WARMUP > 0, lambda: asyncio.to_thread(warm_pool)),
+        ("ingest_queue", True, ingest_queue.start),
+    ]
+    for name, enabled, step in steps:
+        if enabled:
+            start = time.perf_counter()
+            await step()
+            timings[name] = (time.perf_counter() - start) * 1000
+    # Sticker and packaging assets are decoded by each compositing worker, not by this process
+    app.state.startup_timings = {name: round(ms, 1) for name, ms in timings.items()}
+    metrics.record_stages("startup", timings)
+    breakdown = ", ".join(f"{name} {ms:.0f}" for name, ms in timings.items())
+    print(f"Startup took {sum(timings.values()):.0f} ms ({breakdown})")
+
+    yield
 
-# Seed initial data
-seed.init_db()
+    await ingest_queue.stop()
+    compositing_executor.shutdown()
+    # Pooled connections are closed explicitly: aiosqlite's connection threads aren't daemons and would keep the process alive
+    await async_engine.dispose()
+    await asyncio.to_thread(engine.dispose)
+    await close_connectors()
 
-app = FastAPI(title="AuditLens Builder API")
+app = FastAPI(title="AuditLens Builder API", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -24,8 +68,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Content-Range", "X-Next-Cursor", "Idempotent-Replayed"],
 )
 
+# Added last so it wraps CORS and times the whole request
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # Include API routers FIRST - before any catch-all routes
 app.include_router(auth.router)
 app.include_router(projects.router)
@@ -36,9 +85,30 @@ app.include_router(packagings.router)
 def health_check():
     return {"status": "ok"}
 
-# Mount uploads directory
-os.makedirs("uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+@app.get("/health/startup")
+def startup_timings(request: Request):
+    # Milliseconds spent in each startup step of this process
+    return request.app.state.startup_timings
+
+@app.get("/health/db-pool")
+def db_pool_stats():
+    return pool_status()
+
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def prometheus_metrics():
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# Processed files by name, served from the storage backend; names are unique, so responses never change
+@app.get("/uploads/{filename}")
+async def serve_upload(request: Request, filename: str):
+    try:
+        stat = await asyncio.to_thread(photo_storage.stat, filename)
+    except ValueError:
+        stat = None
+    if stat is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return cached_file_response(request, photo_storage, filename, stat, etag_for(filename), IMMUTABLE_CACHE_CONTROL)
 
 # Serve static files from the built frontend
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "dist", "public")
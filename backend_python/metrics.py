@@ -0,0 +1,184 @@
+import bisect
+import os
+import threading
+import time
+
+# Set to false to drop the request middleware, stage timers and the /metrics endpoint
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Histogram bucket upper bounds in seconds
+METRICS_BUCKETS = tuple(sorted(
+    float(bound) for bound in os.getenv("METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30").split(",")
+))
+
+# Starlette appends "; charset=utf-8" to text/ media types
+CONTENT_TYPE = "text/plain; version=0.0.4"
+# Scope key holding the perf_counter() at which the middleware saw the request
+REQUEST_START = "metrics.request_start"
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _family(name: str, kind: str, help: str, samples: list) -> list:
+    """Text lines of one metric family from (labels dict, value) samples."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return lines
+
+class Histogram:
+    """
+    Prometheus histogram keyed by label values. observe() is a bisect and a few
+    additions under a lock, cheap enough to run on every request.
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple = METRICS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {} # label values -> [per-bucket counts (last is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *label_values):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def render(self) -> list:
+        with self._lock:
+            series = [(values, list(counts), total) for values, (counts, total) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _labels(self.labels, values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {cumulative}")
+        return lines
+
+request_duration = Histogram(
+    "auditlens_http_request_duration_seconds",
+    "HTTP request latency by route template, until the last body chunk is sent.",
+    ("method", "route", "status"),
+)
+stage_duration = Histogram(
+    "auditlens_stage_duration_seconds",
+    "Duration of the stages of an operation (an upload, or a composite in a worker).",
+    ("operation", "stage"),
+)
+
+def record_stages(operation: str, timings_ms: dict):
+    """Records a composite_image-style {stage: milliseconds} dict."""
+    if METRICS_ENABLED:
+        for stage, ms in timings_ms.items():
+            stage_duration.observe(ms / 1000, operation, stage)
+
+def record_since_request(scope: dict, operation: str, stage: str):
+    """Records the time since the middleware received the request, e.g. multipart parsing before the endpoint runs."""
+    start = scope.get(REQUEST_START)
+    if start is not None:
+        stage_duration.observe(time.perf_counter() - start, operation, stage)
+
+class stage_timer:
+    """`with stage_timer("upload", "db_insert"):` records the block's duration."""
+
+    __slots__ = ("operation", "stage", "start")
+
+    def __init__(self, operation: str, stage: str):
+        self.operation = operation
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if METRICS_ENABLED:
+            stage_duration.observe(time.perf_counter() - self.start, self.operation, self.stage)
+        return False
+
+class MetricsMiddleware:
+    """ASGI middleware observing request_duration, labelled by route template to keep cardinality bounded."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = {}
+
+    def _route(self, scope: dict) -> str:
+        # The router stores the matched endpoint in the scope; map it back to its path template
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._routes.get(endpoint)
+        if path is None and "router" in scope:
+            self._routes = {getattr(route, "endpoint", getattr(route, "app", None)): route.path for route in scope["router"].routes}
+            path = self._routes.get(endpoint)
+        return path or "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        scope[REQUEST_START] = start
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_duration.observe(time.perf_counter() - start, scope["method"], self._route(scope), str(status))
+
+# (metric, type, help, pool_status() key, scale) for each pool gauge, labelled by engine
+POOL_METRICS = [
+    ("auditlens_db_pool_size", "gauge", "Connections kept open by the pool.", "size", 1),
+    ("auditlens_db_pool_checked_out", "gauge", "Connections currently in use.", "checked_out", 1),
+    ("auditlens_db_pool_overflow", "gauge", "Connections open beyond pool_size.", "overflow", 1),
+    ("auditlens_db_pool_checkouts_total", "counter", "Connections handed out by the pool.", "checkouts", 1),
+    ("auditlens_db_pool_timeouts_total", "counter", "Checkouts that timed out waiting for a connection.", "timeouts", 1),
+    ("auditlens_db_pool_max_wait_seconds", "gauge", "Longest wait for a connection since startup.", "max_wait_ms", 0.001),
+]
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    # Imported here because compositing imports this module for its stage timings
+    from compositing import compositing_executor
+    from database import pool_status
+    from rendering import render_cache
+
+    lines = request_duration.render() + stage_duration.render()
+    status = pool_status()
+    pools = {"sync": status, "async": status["async"]}
+    for name, kind, help, key, scale in POOL_METRICS:
+        lines += _family(name, kind, help, [({"engine": engine}, pool[key] * scale) for engine, pool in pools.items()])
+
+    executor = compositing_executor.stats()
+    lines += _family("auditlens_compositing_workers", "gauge", "Compositing worker processes.", [({}, executor["workers"])])
+    lines += _family("auditlens_compositing_in_flight", "gauge", "Compositing jobs running or waiting.", [({}, executor["in_flight"])])
+    lines += _family("auditlens_compositing_queued", "gauge", "Compositing jobs waiting for a worker.", [({}, executor["queued"])])
+    lines += _family("auditlens_compositing_capacity", "gauge", "Jobs admitted before uploads get 503.", [({}, compositing_executor.capacity)])
+    lines += _family("auditlens_compositing_rejected_total", "counter", "Jobs rejected because the queue was full.", [({}, executor["rejected"])])
+
+    renders = render_cache.stats()
+    lines += _family("auditlens_render_cache_files", "gauge", "Rendered composites kept on disk.", [({}, renders["files"])])
+    lines += _family("auditlens_render_cache_bytes", "gauge", "Disk space used by rendered composites.", [({}, renders["bytes"])])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,50 @@
+import re
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+
+import models
+
+# create_all only creates missing tables, so columns added to existing tables are listed here.
+# Each entry is (table, column, column DDL) and is applied only when the column is missing.
+COLUMN_MIGRATIONS = [
+    ("photos", "status", "VARCHAR NOT NULL DEFAULT 'ready'"),
+    ("photos", "derivatives", "JSON"),
+    ("photos", "content_hash", "VARCHAR(64)"),
+    ("photos", "idempotency_key", "VARCHAR(255)"),
+    ("photos", "overlay", "JSON"),
+    ("photos", "revision", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+def run_migrations(engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, column, ddl in COLUMN_MIGRATIONS:
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                print(f"Adding column {table}.{column}...")
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    create_missing_indexes(engine)
+
+def create_missing_indexes(engine):
+    # create_all doesn't add indexes to tables that already exist either
+    inspector = inspect(engine)
+    for table in models.Base.metadata.sorted_tables:
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            print(f"Creating index {index.name}...")
+            ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+            if engine.dialect.name == "postgresql":
+                # Build without blocking writes to the table; CONCURRENTLY can't run inside a transaction
+                ddl = re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+                with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    conn.execute(text(ddl))
+            else:
+                with engine.begin() as conn:
+                    conn.execute(text(ddl))
+
+if __name__ == "__main__":
+    from database import engine
+    run_migrations(engine)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, DateTime, ForeignKey, JSON, Text, Integer, Boolean
+from sqlalchemy import Column, String, Float, DateTime, ForeignKey, JSON, Text, Integer, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import uuid
@@ -25,8 +25,15 @@ class User(Base):
     packagings = relationship("Packaging", back_populates="user")
     photos = relationship("Photo", back_populates="user")
 
+# Listings are ordered newest first by (created_at, id); Postgres scans these
+# ascending indexes backwards for that, so they don't need DESC columns.
+
 class Project(Base):
     __tablename__ = "projects"
+    __table_args__ = (
+        # get_projects: user's projects newest first
+        Index("ix_projects_user_created", "user_id", "created_at", "id"),
+    )
 
     id = Column(String, primary_key=True, default=generate_uuid)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -40,6 +47,15 @@ class Project(Base):
 
 class Photo(Base):
     __tablename__ = "photos"
+    __table_args__ = (
+        # get_photos: gallery of all the user's photos
+        Index("ix_photos_user_created", "user_id", "created_at", "id"),
+        # get_photos with project_id; project_id leads so Project.photos loads and cascades can use it too
+        Index("ix_photos_project_user_created", "project_id", "user_id", "created_at", "id"),
+        # Upload dedup: retries with the same bytes and overlay, or the same Idempotency-Key
+        Index("ix_photos_user_content_hash", "user_id", "content_hash"),
+        Index("ix_photos_user_idempotency_key", "user_id", "idempotency_key", unique=True),
+    )
 
     id = Column(String, primary_key=True, default=generate_uuid)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -51,6 +67,14 @@ class Photo(Base):
     stickers = Column(JSON, default=list)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     packaging_id = Column(String, ForeignKey("packagings.id"), nullable=True)
+    status = Column(String, nullable=False, default="ready", server_default="ready") # pending | ready | failed
+    derivatives = Column(JSON, nullable=True) # {"thumb": filename, "preview": filename}
+    content_hash = Column(String(64), nullable=True) # sha256 of the raw upload and its overlay parameters
+    idempotency_key = Column(String(255), nullable=True)
+    # Set for photos stored as the original upload (see rendering.py); None when filename is already composited
+    # none_as_null: stored as SQL NULL rather than JSON 'null', so "overlay IS NOT NULL" finds them
+    overlay = Column(JSON(none_as_null=True), nullable=True)
+    revision = Column(Integer, nullable=False, default=0, server_default="0") # Bumped when the overlay's inputs change
 
     user = relationship("User", back_populates="photos")
     project = relationship("Project", back_populates="photos")
@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+from typing import Dict, Any
+import os
+
+# Output settings of composited photos, kept free of Pillow so the API can import them without loading it
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+@dataclass(frozen=True)
+class OutputPolicy:
+    """How composited photos are sized and encoded."""
+    max_edge: int = 4000 # Longest side in pixels; 0 keeps the source resolution
+    quality: int = 85
+    progressive: bool = True
+    optimize: bool = True
+    subsampling: str = "4:2:0" # "4:4:4", "4:2:2" or "4:2:0"
+
+    @classmethod
+    def from_env(cls) -> "OutputPolicy":
+        return cls(
+            max_edge=int(os.getenv("PHOTO_MAX_EDGE", "4000")),
+            quality=int(os.getenv("PHOTO_JPEG_QUALITY", "85")),
+            progressive=_env_flag("PHOTO_JPEG_PROGRESSIVE", "true"),
+            optimize=_env_flag("PHOTO_JPEG_OPTIMIZE", "true"),
+            subsampling=os.getenv("PHOTO_JPEG_SUBSAMPLING", "4:2:0"),
+        )
+
+    def save_kwargs(self) -> Dict[str, Any]:
+        return {
+            "format": "JPEG",
+            "quality": self.quality,
+            "progressive": self.progressive,
+            "optimize": self.optimize,
+            "subsampling": self.subsampling,
+        }
+
+OUTPUT_POLICY = OutputPolicy.from_env()
+
+# Smaller renditions stored next to each processed photo, by name and long edge
+DERIVATIVE_SIZES = {
+    "thumb": 256,
+    "preview": 1024,
+}
+
+def derivative_filename(filename: str, name: str) -> str:
+    base, ext = os.path.splitext(filename)
+    return f"{base}-{name}{ext}"
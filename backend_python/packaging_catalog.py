@@ -0,0 +1,211 @@
+from dataclasses import dataclass
+import hashlib
+import os
+import struct
+import threading
+import time
+
+from caching import LRUCache
+
+PACKAGES_DIR = os.path.join(os.path.dirname(__file__), "assets", "packages")
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+PACKAGING_SOURCES = ("builtin", "custom")
+
+# Seconds between checks of the packages directories for added, changed or removed files (0 checks only at startup)
+PACKAGING_CATALOG_RECHECK = float(os.getenv("PACKAGING_CATALOG_RECHECK", "10"))
+# Scaled packaging labels kept per process, by (packaging, height)
+PACKAGING_LABEL_CACHE_SIZE = int(os.getenv("PACKAGING_LABEL_CACHE_SIZE", "256"))
+
+# JPEG start-of-frame markers, which carry the image size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def image_size(path: str) -> tuple[int, int]:
+    """
+    (width, height) from a PNG or JPEG header, read without Pillow so scanning the catalog
+    stays cheap at startup; raises ValueError for anything that isn't a readable image.
+    """
+    with open(path, "rb") as f:
+        head = f.read(24)
+        if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+            width, height = struct.unpack(">II", head[16:24])
+        elif head[:2] == b"\xff\xd8":
+            f.seek(2)
+            while True:
+                byte = f.read(1)
+                if not byte:
+                    raise ValueError("no JPEG frame header")
+                if byte != b"\xff":
+                    continue
+                marker = f.read(1)
+                while marker == b"\xff":
+                    marker = f.read(1)
+                if not marker:
+                    raise ValueError("truncated JPEG")
+                code = marker[0]
+                if code == 0x01 or 0xD0 <= code <= 0xD9:
+                    continue # Markers without a length
+                length = f.read(2)
+                if len(length) < 2:
+                    raise ValueError("truncated JPEG")
+                if code in JPEG_SOF_MARKERS:
+                    frame = f.read(5)
+                    if len(frame) < 5:
+                        raise ValueError("truncated JPEG")
+                    height, width = struct.unpack(">HH", frame[1:5])
+                    break
+                f.seek(struct.unpack(">H", length)[0] - 2, os.SEEK_CUR)
+        else:
+            raise ValueError("not a PNG or JPEG file")
+    if not width or not height:
+        raise ValueError("empty image")
+    return width, height
+
+@dataclass(frozen=True)
+class PackagingAsset:
+    source: str # "builtin" or "custom"
+    filename: str
+    width: int
+    height: int
+    mtime: float
+
+    @property
+    def name(self) -> str:
+        return os.path.splitext(self.filename)[0].capitalize()
+
+class PackagingCatalog:
+    """
+    The packaging images under assets/packages with their sizes, scanned once and again
+    only when a directory listing or file mtime changes. Scanning reads only the image
+    headers and skips unreadable files; images are decoded to RGBA on first use and labels
+    for the caption strip are kept pre-scaled per height.
+    """
+
+    def __init__(self, packages_dir: str = PACKAGES_DIR, recheck: float = PACKAGING_CATALOG_RECHECK,
+                 label_cache_size: int = PACKAGING_LABEL_CACHE_SIZE):
+        self.packages_dir = packages_dir
+        self.recheck = recheck
+        self.labels = LRUCache(label_cache_size)
+        self.version = ""
+        self._assets = {} # (source, filename) -> PackagingAsset
+        self._images = {} # (source, filename) -> decoded RGBA image
+        self._signature = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _scan(self) -> tuple:
+        entries = []
+        for source in PACKAGING_SOURCES:
+            directory = os.path.join(self.packages_dir, source)
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    entries.append((source, entry.name, stat.st_mtime, stat.st_size))
+        return tuple(sorted(entries))
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rescans the directories if `recheck` seconds have passed; returns True when the catalog changed."""
+        now = time.monotonic()
+        if self._signature is not None and not force and (self.recheck <= 0 or now - self._checked < self.recheck):
+            return False
+        with self._lock:
+            self._checked = now
+            signature = self._scan()
+            if signature == self._signature:
+                return False
+
+            assets = {}
+            for source, filename, mtime, _ in signature:
+                key = (source, filename)
+                asset = self._assets.get(key)
+                if asset is None or asset.mtime != mtime:
+                    try:
+                        width, height = image_size(os.path.join(self.packages_dir, source, filename))
+                    except (OSError, ValueError) as e:
+                        print(f"Skipping unreadable packaging image {source}/{filename}: {e}")
+                        continue
+                    asset = PackagingAsset(source, filename, width, height, mtime)
+                assets[key] = asset
+
+            # Decoded images and labels of changed or removed files are dropped
+            self._images = {key: img for key, img in self._images.items() if assets.get(key) is self._assets.get(key)}
+            self.labels.clear()
+            self._assets = assets
+            self._signature = signature
+            # Derived from the files, so replicas with the same assets agree on it
+            self.version = hashlib.sha256(repr(signature).encode()).hexdigest()[:16]
+        return True
+
+    def assets(self, source: str) -> list:
+        self.refresh()
+        return sorted((asset for asset in self._assets.values() if asset.source == source), key=lambda asset: asset.filename)
+
+    def builtin(self) -> list:
+        """Builtin packagings as served by /api/packagings/builtin and seeded as Packaging rows."""
+        return [
+            {"id": f"builtin:{asset.filename}", "name": asset.name, "color": asset.filename, "type": "builtin"}
+            for asset in self.assets("builtin")
+        ]
+
+    def custom_assets(self) -> list:
+        return [asset.filename for asset in self.assets("custom")]
+
+    def get(self, source: str, filename: str) -> PackagingAsset | None:
+        key = (source, filename)
+        if os.path.basename(filename) != filename:
+            return None
+        if key not in self._assets and os.path.isfile(os.path.join(self.packages_dir, source, filename)):
+            # Custom packaging images may be added after startup
+            self.refresh(force=True)
+        return self._assets.get(key)
+
+    def image(self, source: str, filename: str):
+        """The decoded RGBA image of a packaging, or None if there is no such file."""
+        key = (source, filename)
+        img = self._images.get(key)
+        if img is not None:
+            return img
+        if self.get(source, filename) is None:
+            return None
+
+        from PIL import Image
+        filepath = os.path.join(self.packages_dir, source, filename)
+        try:
+            with Image.open(filepath) as raw:
+                img = raw.convert("RGBA")
+        except Exception as e:
+            print(f"Error loading packaging image {filepath}: {e}")
+            return None
+        with self._lock:
+            self._images[key] = img
+        return img
+
+    def label(self, source: str, filename: str, height: int):
+        """The packaging image scaled to `height`, preserving its aspect ratio."""
+        key = (source, filename, height)
+        label = self.labels.get(key)
+        if label is None:
+            img = self.image(source, filename)
+            if img is None:
+                return None
+            from PIL import Image
+            # Sized from the catalog entry, falling back to the decoded image if the file just changed
+            size = self._assets.get((source, filename)) or img
+            width = max(1, int(height * size.width / size.height))
+            label = img.resize((width, height), resample=Image.Resampling.LANCZOS)
+            self.labels.set(key, label)
+        return label
+
+    def preload(self, label_heights=()):
+        """Decodes every packaging image and pre-scales labels to `label_heights`."""
+        self.refresh(force=True)
+        for source, filename in list(self._assets):
+            for height in label_heights:
+                self.label(source, filename, height)
+            self.image(source, filename)
+
+    def stats(self) -> dict:
+        return {"assets": len(self._assets), "decoded": len(self._images), "version": self.version, "labels": self.labels.stats()}
+
+packaging_catalog = PackagingCatalog()
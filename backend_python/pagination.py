@@ -0,0 +1,65 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, Response
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import aliased
+
+# Response header carrying the cursor of the next page; absent on the last page. A header rather
+# than a next_cursor body field, so the listings stay plain JSON arrays for existing clients
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# `responses=` of the paginated routes, so the header shows up in the OpenAPI docs
+NEXT_CURSOR_RESPONSES = {
+    200: {
+        "headers": {
+            NEXT_CURSOR_HEADER: {
+                "description": "Pass as ?cursor= to get the next page; absent on the last page",
+                "schema": {"type": "string"},
+            }
+        }
+    }
+}
+
+def encode_cursor(created_at: datetime, id: str) -> str:
+    payload = json.dumps([created_at.isoformat(), id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """Returns (created_at, id) from an opaque cursor, raising 400 if it was tampered with."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), str(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset(query, model, cursor: tuple = None):
+    """
+    Orders `query` newest first by (created_at, id) and, given a decoded cursor,
+    keeps only the rows after it. The id tiebreaker keeps pages stable when
+    several rows share a timestamp.
+
+    The cursor row's own created_at is compared rather than the decoded one, since the
+    stored value may not match its bound-parameter form (SQLite keeps timestamps as text,
+    with or without microseconds); the decoded value is only used if the row is gone.
+    """
+    if cursor is not None:
+        created_at, id = cursor
+        row = aliased(model)
+        anchor = select(row.created_at).where(row.id == id).correlate(None).scalar_subquery()
+        query = query.where(tuple_(model.created_at, model.id) < tuple_(func.coalesce(anchor, created_at), id))
+    return query.order_by(model.created_at.desc(), model.id.desc())
+
+def paginate(rows: list, limit: int, response: Response) -> list:
+    """
+    Trims a result fetched with `limit + 1` rows to `limit`, and sets the
+    next-page cursor header when the extra row shows there is more.
+    """
+    rows = list(rows)
+    if len(rows) > limit:
+        rows = rows[:max(limit, 0)]
+        if rows:
+            last = rows[-1]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.created_at, last.id)
+    return rows
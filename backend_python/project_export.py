@@ -0,0 +1,176 @@
+import csv
+import json
+import os
+import re
+import tempfile
+import time
+import zipfile
+from urllib.parse import quote
+
+import crud
+from database import SessionLocal
+from rendering import packaging_label, render_spec, render_key, render_cache, render
+from storage import CHUNK_SIZE
+
+# Photo rows read per database round trip while the archive streams
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+MANIFEST_FIELDS = ["file", "id", "captured_at", "comment", "latitude", "longitude", "packaging", "stickers"]
+
+class _ZipStream:
+    """
+    Write-only file object for zipfile. It can't seek, so zipfile writes each entry's
+    sizes and CRC in a trailing data descriptor and the archive is produced strictly
+    front to back.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+class _Manifest:
+    """Manifest rows spooled to a temp file as photos are written, so memory stays flat."""
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.file = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE, mode="w+", newline="")
+        self.count = 0
+        if fmt == "csv":
+            self._writer = csv.DictWriter(self.file, fieldnames=MANIFEST_FIELDS)
+            self._writer.writeheader()
+        else:
+            self.file.write("[")
+
+    @property
+    def name(self) -> str:
+        return f"manifest.{self.fmt}"
+
+    def add(self, row: dict):
+        if self.fmt == "csv":
+            self._writer.writerow({**row, "stickers": json.dumps(row["stickers"])})
+        else:
+            self.file.write(("," if self.count else "") + "\n  " + json.dumps(row))
+        self.count += 1
+
+    def chunks(self):
+        if self.fmt == "json":
+            self.file.write("\n]\n")
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk.encode()
+        self.file.close()
+
+def content_disposition(project_name: str) -> str:
+    # ASCII fallback plus the RFC 5987 UTF-8 name, since headers must be latin-1
+    name = re.sub(r"[^\w.-]+", "_", project_name).strip("_") or "project"
+    ascii_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "project"
+    return f"attachment; filename=\"{ascii_name}.zip\"; filename*=UTF-8''{quote(name)}.zip"
+
+def _iter_photos(project_id: str, user_id: int):
+    # A short session per page, closed before yielding, so a slow download doesn't hold a pooled connection
+    cursor = None
+    packagings = {}
+    while True:
+        with SessionLocal() as db:
+            page = crud.get_photos(db, user_id=user_id, project_id=project_id, limit=EXPORT_BATCH_SIZE, cursor=cursor)
+            for photo in page:
+                packaging_id = photo.packaging_id
+                if packaging_id and packaging_id not in packagings:
+                    packaging = None if packaging_id.startswith("builtin:") else crud.get_packaging(db, packaging_id)
+                    packagings[packaging_id] = packaging_label(packaging_id, packaging)
+            db.expunge_all()
+        for photo in page:
+            yield photo, packagings.get(photo.packaging_id)
+        if len(page) < EXPORT_BATCH_SIZE:
+            return
+        cursor = (page[-1].created_at, page[-1].id)
+
+def stream_project_zip(project_id: str, user_id: int, store, manifest_format: str = "json", project_name: str = ""):
+    """
+    Yields a ZIP archive of the project's processed photos followed by a manifest.
+    JPEGs are stored uncompressed and copied in CHUNK_SIZE pieces, so memory use
+    doesn't depend on the number or size of the photos.
+    """
+    for chunk in _zip_chunks(project_id, user_id, store, manifest_format, project_name):
+        if chunk:
+            yield chunk
+
+def _composite(photo, packaging: dict | None, store, project_name: str):
+    """(store, name, stat) of the photo's composite, or None if its file is missing."""
+    if photo.overlay is None:
+        stat = store.stat(photo.filename)
+        return (store, photo.filename, stat) if stat else None
+    # Kept as the original: use the cached render, rendering it in the compositing pool if needed
+    spec = render_spec(photo, project_name, packaging)
+    key = render_key(photo.filename, spec)
+    name = render_cache.names(key)["full"]
+    stat = render_cache.stat(name)
+    try:
+        if stat is None and render(store, photo.filename, spec, key):
+            stat = render_cache.stat(name)
+    except Exception as e:
+        # A failed render mustn't truncate the archive half way; ship the photo without its overlay
+        print(f"Error rendering {photo.id} for export, using the original: {e}")
+        stat = store.stat(photo.filename)
+        return (store, photo.filename, stat) if stat else None
+    return (render_cache, name, stat) if stat else None
+
+def _zip_chunks(project_id: str, user_id: int, store, manifest_format: str, project_name: str):
+    out = _ZipStream()
+    manifest = _Manifest(manifest_format)
+    used_names = set()
+    with zipfile.ZipFile(out, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for photo, packaging in _iter_photos(project_id, user_id):
+            composite = _composite(photo, packaging, store, project_name) if photo.status == "ready" else None
+            if composite is None:
+                continue
+            source, filename, stat = composite
+
+            captured = photo.created_at
+            name = f"photos/{captured:%Y-%m-%d_%H-%M-%S}_{photo.id[:8]}.jpg"
+            if name in used_names:
+                name = f"photos/{captured:%Y-%m-%d_%H-%M-%S}_{photo.id}.jpg"
+            used_names.add(name)
+
+            info = zipfile.ZipInfo(name, date_time=max(captured.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = stat.st_size
+            with archive.open(info, "w") as dst:
+                for chunk in source.iter_range(filename, 0, stat.st_size - 1):
+                    dst.write(chunk)
+                    yield out.drain()
+            yield out.drain()
+
+            manifest.add({
+                "file": name,
+                "id": photo.id,
+                "captured_at": captured.isoformat(),
+                "comment": photo.comment,
+                "latitude": photo.latitude,
+                "longitude": photo.longitude,
+                "packaging": packaging["name"] if packaging else None,
+                "stickers": photo.stickers or [],
+            })
+
+        info = zipfile.ZipInfo(manifest.name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(info, "w") as dst:
+            for chunk in manifest.chunks():
+                dst.write(chunk)
+                yield out.drain()
+    # Central directory
+    yield out.drain()
@@ -0,0 +1,168 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+import time
+
+from compositing import run_composite_sync
+from output_policy import DERIVATIVE_SIZES, OUTPUT_POLICY, derivative_filename
+from storage import LocalStorage, remove_files
+
+# "eager" composites during ingest and stores only the result; "lazy" keeps the original upload plus its
+# overlay spec and renders composites when first requested through /api/photos/{id}/file
+# (/uploads/{filename} then serves the original, and PHOTO_INGEST_MODE=async doesn't apply)
+PHOTO_RENDER_MODE = os.getenv("PHOTO_RENDER_MODE", "eager")
+# Local directory for composites rendered from originals; everything in it can be rendered again
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", "render_cache")
+# Disk space rendered composites may use before the least recently served are evicted
+RENDER_CACHE_MAX_MB = int(os.getenv("RENDER_CACHE_MAX_MB", "2048"))
+# Staged renders older than this are left over from a crash; younger ones may belong to another process
+STALE_STAGING_SECONDS = 600
+
+def packaging_label(packaging_id: str, packaging=None, packaging_name: str | None = None) -> dict | None:
+    """
+    The packaging drawn on a photo. `packaging` is the Packaging row of a custom packaging
+    and `packaging_name` the (translated) name the client chose, if any.
+    """
+    if packaging_id.startswith("builtin:"):
+        filename = packaging_id.split(":", 1)[1]
+        return {"name": packaging_name or os.path.splitext(filename)[0].capitalize(), "color": filename, "type": "builtin"}
+    if packaging is None:
+        return None
+    return {"name": packaging_name or packaging.name, "color": packaging.color, "type": "custom"}
+
+def overlay_spec(project_name: str, project_title: str | None, stickers: list, captured_at: str | None, packaging_name: str | None, hide_date: bool) -> dict:
+    """What Photo.overlay stores: the overlay inputs that aren't columns of the photo already."""
+    return {
+        # Clients send the project name they display; only a different title is pinned, so renames show up
+        "project_title": project_title if project_title and project_title != project_name else None,
+        "stickers": stickers, # As uploaded; Photo.stickers only keeps the ones the API can describe
+        "captured_at": captured_at,
+        "packaging_name": packaging_name,
+        "hide_date": hide_date,
+    }
+
+def render_spec(photo, project_name: str, packaging: dict | None) -> dict:
+    """composite_image's keyword arguments for a photo kept as an original plus overlay spec."""
+    overlay = photo.overlay
+    if packaging and overlay.get("packaging_name"):
+        packaging = {**packaging, "name": overlay["packaging_name"]}
+    return {
+        "project_name": overlay.get("project_title") or project_name,
+        "comment": photo.comment,
+        "stickers": overlay.get("stickers") or [],
+        "latitude": photo.latitude,
+        "longitude": photo.longitude,
+        "captured_at": overlay.get("captured_at"),
+        "packaging_info": packaging,
+        "hide_date": overlay.get("hide_date", False),
+    }
+
+def render_key(source_name: str, spec: dict) -> str:
+    # Everything that changes the pixels: the original, the overlay and the output settings
+    payload = json.dumps({"source": source_name, "spec": spec, "policy": OUTPUT_POLICY, "sizes": DERIVATIVE_SIZES}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+class RenderCache(LocalStorage):
+    """
+    Composites rendered from originals, stored like LocalStorage files under their render
+    key ("<key>.jpg", "<key>-thumb.jpg", ...). Once they use more than `max_bytes` the
+    least recently served are deleted; the accounting is per process and the directory
+    is only scanned on first use, so importing this module touches no files.
+    """
+
+    def __init__(self, root: str = RENDER_CACHE_DIR, max_bytes: int = RENDER_CACHE_MAX_MB * 1024 * 1024):
+        super().__init__(root)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict() # name -> bytes, least recently served first
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        # Renders left by an earlier run count towards the limit, oldest first; abandoned half-written ones are dropped
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if os.path.isdir(self.staging_dir):
+                cutoff = time.time() - STALE_STAGING_SECONDS
+                remove_files([entry.path for entry in os.scandir(self.staging_dir) if entry.stat().st_mtime < cutoff])
+            found = []
+            for directory, dirs, files in os.walk(self.root):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                for name in files:
+                    if not name.startswith("."):
+                        stat = os.stat(os.path.join(directory, name))
+                        found.append((stat.st_mtime, name, stat.st_size))
+            for _, name, size in sorted(found):
+                self._entries[name] = size
+                self.size += size
+            self._loaded = True
+
+    def staging_path(self, name: str) -> str:
+        self._load()
+        return super().staging_path(name)
+
+    def names(self, key: str) -> dict:
+        """Cached file names of a render, by size ("full" and the DERIVATIVE_SIZES)."""
+        full = f"{key}.jpg"
+        return {"full": full, **{size: derivative_filename(full, size) for size in DERIVATIVE_SIZES}}
+
+    def touch(self, name: str):
+        self._load()
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+
+    def store(self, names):
+        """Publishes staged renders and evicts the least recently served beyond max_bytes."""
+        self._load()
+        names = list(names)
+        self.publish(names)
+        evicted = []
+        with self._lock:
+            for name in names:
+                size = os.stat(self._path(name)).st_size
+                self.size += size - self._entries.pop(name, 0)
+                self._entries[name] = size
+            while self.size > self.max_bytes and len(self._entries) > len(names):
+                name, size = self._entries.popitem(last=False)
+                self.size -= size
+                evicted.append(name)
+        self.delete(evicted)
+
+    def discard(self, *keys: str):
+        """Drops renders whose overlay has been edited or whose photos are gone."""
+        self._load()
+        names = [name for key in keys for name in self.names(key).values()]
+        with self._lock:
+            for name in names:
+                self.size -= self._entries.pop(name, 0)
+        self.delete(names)
+
+    def stats(self) -> dict:
+        self._load()
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self.size, "max_bytes": self.max_bytes}
+
+render_cache = RenderCache()
+
+def render(store, source_name: str, spec: dict, key: str) -> bool:
+    """
+    Renders the original `source_name` from `store` into the render cache in the compositing
+    pool, blocking this thread until done; False if the original is gone. Request handlers
+    use the async pool helpers instead.
+    """
+    source = store.fetch(source_name)
+    if source is None:
+        return False
+    names = render_cache.names(key)
+    try:
+        derivatives = run_composite_sync(source, **spec, output_path=render_cache.staging_path(names["full"]), derivative_sizes=DERIVATIVE_SIZES)
+    finally:
+        store.release(source)
+    render_cache.store([names["full"], *derivatives.values()])
+    return True
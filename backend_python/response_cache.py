@@ -0,0 +1,146 @@
+from fastapi import Request, Response
+import asyncio
+import hashlib
+import json
+import os
+import threading
+
+from caching import LRUCache
+from http_cache import etag_matches, not_modified, REVALIDATE_CACHE_CONTROL
+
+# Where cached list responses live: "memory" (per process), "redis" (shared, needs the redis package) or "off"
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+# Any server speaking the Redis protocol (Redis, Valkey, KeyDB, ...)
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "redis://localhost:6379/0")
+RESPONSE_CACHE_PREFIX = os.getenv("RESPONSE_CACHE_PREFIX", "auditlens:")
+# Responses kept by the memory backend
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+# Seconds a response is kept; invalidation doesn't depend on it, it only bounds memory
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+class LocalStore:
+    """
+    In-process stand-in for the few Redis commands the cache uses (GET, SET EX, MGET, INCR),
+    so the memory backend and tests exercise the same code as a Redis server.
+    """
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float | None = RESPONSE_CACHE_TTL):
+        self._values = LRUCache(maxsize, ttl=ttl)
+        # Generation counters are tiny and must outlive the responses they guard, so they are never evicted
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        value = self._counters.get(key)
+        return str(value).encode() if value is not None else self._values.get(key)
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key: str, value: bytes, ex: int | None = None):
+        self._values.set(key, value)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = self._counters[key] = self._counters.get(key, 0) + 1
+        return value
+
+class NullStore:
+    def get(self, key: str):
+        return None
+
+    def mget(self, keys):
+        return [None] * len(keys)
+
+    def set(self, key: str, value: bytes, ex: int | None = None):
+        pass
+
+    def incr(self, key: str) -> int:
+        return 0
+
+class ResponseCache:
+    """
+    JSON response bodies keyed by namespace (a route family such as "projects"), scope
+    (usually the user id) and the request parameters. Keys embed generation counters of
+    the namespace and of the scope; writes bump a counter, so every cached variant of the
+    affected lists stops being read at once and expires on its own. A response computed
+    while a write commits is stored under the old generation and never served.
+    """
+
+    def __init__(self, store, prefix: str = RESPONSE_CACHE_PREFIX, ttl: int = RESPONSE_CACHE_TTL):
+        self.store = store
+        self.prefix = prefix
+        self.ttl = ttl
+        # A remote store is a network round trip, which handlers make off the event loop
+        self.remote = not isinstance(store, (LocalStore, NullStore))
+
+    async def _call(self, fn, *args, **kwargs):
+        if self.remote:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    def _generation_keys(self, namespace: str, scope) -> list:
+        return [f"{self.prefix}gen:{namespace}", f"{self.prefix}gen:{namespace}:{scope}"]
+
+    def key(self, namespace: str, scope, params: dict) -> str:
+        generations = [int(value or 0) for value in self.store.mget(self._generation_keys(namespace, scope))]
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:32]
+        return f"{self.prefix}resp:{namespace}:{scope}:{'.'.join(map(str, generations))}:{digest}"
+
+    def get(self, key: str) -> dict | None:
+        raw = self.store.get(key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, entry: dict):
+        self.store.set(key, json.dumps(entry).encode(), ex=self.ttl)
+
+    def invalidate_sync(self, namespace: str, scope=None):
+        """Drops the cached responses of `namespace` for `scope`, or for every scope when None."""
+        try:
+            self.store.incr(self._generation_keys(namespace, scope)[0 if scope is None else 1])
+        except Exception as e:
+            # A write must not fail because the cache is down; its entries expire after the TTL
+            print(f"Error invalidating response cache {namespace}:{scope}: {e}")
+
+    async def invalidate(self, namespace: str, scope=None):
+        await self._call(self.invalidate_sync, namespace, scope)
+
+    async def respond(self, request: Request, namespace: str, scope, params: dict, produce) -> Response:
+        """
+        Answers a GET from the cache, or from `produce()` on a miss. `produce` is an async
+        callable returning the JSON body as bytes and a dict of headers to replay with it.
+        """
+        try:
+            key = await self._call(self.key, namespace, scope, params)
+            entry = await self._call(self.get, key)
+        except Exception as e:
+            print(f"Error reading response cache: {e}")
+            key = entry = None
+        if entry is None:
+            body, headers = await produce()
+            entry = {"etag": f'"{hashlib.sha256(body).hexdigest()[:16]}"', "headers": headers, "body": body.decode()}
+            if key is not None:
+                try:
+                    await self._call(self.set, key, entry)
+                except Exception as e:
+                    print(f"Error writing response cache: {e}")
+        return json_response(request, entry)
+
+def json_response(request: Request, entry: dict) -> Response:
+    # Lists change whenever their data does, so clients revalidate every time and usually get a 304
+    if etag_matches(request, entry["etag"]):
+        return not_modified(entry["etag"], REVALIDATE_CACHE_CONTROL)
+    headers = {**entry["headers"], "ETag": entry["etag"], "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    return Response(entry["body"], media_type="application/json", headers=headers)
+
+def create_response_cache() -> ResponseCache:
+    if RESPONSE_CACHE_BACKEND == "redis":
+        import redis
+        return ResponseCache(redis.Redis.from_url(RESPONSE_CACHE_URL, socket_timeout=1))
+    if RESPONSE_CACHE_BACKEND == "memory":
+        return ResponseCache(LocalStore())
+    if RESPONSE_CACHE_BACKEND == "off":
+        return ResponseCache(NullStore())
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND {RESPONSE_CACHE_BACKEND!r} (expected 'memory', 'redis' or 'off')")
+
+response_cache = create_response_cache()
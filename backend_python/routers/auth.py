@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 import hmac
 import hashlib
@@ -7,10 +7,10 @@ import json
 from urllib.parse import parse_qs, unquote
 import os
 
-import crud
+import crud_async as crud
 import models
 import schemas
-from database import get_db
+from database import get_async_db
 
 router = APIRouter(
     prefix="/api/auth",
@@ -72,13 +72,13 @@ def validate_telegram_data(init_data: str, bot_token: str) -> dict:
         raise ValueError(f"Invalid initData: {e}")
 
 @router.post("/telegram", response_model=schemas.User)
-def authenticate_telegram_user(auth_data: TelegramAuth, db: Session = Depends(get_db)):
+async def authenticate_telegram_user(auth_data: TelegramAuth, db: AsyncSession = Depends(get_async_db)):
     init_data = auth_data.initData
     
     # Allow a bypass for local development if initData is just a string "dev"
     if init_data == "dev":
          # Return the hardcoded dev user
-         user = crud.get_user(db, 1)
+         user = await crud.get_user(db, 1)
          if not user:
             # If dev user not found, create it
             user_create = schemas.UserCreate(
@@ -90,7 +90,7 @@ def authenticate_telegram_user(auth_data: TelegramAuth, db: Session = Depends(ge
                 language_code="en",
                 is_bot=False
             )
-            user = crud.create_user(db, user_create)
+            user = await crud.create_user(db, user_create)
          return user
 
     try:
@@ -101,7 +101,7 @@ def authenticate_telegram_user(auth_data: TelegramAuth, db: Session = Depends(ge
     telegram_id = str(user_data['id'])
     
     # Check if user exists
-    user = crud.get_user_by_telegram_id(db, telegram_id)
+    user = await crud.get_user_by_telegram_id(db, telegram_id)
     
     if not user:
         # Create new user
@@ -113,7 +113,7 @@ def authenticate_telegram_user(auth_data: TelegramAuth, db: Session = Depends(ge
             language_code=user_data.get('language_code', "en"),
             is_bot=user_data.get('is_bot', False)
         )
-        user = crud.create_user(db, user_create)
+        user = await crud.create_user(db, user_create)
     else:
         # Update existing user info if changed (optional, but good practice)
         # For simplicity, we just return the user for now
@@ -1,12 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-import os
+import json
 
-import crud
+import crud_async as crud
 import models
 import schemas
-from database import get_db
+from database import get_async_db
+from packaging_catalog import packaging_catalog
+from response_cache import response_cache
 
 # Hardcoded User ID for now (as requested)
 HARDCODED_USER_ID = 1
@@ -20,56 +23,48 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+packaging_list = TypeAdapter(List[schemas.Packaging])
+
 @router.get("", response_model=List[schemas.Packaging])
-def read_packagings(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    packagings = crud.get_packagings(db, user_id=user_id, skip=skip, limit=limit)
-    return packagings
+async def read_packagings(request: Request, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    async def produce():
+        packagings = await crud.get_packagings(db, user_id=user_id, skip=skip, limit=limit)
+        return packaging_list.dump_json(packagings, by_alias=True), {}
+
+    return await response_cache.respond(request, "packagings", user_id, {"skip": skip, "limit": limit}, produce)
 
 @router.get("/builtin")
-def read_builtin_packagings():
-    builtin_dir = os.path.join(os.path.dirname(__file__), "..", "assets", "packages", "builtin")
-    packages = []
-    if os.path.exists(builtin_dir):
-        for filename in os.listdir(builtin_dir):
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                name = os.path.splitext(filename)[0].capitalize()
-                packages.append({
-                    "id": f"builtin:{filename}",
-                    "name": name,
-                    "color": filename,
-                    "type": "builtin"
-                })
-    return packages
+async def read_builtin_packagings(request: Request):
+    # The same for every user; the catalog version changes whenever a file is added, replaced or removed
+    packaging_catalog.refresh()
+
+    async def produce():
+        return json.dumps(packaging_catalog.builtin()).encode(), {}
+
+    return await response_cache.respond(request, "builtin-packagings", None, {"catalog": packaging_catalog.version}, produce)
 
 @router.get("/custom-assets")
 def read_custom_assets():
-    custom_dir = os.path.join(os.path.dirname(__file__), "..", "assets", "packages", "custom")
-    assets = []
-    if os.path.exists(custom_dir):
-        for filename in os.listdir(custom_dir):
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                assets.append(filename)
-    return sorted(assets)
+    return packaging_catalog.custom_assets()
 
 @router.post("", response_model=schemas.Packaging)
-def create_packaging(packaging: schemas.PackagingCreate, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    return crud.create_packaging(db=db, packaging=packaging, user_id=user_id)
+async def create_packaging(packaging: schemas.PackagingCreate, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    return await crud.create_packaging(db=db, packaging=packaging, user_id=user_id)
 
 @router.put("/{packaging_id}", response_model=schemas.Packaging)
-def update_packaging(packaging_id: str, packaging: schemas.PackagingCreate, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    db_packaging = crud.update_packaging(db, packaging_id=packaging_id, packaging=packaging, user_id=user_id)
+async def update_packaging(packaging_id: str, packaging: schemas.PackagingCreate, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    db_packaging = await crud.update_packaging(db, packaging_id=packaging_id, packaging=packaging, user_id=user_id)
     if db_packaging is None:
         raise HTTPException(status_code=404, detail="Packaging not found or access denied")
     return db_packaging
 
 @router.delete("/all", status_code=204)
-def delete_all_packagings(db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+async def delete_all_packagings(db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
     # Only delete user's packagings
-    db.query(models.Packaging).filter(models.Packaging.user_id == user_id).delete()
-    db.commit()
+    await crud.delete_user_packagings(db, user_id=user_id)
     return None
 
 @router.delete("/{packaging_id}", status_code=204)
-def delete_packaging(packaging_id: str, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    crud.delete_packaging(db, packaging_id=packaging_id, user_id=user_id)
+async def delete_packaging(packaging_id: str, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    await crud.delete_packaging(db, packaging_id=packaging_id, user_id=user_id)
     return None
@@ -1,17 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks, Query, Request, Response, Header
 from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import ValidationError
 from typing import List, Optional
 import shutil
 import os
+import asyncio
+import functools
+import hashlib
 import json
 import uuid
 
-import crud
+import crud_async as crud
+import metrics
 import models
 import schemas
-from database import get_db
-from image_processing import composite_image
+from database import get_async_db
+from pagination import decode_cursor, paginate, NEXT_CURSOR_RESPONSES
+from compositing import run_composite, run_generate_derivatives, compositing_executor, CompositingBusy, COMPOSITE_RETRY_AFTER
+from ingest_queue import ingest_queue, PHOTO_INGEST_MODE
+from output_policy import DERIVATIVE_SIZES
+from caching import LRUCache
+from http_cache import cached_file_response, etag_for, etag_matches, not_modified, IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL
+from storage import write_stream, write_temp_stream, file_version, remove_files, photo_storage
+from rendering import PHOTO_RENDER_MODE, packaging_label, overlay_spec, render_spec, render_key, render_cache
 
 # Hardcoded User ID for now (as requested)
 HARDCODED_USER_ID = 1
@@ -25,16 +38,90 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Most photos accepted by one POST /batch request
+PHOTO_BATCH_MAX = int(os.getenv("PHOTO_BATCH_MAX", "200"))
+# Times a batch item waits COMPOSITE_RETRY_AFTER/5 seconds for pool capacity before failing
+PHOTO_BATCH_BUSY_RETRIES = int(os.getenv("PHOTO_BATCH_BUSY_RETRIES", "10"))
 
-@router.get("", response_model=List[schemas.Photo])
-def read_photos(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    photos = crud.get_photos(db, user_id=user_id, skip=skip, limit=limit)
-    return photos
+# Set on responses that return the photo created by an earlier attempt of the same upload
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# Uploads being composited by this process, by content hash; a concurrent retry waits for the first
+uploads_in_flight = {}
+
+# Renders running in this process, by render key; requests for the sizes of one photo share a render
+renders_in_flight = {}
+
+# Ready photo rows looked up by /file, keyed by (user_id, photo_id)
+photo_file_cache = LRUCache(
+    int(os.getenv("PHOTO_LOOKUP_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("PHOTO_LOOKUP_CACHE_TTL", "300"))
+)
+
+def normalize_packaging_id(packaging_id: Optional[str]) -> Optional[str]:
+    return packaging_id if packaging_id and packaging_id.strip() else None
+
+async def resolve_packaging(db: AsyncSession, packaging_id: Optional[str], packaging_name: Optional[str] = None) -> Optional[dict]:
+    """Returns the packaging label drawn on the photo, or None."""
+    packaging_id = normalize_packaging_id(packaging_id)
+    if not packaging_id:
+        return None
+    # For custom packages, verify it exists (ownership check handles visibility effectively,
+    # but ideally we should verify user owns it if it's custom)
+    packaging = None if packaging_id.startswith("builtin:") else await crud.get_packaging(db, packaging_id)
+    return packaging_label(packaging_id, packaging, packaging_name)
+
+async def photo_render_spec(db: AsyncSession, db_photo: models.Photo, project: models.Project = None) -> dict:
+    """The composite_image arguments of a photo stored as its original, from its current metadata."""
+    if project is None:
+        project = await crud.get_user_project(db, db_photo.project_id, db_photo.user_id, load_photos=False)
+    packaging = await resolve_packaging(db, db_photo.packaging_id)
+    return render_spec(db_photo, project.name if project else "", packaging)
+
+def upload_hash(raw_hasher, project_id: str, overlay: dict) -> str:
+    """Identifies an upload by its bytes and everything drawn onto it, so a retry maps to the same photo."""
+    payload = json.dumps({"raw": raw_hasher.hexdigest(), "project_id": project_id, **overlay}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+async def find_duplicate(db: AsyncSession, user_id: int, idempotency_key: Optional[str] = None, content_hash: Optional[str] = None):
+    if idempotency_key:
+        existing = await crud.get_photo_by_idempotency_key(db, idempotency_key, user_id)
+        if existing:
+            return existing
+    if content_hash:
+        return await crud.get_photo_by_content_hash(db, content_hash, user_id)
+    return None
+
+def replay(response: Response, existing: models.Photo) -> models.Photo:
+    # Answer a retry with the earlier photo instead of compositing it again
+    response.headers[REPLAYED_HEADER] = "true"
+    if existing.status == "pending":
+        response.status_code = 202
+        response.headers["Location"] = f"/api/photos/{existing.id}/status"
+    else:
+        response.status_code = 200
+    return existing
+
+def parse_stickers(stickers_list: list) -> List[schemas.StickerBase]:
+    # Invalid stickers are dropped rather than failing the upload
+    sticker_objs = []
+    for s in stickers_list:
+        try:
+            sticker_objs.append(schemas.StickerBase(**s))
+        except:
+            continue
+    return sticker_objs
+
+@router.get("", response_model=List[schemas.Photo], responses=NEXT_CURSOR_RESPONSES)
+async def read_photos(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    # One extra row tells paginate() whether there is a next page
+    photos = await crud.get_photos(db, user_id=user_id, skip=skip, limit=limit + 1, cursor=decode_cursor(cursor) if cursor else None)
+    return paginate(photos, limit, response)
 
 @router.post("", response_model=schemas.Photo, status_code=201)
 async def create_photo(
+    request: Request,
+    response: Response,
     photo: UploadFile = File(...),
     project_id: str = Form(...),
     project_title: Optional[str] = Form(None),
@@ -46,41 +133,29 @@ async def create_photo(
     packaging_id: Optional[str] = Form(None),
     packaging_name: Optional[str] = Form(None),
     hide_date: Optional[str] = Form(None),
-    db: Session = Depends(get_db),
+    ingest: Optional[str] = Query(None, pattern="^(sync|async)$"), # Overrides PHOTO_INGEST_MODE when rendering eagerly
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
+    # The multipart body has been parsed (and spooled by Starlette) by the time the endpoint runs
+    metrics.record_since_request(request.scope, "upload", "parse")
+
     # Validate project exists and belongs to user
-    project = crud.get_user_project(db, project_id, user_id)
+    project = await crud.get_user_project(db, project_id, user_id, load_photos=False)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
+    # A retry carrying the same Idempotency-Key doesn't need its body looked at
+    existing = await find_duplicate(db, user_id, idempotency_key=idempotency_key)
+    if existing:
+        return replay(response, existing)
+
     # Use project_title if provided, otherwise use project name from DB
     display_name = project_title or project.name
 
     # Get packaging info if provided
-    packaging_info = None
-    if packaging_id and packaging_id.strip() and packaging_id != " ":
-        if packaging_id.startswith("builtin:"):
-            filename = packaging_id.split(":", 1)[1]
-            # Always use packaging_name from client if provided, otherwise derive from filename
-            name = packaging_name if packaging_name else os.path.splitext(filename)[0].capitalize()
-            packaging_info = {
-                "name": name,
-                "color": filename,
-                "type": "builtin"
-            }
-        else:
-            # For custom packages, verify it exists (ownership check handles visibility effectively,
-            # but ideally we should verify user owns it if it's custom)
-            packaging = crud.get_packaging(db, packaging_id)
-            if packaging:
-                # Use name from client if provided, otherwise use DB name
-                name = packaging_name if packaging_name else packaging.name
-                packaging_info = {
-                    "name": name,
-                    "color": packaging.color,
-                    "type": "custom"
-                }
+    packaging_info = await resolve_packaging(db, packaging_id, packaging_name)
 
     # Parse stickers
     stickers_list = []
@@ -90,39 +165,9 @@ async def create_photo(
         except json.JSONDecodeError:
             pass # Or raise error
             
-    # Read image file
-    content = await photo.read()
-    
-    # Process image (Composite)
     should_hide_date = hide_date.lower() == 'true' if hide_date else False
-    
-    processed_image_data = await composite_image(
-        content,
-        comment,
-        stickers_list,
-        latitude,
-        longitude,
-        display_name,
-        captured_at,
-        packaging_info,
-        should_hide_date
-    )
-    
-    # Save to disk
+
     filename = f"photo-{uuid.uuid4()}.jpg"
-    filepath = os.path.join(UPLOAD_DIR, filename)
-    
-    with open(filepath, "wb") as f:
-        f.write(processed_image_data)
-        
-    # Create DB entry
-    
-    sticker_objs = []
-    for s in stickers_list:
-        try:
-            sticker_objs.append(schemas.StickerBase(**s))
-        except:
-            continue
 
     photo_create = schemas.PhotoCreate(
         filename=filename,
@@ -130,42 +175,475 @@ async def create_photo(
         comment=comment,
         latitude=latitude,
         longitude=longitude,
-        stickers=sticker_objs,
+        stickers=parse_stickers(stickers_list),
         captured_at=captured_at,
-        packaging_id=packaging_id if packaging_id and packaging_id.strip() and packaging_id != " " else None
+        packaging_id=normalize_packaging_id(packaging_id),
+        idempotency_key=idempotency_key
     )
-    
-    return crud.create_photo(db=db, photo=photo_create, filename=filename, user_id=user_id)
+    # composite_image's keyword arguments, also hashed to recognise retries
+    overlay = {
+        "project_name": display_name,
+        "comment": comment,
+        "stickers": stickers_list,
+        "latitude": latitude,
+        "longitude": longitude,
+        "captured_at": captured_at,
+        "packaging_info": packaging_info,
+        "hide_date": should_hide_date,
+    }
+    hasher = hashlib.sha256()
+
+    if PHOTO_RENDER_MODE == "eager" and (ingest or PHOTO_INGEST_MODE) == "async":
+        # Store the raw upload and composite it in the background; the client polls /status
+        photo_id = str(uuid.uuid4())
+        await asyncio.to_thread(ingest_queue.store_raw, photo_id, photo.file, hasher)
+        photo_create.content_hash = upload_hash(hasher, project_id, overlay)
+        existing = await find_duplicate(db, user_id, content_hash=photo_create.content_hash)
+        if existing:
+            await asyncio.to_thread(remove_files, [ingest_queue.raw_path(photo_id)])
+            return replay(response, existing)
+        await asyncio.to_thread(ingest_queue.write_job, photo_id, {
+            "filename": filename,
+            "comment": comment,
+            "stickers": stickers_list,
+            "latitude": latitude,
+            "longitude": longitude,
+            "project_name": display_name,
+            "captured_at": captured_at,
+            "packaging_info": packaging_info,
+            "hide_date": should_hide_date,
+        })
+        try:
+            db_photo = await crud.create_photo(db=db, photo=photo_create, filename=filename, user_id=user_id, photo_id=photo_id, status="pending")
+        except IntegrityError:
+            # Another request stored the same Idempotency-Key first
+            await db.rollback()
+            existing = await find_duplicate(db, user_id, idempotency_key=idempotency_key)
+            if not existing:
+                raise
+            await asyncio.to_thread(ingest_queue.discard, photo_id)
+            return replay(response, existing)
+        ingest_queue.enqueue(photo_id)
+
+        response.status_code = 202
+        response.headers["Location"] = f"/api/photos/{photo_id}/status"
+        return db_photo
+
+    if PHOTO_RENDER_MODE == "lazy":
+        # Only the original is kept; composites are rendered from it and the overlay spec when first requested
+        photo_create.overlay = overlay_spec(project.name, project_title, stickers_list, captured_at, packaging_name, should_hide_date)
+        upload_path = photo_storage.staging_path(filename)
+        with metrics.stage_timer("upload", "spool"):
+            await asyncio.to_thread(write_stream, photo.file, upload_path, hasher=hasher)
+        save = functools.partial(save_original, db, photo_create, user_id, response)
+    else:
+        # Spool the upload to a temp file in chunks instead of reading it into memory
+        with metrics.stage_timer("upload", "spool"):
+            upload_path = await asyncio.to_thread(write_temp_stream, photo.file, hasher=hasher)
+        save = functools.partial(composite_and_save, db, upload_path, overlay, photo_create, user_id, response)
+    content_hash = photo_create.content_hash = upload_hash(hasher, project_id, overlay)
+
+    # Checked and claimed without an await in between, so only one attempt composites at a time
+    while content_hash in uploads_in_flight:
+        await asyncio.shield(uploads_in_flight[content_hash])
+    uploads_in_flight[content_hash] = asyncio.get_running_loop().create_future()
+    try:
+        existing = await find_duplicate(db, user_id, content_hash=content_hash)
+        if existing:
+            os.remove(upload_path)
+            return replay(response, existing)
+        return await save()
+    finally:
+        # Waiting retries look the photo up again, so they learn the outcome either way
+        uploads_in_flight.pop(content_hash).set_result(None)
+
+async def composite_and_save(db: AsyncSession, upload_path: str, overlay: dict, photo_create: schemas.PhotoCreate, user_id: int, response: Response):
+    # Process image (Composite), encoding straight to the staging file
+    try:
+        # Includes waiting for a free worker; the worker's own stages are recorded under "composite"
+        with metrics.stage_timer("upload", "composite"):
+            derivatives = await run_composite(
+                upload_path, **overlay, output_path=photo_storage.staging_path(photo_create.filename), derivative_sizes=DERIVATIVE_SIZES
+            )
+    except CompositingBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy processing photos, please retry shortly",
+            headers={"Retry-After": str(COMPOSITE_RETRY_AFTER)}
+        )
+    finally:
+        os.remove(upload_path)
+
+    files = [photo_create.filename, *(derivatives or {}).values()]
+    with metrics.stage_timer("upload", "publish"):
+        await asyncio.to_thread(photo_storage.publish, files)
+    return await insert_photo(db, photo_create, files, user_id, response, derivatives)
+
+async def save_original(db: AsyncSession, photo_create: schemas.PhotoCreate, user_id: int, response: Response):
+    # The original was spooled straight to its staging file
+    files = [photo_create.filename]
+    with metrics.stage_timer("upload", "publish"):
+        await asyncio.to_thread(photo_storage.publish, files)
+    return await insert_photo(db, photo_create, files, user_id, response)
+
+async def insert_photo(db: AsyncSession, photo_create: schemas.PhotoCreate, files: list, user_id: int, response: Response, derivatives: dict = None):
+    # Create DB entry
+    try:
+        with metrics.stage_timer("upload", "db_insert"):
+            return await crud.create_photo(db=db, photo=photo_create, filename=photo_create.filename, user_id=user_id, derivatives=derivatives)
+    except IntegrityError:
+        # Another process stored the same Idempotency-Key first
+        await db.rollback()
+        existing = await find_duplicate(db, user_id, idempotency_key=photo_create.idempotency_key)
+        if not existing:
+            raise
+        await asyncio.to_thread(photo_storage.delete, files)
+        return replay(response, existing)
+
+async def composite_when_free(*args, **kwargs):
+    # Batch items wait for pool capacity instead of failing while single uploads fill the queue
+    for _ in range(PHOTO_BATCH_BUSY_RETRIES):
+        try:
+            return await run_composite(*args, **kwargs)
+        except CompositingBusy:
+            await asyncio.sleep(COMPOSITE_RETRY_AFTER / 5)
+    return await run_composite(*args, **kwargs)
+
+@router.post("/batch", response_model=schemas.PhotoBatchResponse)
+async def create_photos_batch(
+    request: Request,
+    photos: List[UploadFile] = File(...),
+    metadata: Optional[str] = Form(None), # JSON list with one PhotoBatchItem per photo, in the same order
+    project_id: str = Form(...),
+    project_title: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    metrics.record_since_request(request.scope, "batch_upload", "parse")
+    if len(photos) > PHOTO_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {PHOTO_BATCH_MAX} photos per batch")
+    try:
+        raw_items = json.loads(metadata) if metadata else [{} for _ in photos]
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="metadata is not valid JSON")
+    if not isinstance(raw_items, list) or len(raw_items) != len(photos):
+        raise HTTPException(status_code=400, detail="metadata must be a JSON list with one entry per photo")
+
+    # Project and packagings are resolved once for the whole batch
+    project = await crud.get_user_project(db, project_id, user_id, load_photos=False)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    display_name = project_title or project.name
+
+    results = {}
+    items = []
+    for index, raw in enumerate(raw_items):
+        try:
+            items.append((index, schemas.PhotoBatchItem.model_validate(raw)))
+        except ValidationError as e:
+            client_id = raw.get("clientId") if isinstance(raw, dict) else None
+            results[index] = schemas.PhotoBatchResult(index=index, client_id=client_id, status="failed", error=f"Invalid metadata: {e.errors()[0]['msg']}")
+
+    packagings = {}
+    for _, item in items:
+        key = (normalize_packaging_id(item.packaging_id), item.packaging_name)
+        if key not in packagings:
+            packagings[key] = await resolve_packaging(db, *key)
+
+    # One job per worker keeps part of the pool's queue free for single uploads
+    slots = asyncio.Semaphore(compositing_executor.workers)
+    # The session is shared by the items' tasks, which may only use it one at a time
+    db_lock = asyncio.Lock()
+    # Items with the same content and overlay share the photo of the first one to get hashed
+    first_by_hash = {}
+
+    async def process(index: int, item: schemas.PhotoBatchItem):
+        filename = f"photo-{uuid.uuid4()}.jpg"
+        overlay = {
+            "project_name": display_name,
+            "comment": item.comment,
+            "stickers": item.stickers,
+            "latitude": item.latitude,
+            "longitude": item.longitude,
+            "captured_at": item.captured_at,
+            "packaging_info": packagings[(normalize_packaging_id(item.packaging_id), item.packaging_name)],
+            "hide_date": item.hide_date,
+        }
+        hasher = hashlib.sha256()
+        lazy = PHOTO_RENDER_MODE == "lazy"
+        async with slots:
+            if lazy:
+                # The original is what gets stored, so it is spooled straight to its staging file
+                upload_path = photo_storage.staging_path(filename)
+                await asyncio.to_thread(write_stream, photos[index].file, upload_path, hasher=hasher)
+            else:
+                upload_path = await asyncio.to_thread(write_temp_stream, photos[index].file, hasher=hasher)
+            keep_upload = False
+            try:
+                content_hash = upload_hash(hasher, project_id, overlay)
+                if content_hash in first_by_hash:
+                    return first_by_hash[content_hash]
+                first_by_hash[content_hash] = index
+                async with db_lock:
+                    existing = await crud.get_photo_by_content_hash(db, content_hash, user_id)
+                if existing:
+                    # Uploaded before, e.g. by an earlier attempt of this batch
+                    return existing
+                if lazy:
+                    derivatives = None
+                    keep_upload = True
+                else:
+                    derivatives = await composite_when_free(
+                        upload_path, **overlay, output_path=photo_storage.staging_path(filename), derivative_sizes=DERIVATIVE_SIZES
+                    )
+            finally:
+                if not keep_upload:
+                    os.remove(upload_path)
+        await asyncio.to_thread(photo_storage.publish, [filename, *(derivatives or {}).values()])
+        photo_create = schemas.PhotoCreate(
+            filename=filename,
+            project_id=project_id,
+            comment=item.comment,
+            latitude=item.latitude,
+            longitude=item.longitude,
+            stickers=parse_stickers(item.stickers),
+            captured_at=item.captured_at,
+            packaging_id=normalize_packaging_id(item.packaging_id),
+            content_hash=content_hash,
+            overlay=overlay_spec(project.name, project_title, item.stickers, item.captured_at, item.packaging_name, item.hide_date) if lazy else None
+        )
+        return photo_create, filename, derivatives
+
+    outcomes = await asyncio.gather(*(process(index, item) for index, item in items), return_exceptions=True)
+
+    created = []
+    duplicates = []
+    for (index, item), outcome in zip(items, outcomes):
+        if isinstance(outcome, BaseException):
+            error = "Server is busy processing photos" if isinstance(outcome, CompositingBusy) else "Could not process photo"
+            print(f"Batch item {index} failed: {outcome!r}")
+            results[index] = schemas.PhotoBatchResult(index=index, client_id=item.client_id, status="failed", error=error)
+        elif isinstance(outcome, int):
+            # Index of an identical item earlier in the processing order
+            duplicates.append((index, item, outcome))
+        elif isinstance(outcome, models.Photo):
+            results[index] = schemas.PhotoBatchResult(
+                index=index, client_id=item.client_id, status="created", replayed=True, photo=schemas.Photo.model_validate(outcome)
+            )
+        else:
+            created.append((index, item, outcome))
+
+    if created:
+        # All rows are inserted in one transaction
+        try:
+            with metrics.stage_timer("batch_upload", "db_insert"):
+                db_photos = await crud.create_photos(db, [outcome for _, _, outcome in created], user_id)
+        except Exception as e:
+            print(f"Error saving photo batch: {e}")
+            await db.rollback()
+            files = [name for _, _, (_, filename, derivatives) in created for name in (filename, *(derivatives or {}).values())]
+            await asyncio.to_thread(photo_storage.delete, files)
+            for index, item, _ in created:
+                results[index] = schemas.PhotoBatchResult(index=index, client_id=item.client_id, status="failed", error="Could not save photo")
+        else:
+            for (index, item, _), db_photo in zip(created, db_photos):
+                results[index] = schemas.PhotoBatchResult(
+                    index=index, client_id=item.client_id, status="created", photo=schemas.Photo.model_validate(db_photo)
+                )
+
+    for index, item, first in duplicates:
+        result = results[first]
+        results[index] = result.model_copy(update={"index": index, "client_id": item.client_id, "replayed": result.status == "created"})
+
+    ordered = [results[index] for index in sorted(results)]
+    created_count = sum(1 for result in ordered if result.status == "created")
+    return schemas.PhotoBatchResponse(created=created_count, failed=len(ordered) - created_count, results=ordered)
 
 @router.get("/{photo_id}", response_model=schemas.Photo)
-def read_photo(photo_id: str, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    db_photo = crud.get_photo(db, photo_id=photo_id, user_id=user_id)
+async def read_photo(photo_id: str, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    db_photo = await crud.get_photo(db, photo_id=photo_id, user_id=user_id)
     if db_photo is None:
         raise HTTPException(status_code=404, detail="Photo not found")
     return db_photo
 
-@router.get("/{photo_id}/file")
-def get_photo_file(photo_id: str, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    # Verify access
-    db_photo = crud.get_photo(db, photo_id=photo_id, user_id=user_id)
+@router.get("/{photo_id}/status", response_model=schemas.PhotoStatusResponse)
+async def read_photo_status(
+    photo_id: str,
+    wait: float = Query(0, ge=0, le=30), # Long-poll up to this many seconds while pending
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    db_photo = await crud.get_photo(db, photo_id=photo_id, user_id=user_id)
     if db_photo is None:
         raise HTTPException(status_code=404, detail="Photo not found")
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while db_photo.status == "pending" and deadline > loop.time():
+        # Wake up early when this process finishes the job, otherwise re-check every second
+        await ingest_queue.wait_for(photo_id, min(1.0, deadline - loop.time()))
+        await db.refresh(db_photo)
+    return db_photo
+
+@router.get("/{photo_id}/file")
+async def get_photo_file(
+    request: Request,
+    photo_id: str,
+    size: str = "full", # "full" or a DERIVATIVE_SIZES name such as "thumb" / "preview"
+    v: Optional[str] = None, # Photo.version; makes the response cacheable forever
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    if size != "full" and size not in DERIVATIVE_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown size '{size}'")
+
+    # Verify access; ready rows are cached so conditional GETs don't reach the database.
+    # A ?v= other than the cached version means the photo was edited since, possibly by another process
+    cache_key = (user_id, photo_id)
+    entry = photo_file_cache.get(cache_key)
+    if entry is None or (v and v != entry["version"]):
+        db_photo = await crud.get_photo(db, photo_id=photo_id, user_id=user_id)
+        if db_photo is None:
+            raise HTTPException(status_code=404, detail="Photo not found")
+        if db_photo.status == "pending":
+            raise HTTPException(status_code=409, detail="Photo is still being processed")
+        entry = {
+            "filename": db_photo.filename,
+            "derivatives": dict(db_photo.derivatives or {}),
+            "version": file_version(db_photo.filename, db_photo.revision),
+        }
+        if db_photo.overlay is not None:
+            spec = await photo_render_spec(db, db_photo)
+            entry["render"] = (render_key(db_photo.filename, spec), spec)
+        if db_photo.status == "ready":
+            photo_file_cache.set(cache_key, entry)
+
+    cache_control = IMMUTABLE_CACHE_CONTROL if v and v == entry["version"] else REVALIDATE_CACHE_CONTROL
+    if "render" in entry:
+        return await rendered_file_response(request, entry, size, cache_control)
+
+    filename = entry["filename"] if size == "full" else entry["derivatives"].get(size)
+    if filename and etag_matches(request, etag_for(filename)):
+        return not_modified(etag_for(filename), cache_control)
     
-    filepath = os.path.join(UPLOAD_DIR, db_photo.filename)
-    if not os.path.exists(filepath):
+    stat = await asyncio.to_thread(photo_storage.stat, filename) if filename else None
+    if stat is None and size != "full":
+        # Photos stored before derivatives existed are backfilled on first request
+        full_stat = await asyncio.to_thread(photo_storage.stat, entry["filename"])
+        if full_stat is not None:
+            try:
+                derivatives = await backfill_derivatives(entry["filename"])
+            except CompositingBusy:
+                # Serving the full image beats failing a gallery tile
+                return cached_file_response(
+                    request, photo_storage, entry["filename"], full_stat, etag_for(entry["filename"]), REVALIDATE_CACHE_CONTROL
+                )
+            await crud.set_photo_derivatives(db, photo_id, derivatives)
+            photo_file_cache.pop(cache_key)
+            filename = derivatives[size]
+            stat = await asyncio.to_thread(photo_storage.stat, filename)
+    if stat is None:
+        photo_file_cache.pop(cache_key)
         raise HTTPException(status_code=404, detail="File not found on server")
-        
-    return FileResponse(filepath)
+
+    return cached_file_response(request, photo_storage, filename, stat, etag_for(filename), cache_control)
+
+async def rendered_file_response(request: Request, entry: dict, size: str, cache_control: str):
+    """Serves a size of a photo kept as its original, rendering it into the render cache on a miss."""
+    key, spec = entry["render"]
+    name = render_cache.names(key)[size]
+    etag = etag_for(name)
+    if etag_matches(request, etag):
+        return not_modified(etag, cache_control)
+
+    stat = await asyncio.to_thread(render_cache.stat, name)
+    if stat is None:
+        try:
+            await render_photo(key, entry["filename"], spec)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found on server")
+        except CompositingBusy:
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy processing photos, please retry shortly",
+                headers={"Retry-After": str(COMPOSITE_RETRY_AFTER)}
+            )
+        stat = await asyncio.to_thread(render_cache.stat, name)
+        if stat is None:
+            raise HTTPException(status_code=404, detail="File not found on server")
+    render_cache.touch(name)
+    return cached_file_response(request, render_cache, name, stat, etag, cache_control)
+
+async def render_photo(key: str, source_name: str, spec: dict):
+    task = renders_in_flight.get(key)
+    if task is None:
+        task = renders_in_flight[key] = asyncio.ensure_future(_render(key, source_name, spec))
+        task.add_done_callback(lambda _: renders_in_flight.pop(key, None))
+    # Shielded so a client going away doesn't cancel a render other requests are waiting for
+    await asyncio.shield(task)
+
+async def _render(key: str, source_name: str, spec: dict):
+    source = await asyncio.to_thread(photo_storage.fetch, source_name)
+    if source is None:
+        raise FileNotFoundError(source_name)
+    names = render_cache.names(key)
+    try:
+        # Every size is rendered at once; derivatives are downscaled from the fresh composite
+        with metrics.stage_timer("render", "composite"):
+            derivatives = await composite_when_free(
+                source, **spec, output_path=render_cache.staging_path(names["full"]), derivative_sizes=DERIVATIVE_SIZES
+            )
+    finally:
+        await asyncio.to_thread(photo_storage.release, source)
+    await asyncio.to_thread(render_cache.store, [names["full"], *derivatives.values()])
+
+async def backfill_derivatives(filename: str) -> dict:
+    source = await asyncio.to_thread(photo_storage.fetch, filename)
+    try:
+        derivatives = await run_generate_derivatives(source, output_path=photo_storage.staging_path(filename))
+    finally:
+        await asyncio.to_thread(photo_storage.release, source)
+    await asyncio.to_thread(photo_storage.publish, derivatives.values())
+    return derivatives
+
+@router.patch("/{photo_id}", response_model=schemas.Photo)
+async def update_photo(photo_id: str, photo: schemas.PhotoUpdate, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    db_photo = await crud.get_photo(db, photo_id=photo_id, user_id=user_id)
+    if db_photo is None:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    if db_photo.overlay is None:
+        raise HTTPException(status_code=409, detail="Photo was stored with its overlay drawn in and can't be edited")
+
+    project = await crud.get_user_project(db, db_photo.project_id, user_id, load_photos=False)
+    old_key = render_key(db_photo.filename, await photo_render_spec(db, db_photo, project))
+
+    # Fields that are columns of the photo; the rest belong to the overlay spec
+    changes = photo.model_dump(exclude_unset=True)
+    columns = {key: changes.pop(key) for key in ("comment", "latitude", "longitude") if key in changes}
+    if "packaging_id" in changes:
+        columns["packaging_id"] = normalize_packaging_id(changes.pop("packaging_id"))
+    if "stickers" in changes:
+        changes["stickers"] = changes["stickers"] or []
+        columns["stickers"] = [s.model_dump() for s in parse_stickers(changes["stickers"])]
+    if "hide_date" in changes:
+        changes["hide_date"] = bool(changes["hide_date"])
+    if "project_title" in changes and project and changes["project_title"] == project.name:
+        # As in overlay_spec: the project's own name isn't pinned
+        changes["project_title"] = None
+
+    db_photo = await crud.update_photo(db, db_photo, columns, changes)
+    photo_file_cache.pop((user_id, photo_id))
+    await asyncio.to_thread(render_cache.discard, old_key)
+    return db_photo
 
 @router.delete("/{photo_id}", status_code=204)
-def delete_photo(photo_id: str, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    db_photo = crud.get_photo(db, photo_id=photo_id, user_id=user_id)
+async def delete_photo(photo_id: str, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    db_photo = await crud.get_photo(db, photo_id=photo_id, user_id=user_id)
     if db_photo:
-        filepath = os.path.join(UPLOAD_DIR, db_photo.filename)
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except OSError:
-                pass # Fail silently if file already gone
-        crud.delete_photo(db, photo_id=photo_id, user_id=user_id)
+        filenames = [db_photo.filename, *(db_photo.derivatives or {}).values()]
+        await asyncio.to_thread(photo_storage.delete, filenames)
+        if db_photo.overlay is not None:
+            await asyncio.to_thread(render_cache.discard, render_key(db_photo.filename, await photo_render_spec(db, db_photo)))
+        await crud.delete_photo(db, photo_id=photo_id, user_id=user_id)
+        photo_file_cache.pop((user_id, photo_id))
     return None
@@ -1,11 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+import asyncio
+import os
 
-import crud
+import crud_async as crud
 import models
 import schemas
-from database import get_db
+from database import get_async_db
+from pagination import decode_cursor, paginate, NEXT_CURSOR_HEADER, NEXT_CURSOR_RESPONSES
+from response_cache import response_cache
+from storage import photo_storage
+from project_export import stream_project_zip, content_disposition
+from rendering import render_spec, render_key, render_cache
+from routers.photos import photo_file_cache, resolve_packaging
 
 # Hardcoded User ID for now (as requested)
 # In a real app, this would come from a dependency parsing a token
@@ -20,61 +30,127 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-@router.get("", response_model=List[schemas.Project])
-def read_projects(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    projects = crud.get_projects(db, user_id=user_id, skip=skip, limit=limit)
-    return projects
+project_summaries = TypeAdapter(List[schemas.ProjectSummary])
 
-@router.get("/{project_id}", response_model=schemas.Project)
-def read_project(project_id: str, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    db_project = crud.get_user_project(db, project_id=project_id, user_id=user_id)
+@router.get("", response_model=List[schemas.ProjectSummary], responses=NEXT_CURSOR_RESPONSES)
+async def read_projects(request: Request, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, include: Optional[str] = Query(None, pattern="^photos$"), db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    # Summaries carry photo counts and a cover photo; full photo lists only with ?include=photos.
+    # Served from the response cache until crud changes one of the user's projects or photos
+    async def produce():
+        response = Response()
+        # One extra row tells paginate() whether there is a next page
+        projects = await crud.get_project_summaries(
+            db, user_id=user_id, skip=skip, limit=limit + 1,
+            cursor=decode_cursor(cursor) if cursor else None,
+            include_photos=include == "photos"
+        )
+        page = paginate(projects, limit, response)
+        headers = {NEXT_CURSOR_HEADER: response.headers[NEXT_CURSOR_HEADER]} if NEXT_CURSOR_HEADER in response.headers else {}
+        return project_summaries.dump_json(page, by_alias=True), headers
+
+    params = {"skip": skip, "limit": limit, "cursor": cursor, "include": include}
+    return await response_cache.respond(request, "projects", user_id, params, produce)
+
+@router.get("/{project_id}", response_model=schemas.ProjectSummary)
+async def read_project(project_id: str, include: Optional[str] = Query(None, pattern="^photos$"), db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    db_project = await crud.get_project_summary(db, project_id=project_id, user_id=user_id, include_photos=include == "photos")
     if db_project is None:
         raise HTTPException(status_code=404, detail="Project not found")
     return db_project
 
 @router.post("", response_model=schemas.Project)
-def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    return crud.create_project(db=db, project=project, user_id=user_id)
+async def create_project(project: schemas.ProjectCreate, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    return await crud.create_project(db=db, project=project, user_id=user_id)
 
-@router.patch("/{project_id}", response_model=schemas.Project)
-def update_project(project_id: str, project: schemas.ProjectCreate, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    db_project = crud.update_project(db, project_id=project_id, project=project, user_id=user_id)
+@router.patch("/{project_id}", response_model=schemas.ProjectSummary)
+async def update_project(project_id: str, project: schemas.ProjectCreate, db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)):
+    # Answers with the summary (photo count, cover photo) rather than every photo of the project
+    db_project, renamed_photo_ids = await crud.update_project(db, project_id=project_id, project=project, user_id=user_id)
     if db_project is None:
         raise HTTPException(status_code=404, detail="Project not found")
-    return db_project
+    # Cached /file lookups of the photos drawn with the old name hold its render spec
+    for photo_id in renamed_photo_ids:
+        photo_file_cache.pop((user_id, photo_id))
+    return await crud.get_project_summary(db, project_id=project_id, user_id=user_id)
 
-@router.delete("/{project_id}", status_code=204)
-def delete_project(project_id: str, transfer_project_id: str = None, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    # Check if project has photos (scoped by user)
-    photos = crud.get_photos(db, user_id=user_id, project_id=project_id)
-    
-    if photos and len(photos) > 0:
-        # If there are photos, a transfer project must be specified
-        if not transfer_project_id:
-            raise HTTPException(
-                status_code=400, 
-                detail="Project has photos. Please specify transfer_project_id to move photos before deletion."
-            )
-        
+@router.delete("/{project_id}", response_model=schemas.ProjectDeleteResult)
+async def delete_project(
+    project_id: str,
+    transfer_project_id: str = None,
+    delete_photos: bool = False, # Delete the photos with the project instead of transferring them
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    project = await crud.get_project_summary(db, project_id=project_id, user_id=user_id)
+    if project is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if transfer_project_id:
+        if transfer_project_id == project_id:
+            raise HTTPException(status_code=400, detail="Cannot transfer photos to the project being deleted")
         # Verify transfer project exists and belongs to user
-        transfer_project = crud.get_user_project(db, project_id=transfer_project_id, user_id=user_id)
+        transfer_project = await crud.get_project_summary(db, project_id=transfer_project_id, user_id=user_id)
         if not transfer_project:
             raise HTTPException(status_code=404, detail="Transfer project not found")
-        
-        # Transfer all photos to the new project
-        for photo in photos:
-            photo.project_id = transfer_project_id
-        db.commit()
-    
-    # Now delete the project
-    crud.delete_project(db, project_id=project_id, user_id=user_id)
-    return None
-
-@router.get("/{project_id}/photos", response_model=List[schemas.Photo])
-def read_project_photos(project_id: str, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    elif project.photo_count and not delete_photos:
+        # If there are photos, a transfer project must be specified
+        raise HTTPException(
+            status_code=400,
+            detail="Project has photos. Please specify transfer_project_id to move photos before deletion, or delete_photos=true."
+        )
+
+    # Renders of photos kept as originals name this project, whether the photos move or go.
+    # Their keys come from the photos' metadata, which is gone after the delete
+    rendered = await crud.get_rendered_photo_specs(db, project_id=project_id, user_id=user_id)
+    packagings = {}
+    for photo in rendered:
+        if photo.packaging_id not in packagings:
+            packagings[photo.packaging_id] = await resolve_packaging(db, photo.packaging_id)
+    render_keys = [render_key(photo.filename, render_spec(photo, project.name, packagings[photo.packaging_id])) for photo in rendered]
+
+    # Transfer, photo deletion and project deletion run as single statements in one transaction
+    result = await crud.delete_project(db, project_id=project_id, user_id=user_id, transfer_project_id=transfer_project_id)
+    for photo_id in {*result["photo_ids"], *(photo.id for photo in rendered)}:
+        photo_file_cache.pop((user_id, photo_id))
+    if render_keys:
+        await asyncio.to_thread(render_cache.discard, *render_keys)
+    if result["filenames"]:
+        await asyncio.to_thread(photo_storage.delete, result["filenames"])
+    return result
+
+@router.get("/{project_id}/photos", response_model=List[schemas.Photo], responses=NEXT_CURSOR_RESPONSES)
+async def read_project_photos(
+    project_id: str,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100, # Follow X-Next-Cursor for the rest
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
     # First verify project access
-    project = crud.get_user_project(db, project_id=project_id, user_id=user_id)
+    project = await crud.get_user_project(db, project_id=project_id, user_id=user_id, load_photos=False)
+    if not project:
+         raise HTTPException(status_code=404, detail="Project not found")
+
+    # One extra row tells paginate() whether there is a next page
+    photos = await crud.get_photos(db, user_id=user_id, project_id=project_id, skip=skip, limit=limit + 1, cursor=decode_cursor(cursor) if cursor else None)
+    return paginate(photos, limit, response)
+
+@router.get("/{project_id}/export")
+async def export_project(
+    project_id: str,
+    manifest: str = Query("json", pattern="^(json|csv)$"),
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    project = await crud.get_user_project(db, project_id=project_id, user_id=user_id, load_photos=False)
     if not project:
          raise HTTPException(status_code=404, detail="Project not found")
 
-    return crud.get_photos(db, user_id=user_id, project_id=project_id)
+    # No Content-Length: the archive is built while it is sent, using chunked transfer
+    return StreamingResponse(
+        stream_project_zip(project_id, user_id, photo_storage, manifest, project.name),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(project.name)}
+    )
@@ -1,8 +1,10 @@
-from pydantic import BaseModel, ConfigDict, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator, computed_field
 from pydantic.alias_generators import to_camel
-from typing import List, Optional, Literal, Any
+from typing import List, Dict, Optional, Literal, Any
 from datetime import datetime, timezone
 
+from storage import file_version
+
 class CamelModel(BaseModel):
     model_config = ConfigDict(
         alias_generator=to_camel,
@@ -10,7 +12,7 @@ class CamelModel(BaseModel):
         from_attributes=True
     )
 
-    @field_validator('created_at', 'updated_at', check_fields=False)
+    @field_validator('created_at', 'updated_at', 'last_photo_at', check_fields=False)
     def set_utc_timezone(cls, v):
         if isinstance(v, datetime) and v.tzinfo is None:
             return v.replace(tzinfo=timezone.utc)
@@ -54,6 +56,11 @@ class PhotoCreate(PhotoBase):
     captured_at: Optional[str] = None
     packaging_id: Optional[str] = None
     user_id: Optional[int] = None # Optional in request, filled by backend
+    content_hash: Optional[str] = None # Filled by the upload endpoints
+    idempotency_key: Optional[str] = None
+    overlay: Optional[Dict[str, Any]] = None # Set when the original is stored and rendered on demand
+
+PhotoStatus = Literal["pending", "ready", "failed"]
 
 class Photo(PhotoBase):
     id: str
@@ -61,6 +68,54 @@ class Photo(PhotoBase):
     user_id: int
     created_at: datetime
     packaging_id: Optional[str] = None
+    status: PhotoStatus = "ready"
+    derivatives: Optional[Dict[str, str]] = None
+    revision: Optional[int] = Field(0, exclude=True)
+
+    @computed_field
+    @property
+    def version(self) -> str:
+        # Pass as ?v= to /file to get an immutable, cache-forever response
+        return file_version(self.filename, self.revision)
+
+class PhotoUpdate(CamelModel):
+    """Edits to what is drawn on a photo; only the fields sent are changed."""
+    comment: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    stickers: Optional[List[Dict[str, Any]]] = None
+    packaging_id: Optional[str] = None
+    packaging_name: Optional[str] = None
+    hide_date: Optional[bool] = None
+    project_title: Optional[str] = None
+
+class PhotoBatchItem(CamelModel):
+    client_id: Optional[str] = None # Echoed back so the client can match results to its photos
+    comment: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    stickers: List[Dict[str, Any]] = []
+    captured_at: Optional[str] = None
+    packaging_id: Optional[str] = None
+    packaging_name: Optional[str] = None
+    hide_date: bool = False
+
+class PhotoBatchResult(CamelModel):
+    index: int
+    client_id: Optional[str] = None
+    status: Literal["created", "failed"]
+    replayed: bool = False # The photo already existed from an earlier upload of the same content
+    photo: Optional[Photo] = None
+    error: Optional[str] = None
+
+class PhotoBatchResponse(CamelModel):
+    created: int
+    failed: int
+    results: List[PhotoBatchResult]
+
+class PhotoStatusResponse(CamelModel):
+    id: str
+    status: PhotoStatus
 
 class ProjectBase(CamelModel):
     name: str
@@ -76,6 +131,20 @@ class Project(ProjectBase):
     updated_at: datetime
     photos: List[Photo] = []
 
+class ProjectSummary(ProjectBase):
+    id: str
+    user_id: int
+    created_at: datetime
+    updated_at: datetime
+    photo_count: int = 0
+    last_photo_at: Optional[datetime] = None
+    cover_photo_id: Optional[str] = None # Latest ready photo
+    photos: Optional[List[Photo]] = None # Only with ?include=photos
+
+class ProjectDeleteResult(CamelModel):
+    transferred_photos: int
+    deleted_photos: int
+
 class PackagingBase(CamelModel):
     name: str
     color: str
@@ -1,13 +1,18 @@
 from database import engine, SessionLocal
+from migrations import run_migrations
+from packaging_catalog import packaging_catalog, PACKAGES_DIR
+from response_cache import response_cache
+import crud
 import models
 import os
 
-def init_db():
+def migrate():
     print("Creating database tables...")
     models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
     print("Database tables created successfully.")
 
-    # Create the hardcoded user if it doesn't exist
+def seed_data():
     db = SessionLocal()
     try:
         # Create the hardcoded user if it doesn't exist
@@ -31,29 +36,14 @@ def init_db():
         else:
             print("Default user already exists.")
 
-        # Seed builtin packagings
-        builtin_dir = os.path.join(os.path.dirname(__file__), "assets", "packages", "builtin")
-        if os.path.exists(builtin_dir):
-            print(f"Scanning for builtin packagings in {builtin_dir}...")
-            for filename in os.listdir(builtin_dir):
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    pkg_id = f"builtin:{filename}"
-                    existing_pkg = db.query(models.Packaging).filter(models.Packaging.id == pkg_id).first()
-                    
-                    if not existing_pkg:
-                        print(f"Creating builtin packaging: {pkg_id}")
-                        name = os.path.splitext(filename)[0].capitalize()
-                        new_pkg = models.Packaging(
-                            id=pkg_id,
-                            user_id=None, # System/builtin packaging
-                            name=name,
-                            color=filename # Storing filename as 'color' based on router logic
-                        )
-                        db.add(new_pkg)
-            db.commit()
-            print("Builtin packagings seeded.")
+        # Seed builtin packagings from the catalog in a single upsert
+        packagings = packaging_catalog.builtin()
+        if packagings:
+            crud.upsert_builtin_packagings(db, packagings)
+            response_cache.invalidate_sync("builtin-packagings")
+            print(f"{len(packagings)} builtin packagings seeded.")
         else:
-            print(f"Builtin packages directory not found at {builtin_dir}")
+            print(f"No builtin packagings found in {os.path.join(PACKAGES_DIR, 'builtin')}")
 
     except Exception as e:
         print(f"Error seeding database: {e}")
@@ -61,5 +51,9 @@ def init_db():
     finally:
         db.close()
 
+def init_db():
+    migrate()
+    seed_data()
+
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,282 @@
+from contextlib import contextmanager
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+from typing import NamedTuple
+
+# Uploads and processed files are copied in chunks of this size
+CHUNK_SIZE = 1024 * 1024
+
+def file_version(filename: str, revision: int = 0) -> str:
+    """
+    Short content version for a stored file; files are written once under a unique name.
+    `revision` counts edits to the overlay of a photo rendered from its original.
+    """
+    key = f"{filename}#{revision}" if revision else filename
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+@contextmanager
+def atomic_path(path: str):
+    """
+    Yields a temporary path next to `path`; it is renamed over `path` when the block succeeds
+    and removed when it fails, so readers never observe a partially written file.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # Not created via mkstemp so the final file keeps the usual umask-based permissions
+    tmp_path = os.path.join(directory, f".tmp-{uuid.uuid4().hex}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def write_stream(src, path: str, chunk_size: int = CHUNK_SIZE, hasher=None) -> int:
+    """
+    Copies the file-like `src` to `path` chunk by chunk; returns the number of bytes written.
+    The chunks are also fed to the hashlib object `hasher` when given.
+    """
+    size = 0
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                size += len(chunk)
+    return size
+
+def remove_files(paths):
+    """Removes files, ignoring ones that are already gone."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def write_temp_stream(src, suffix: str = ".upload", chunk_size: int = CHUNK_SIZE, hasher=None) -> str:
+    """Spools `src` to a new file in the system temp dir, feeding `hasher` if given; the caller removes it."""
+    fd, tmp_path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+# Where processed photos and their derivatives are kept: "local" or "s3"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+# Root directory of the local backend; also where older flat uploads are found
+STORAGE_DIR = os.getenv("STORAGE_DIR", "uploads")
+# Levels of two-hex-digit directories (or key prefixes) files are spread over
+STORAGE_SHARD_DEPTH = int(os.getenv("STORAGE_SHARD_DEPTH", "2"))
+# S3-compatible backend (AWS, MinIO, ...); credentials come from the usual AWS_* variables
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_PREFIX = os.getenv("S3_PREFIX", "photos/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+# Local scratch space where the S3 backend composites files before uploading them
+STORAGE_STAGING_DIR = os.getenv("STORAGE_STAGING_DIR", os.path.join(tempfile.gettempdir(), "auditlens-staging"))
+
+class FileStat(NamedTuple):
+    st_size: int
+    st_mtime: float
+
+def shard_path(name: str, depth: int = STORAGE_SHARD_DEPTH) -> str:
+    """`name` under directories taken from its hash, e.g. "3f/a2/photo-....jpg"."""
+    digest = hashlib.sha256(name.encode()).hexdigest()
+    return "/".join([digest[2 * i:2 * i + 2] for i in range(depth)] + [name])
+
+def _ensure_staging_dir(store) -> str:
+    # Created on first use rather than in __init__, so importing this module writes nothing
+    if not store._staging_ready:
+        os.makedirs(store.staging_dir, exist_ok=True)
+        store._staging_ready = True
+    return store.staging_dir
+
+def _check_name(name: str):
+    # Names come from the database, but never let one escape the storage root
+    if not name or "/" in name or "\\" in name or name.startswith("."):
+        raise ValueError(f"Invalid stored file name: {name!r}")
+
+class LocalStorage:
+    """
+    Files under STORAGE_DIR, sharded by the hash of their name so no directory grows
+    past a few thousand entries. Files are composited into a staging directory on the
+    same filesystem and renamed into place, so readers never see partial files.
+    """
+
+    def __init__(self, root: str = STORAGE_DIR, depth: int = STORAGE_SHARD_DEPTH):
+        self.root = root
+        self.depth = depth
+        self.staging_dir = os.path.join(root, ".staging")
+        self._staging_ready = False
+
+    def _path(self, name: str) -> str:
+        _check_name(name)
+        return os.path.join(self.root, shard_path(name, self.depth))
+
+    def local_path(self, name: str) -> str | None:
+        """Path of a stored file, falling back to the flat layout used before sharding."""
+        path = self._path(name)
+        if os.path.exists(path):
+            return path
+        legacy = os.path.join(self.root, name)
+        return legacy if os.path.exists(legacy) else None
+
+    def staging_path(self, name: str) -> str:
+        _check_name(name)
+        return os.path.join(_ensure_staging_dir(self), name)
+
+    def publish(self, names):
+        """Moves staged files into their shards."""
+        for name in names:
+            path = self._path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.staging_path(name), path)
+
+    def stat(self, name: str):
+        path = self.local_path(name)
+        return os.stat(path) if path else None
+
+    def iter_range(self, name: str, start: int, end: int, chunk_size: int = CHUNK_SIZE):
+        """Yields bytes start..end (inclusive) of a stored file."""
+        with open(self.local_path(name) or self._path(name), "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def fetch(self, name: str) -> str | None:
+        """A local path to read the file from; pass it to release() when done."""
+        return self.local_path(name)
+
+    def release(self, path: str):
+        pass
+
+    def delete(self, names):
+        remove_files([path for name in names for path in (self._path(name), os.path.join(self.root, name))])
+
+class S3Storage:
+    """
+    Files in an S3-compatible bucket under sharded keys. A PUT only becomes visible once
+    complete, so uploading the finished staged file plays the part of the rename.
+    """
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, depth: int = STORAGE_SHARD_DEPTH,
+                 endpoint_url: str | None = S3_ENDPOINT_URL, region: str | None = S3_REGION, staging_dir: str = STORAGE_STAGING_DIR):
+        if not bucket:
+            raise ValueError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.depth = depth
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.staging_dir = staging_dir
+        self._staging_ready = False
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Created on first use: compositing workers import this module but never touch the bucket
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    self._client = boto3.client("s3", endpoint_url=self.endpoint_url, region_name=self.region)
+        return self._client
+
+    def _key(self, name: str) -> str:
+        _check_name(name)
+        return self.prefix + shard_path(name, self.depth)
+
+    def local_path(self, name: str) -> str | None:
+        return None
+
+    def staging_path(self, name: str) -> str:
+        _check_name(name)
+        return os.path.join(_ensure_staging_dir(self), name)
+
+    def publish(self, names):
+        for name in names:
+            path = self.staging_path(name)
+            self.client.upload_file(path, self.bucket, self._key(name), ExtraArgs={"ContentType": "image/jpeg"})
+            os.remove(path)
+
+    def stat(self, name: str):
+        from botocore.exceptions import ClientError
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return FileStat(head["ContentLength"], head["LastModified"].timestamp())
+
+    def iter_range(self, name: str, start: int, end: int, chunk_size: int = CHUNK_SIZE):
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(name), Range=f"bytes={start}-{end}")["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def fetch(self, name: str) -> str | None:
+        path = os.path.join(_ensure_staging_dir(self), f".fetch-{uuid.uuid4().hex}-{name}")
+        try:
+            self.client.download_file(self.bucket, self._key(name), path)
+        except Exception as e:
+            print(f"Error fetching {name} from S3: {e}")
+            remove_files([path])
+            return None
+        return path
+
+    def release(self, path: str):
+        remove_files([path])
+
+    def delete(self, names):
+        keys = [{"Key": self._key(name)} for name in names]
+        # DeleteObjects accepts up to 1000 keys per call
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys[i:i + 1000], "Quiet": True})
+
+def create_storage():
+    if STORAGE_BACKEND == "s3":
+        return S3Storage()
+    if STORAGE_BACKEND == "local":
+        return LocalStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r} (expected 'local' or 's3')")
+
+photo_storage = create_storage()
+
+def migrate_flat_uploads(root: str = STORAGE_DIR) -> int:
+    """Moves files written before sharding from the top of `root` into the local backend's shards."""
+    store = LocalStorage(root)
+    names = [entry.name for entry in os.scandir(root) if entry.is_file() and not entry.name.startswith(".")]
+    for name in names:
+        os.replace(os.path.join(root, name), store.staging_path(name))
+        store.publish([name])
+    return len(names)
+
+if __name__ == "__main__":
+    print(f"Moved {migrate_flat_uploads()} files into shards under {STORAGE_DIR}")
@@ -0,0 +1,92 @@
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Configuration is read at import, so point everything at a scratch directory before the app loads.
+# DATABASE_URL is SQLite (the async engine uses aiosqlite); an empty INSTANCE_CONNECTION_NAME
+# keeps a developer's .env from selecting Cloud SQL
+DATA_DIR = tempfile.mkdtemp(prefix="auditlens-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(DATA_DIR, 'test.db')}",
+    "INSTANCE_CONNECTION_NAME": "",
+    "STORAGE_BACKEND": "local",
+    "STORAGE_DIR": os.path.join(DATA_DIR, "uploads"),
+    "RENDER_CACHE_DIR": os.path.join(DATA_DIR, "render_cache"),
+    "INGEST_DIR": os.path.join(DATA_DIR, "incoming"),
+    "COMPOSITE_WORKERS": "2",
+    "METRICS_ENABLED": "false",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import models
+import seed
+from compositing import compositing_executor
+from database import SessionLocal, engine, async_engine
+from ingest_queue import ingest_queue
+from routers import projects, photos, packagings
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # main.py's startup and shutdown, without the frontend build it serves
+    seed.init_db()
+    await ingest_queue.start()
+    yield
+    await ingest_queue.stop()
+    await async_engine.dispose()
+    engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+for module in (projects, photos, packagings):
+    app.include_router(module.router)
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+    compositing_executor.shutdown()
+
+@pytest.fixture
+def as_user(client):
+    """Makes the client act as another user, created on first use."""
+    def switch(user_id: int):
+        with SessionLocal() as db:
+            if db.get(models.User, user_id) is None:
+                db.add(models.User(id=user_id, telegram_id=f"test_user_{user_id}", first_name="Test", is_bot=False))
+                db.commit()
+        for module in (projects, photos, packagings):
+            app.dependency_overrides[module.get_current_user_id] = lambda: user_id
+    yield switch
+    app.dependency_overrides.clear()
+
+@pytest.fixture
+def lazy_rendering(monkeypatch):
+    # Uploads keep the original plus its overlay spec, rendered by /file on demand
+    monkeypatch.setattr(photos, "PHOTO_RENDER_MODE", "lazy")
+
+def jpeg(width: int = 320, height: int = 240, color: str = "red") -> bytes:
+    """A distinct image per size and color, so uploads don't deduplicate unless meant to."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def create_project(client, name: str = "Project") -> str:
+    response = client.post("/api/projects", json={"name": name})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+def upload(client, project_id: str, image: bytes, headers: dict = None, **fields):
+    return client.post(
+        "/api/photos",
+        data={"project_id": project_id, **fields},
+        files={"photo": ("photo.jpg", image, "image/jpeg")},
+        headers=headers or {},
+    )
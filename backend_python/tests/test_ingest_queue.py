@@ -0,0 +1,19 @@
+import asyncio
+
+from ingest_queue import IngestQueue
+
+def test_wait_for_leaves_no_events_behind(tmp_path):
+    queue = IngestQueue(directory=str(tmp_path))
+
+    async def scenario():
+        # One long-poll times out (job finished elsewhere); two others are woken by the job finishing
+        await queue.wait_for("elsewhere", 0.01)
+        waiters = [asyncio.create_task(queue.wait_for("here", 5)) for _ in range(2)]
+        await asyncio.sleep(0)
+        queue._notify("here")
+        await asyncio.wait_for(asyncio.gather(*waiters), 1)
+        # Finishing with nobody waiting creates nothing
+        queue._notify("unwatched")
+
+    asyncio.run(scenario())
+    assert queue._events == {}
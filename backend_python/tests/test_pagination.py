@@ -0,0 +1,74 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import models
+from database import SessionLocal
+from pagination import encode_cursor, decode_cursor, NEXT_CURSOR_HEADER
+
+def add_photos(user_id: int, timestamps: list) -> str:
+    """
+    Inserts photos with the given created_at values into a new project; returns the project id.
+    None leaves created_at to the server default, which SQLite stores without microseconds.
+    """
+    project_id = str(uuid.uuid4())
+    with SessionLocal() as db:
+        db.add(models.Project(id=project_id, user_id=user_id, name="Paged"))
+        for created_at in timestamps:
+            timestamp = {"created_at": created_at} if created_at else {}
+            db.add(models.Photo(user_id=user_id, project_id=project_id, filename=f"photo-{uuid.uuid4()}.jpg", **timestamp))
+        db.commit()
+    return project_id
+
+def fetch_pages(client, url: str, limit: int) -> list:
+    pages, cursor = [], None
+    # Bounded, so a cursor that keeps returning the same page fails instead of hanging
+    for _ in range(50):
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return pages
+    pytest.fail(f"{url} never reached its last page")
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    assert decode_cursor(encode_cursor(created_at, "photo-id")) == (created_at, "photo-id")
+
+@pytest.mark.parametrize("cursor", ["garbage", encode_cursor(datetime(2024, 1, 1), "x")[:-4], "eyJhIjoxfQ", "MTIz"])
+def test_invalid_cursor_is_rejected(client, cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+    assert client.get("/api/photos", params={"cursor": cursor}).status_code == 400
+
+def test_pages_cover_rows_sharing_a_timestamp(client, as_user):
+    as_user(3)
+    base = datetime(2024, 5, 1, 12, 0, 0)
+    # Several rows per timestamp, with and without microseconds, so pages split inside a tie;
+    # the server-default rows all get the insert's timestamp
+    timestamps = [None] * 4 + [base + timedelta(microseconds=500)] * 3 + [base] * 3
+    project_id = add_photos(3, timestamps)
+
+    for url in (f"/api/projects/{project_id}/photos", "/api/photos"):
+        pages = fetch_pages(client, url, limit=3)
+        photos = [photo for page in pages for photo in page]
+        assert [len(page) for page in pages] == [3, 3, 3, 1]
+        assert len({photo["id"] for photo in photos}) == len(timestamps)
+        # Newest first, ties broken by id
+        keys = [(datetime.fromisoformat(photo["createdAt"]), photo["id"]) for photo in photos]
+        assert keys == sorted(keys, reverse=True)
+
+def test_project_photos_default_to_a_bounded_page(client, as_user):
+    as_user(4)
+    project_id = add_photos(4, [datetime(2024, 5, 1) + timedelta(seconds=i) for i in range(105)])
+
+    response = client.get(f"/api/projects/{project_id}/photos")
+    assert len(response.json()) == 100
+    rest = client.get(f"/api/projects/{project_id}/photos", params={"cursor": response.headers[NEXT_CURSOR_HEADER]})
+    assert len(rest.json()) == 5
+    assert NEXT_CURSOR_HEADER not in rest.headers
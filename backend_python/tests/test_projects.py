@@ -0,0 +1,87 @@
+import json
+import uuid
+
+import models
+from database import SessionLocal
+from rendering import render_cache
+from routers.photos import photo_file_cache
+from conftest import jpeg, create_project, upload
+
+STICKERS = json.dumps([{"id": "1", "type": "arrow", "x": 0.5, "y": 0.5, "width": 0.1, "height": 0.1, "rotation": 0}])
+
+def upload_rendered(client, project_id: str, width: int) -> str:
+    """Uploads a photo kept as its original and serves it once, caching its /file lookup."""
+    response = upload(client, project_id, jpeg(width), comment="note", stickers=STICKERS)
+    assert response.status_code == 201
+    photo_id = response.json()["id"]
+    assert client.get(f"/api/photos/{photo_id}/file").status_code == 200
+    return photo_id
+
+def test_rename_evicts_only_that_projects_file_lookups(client, lazy_rendering):
+    renamed = create_project(client, "Before")
+    other = create_project(client, "Other")
+    renamed_photo = upload_rendered(client, renamed, 401)
+    other_photo = upload_rendered(client, other, 402)
+    version = client.get(f"/api/photos/{renamed_photo}").json()["version"]
+
+    response = client.patch(f"/api/projects/{renamed}", json={"name": "After"})
+    assert response.status_code == 200
+    assert response.json()["name"] == "After"
+    assert response.json()["photoCount"] == 1
+
+    assert photo_file_cache.get((1, renamed_photo)) is None
+    assert photo_file_cache.get((1, other_photo)) is not None
+    # The next lookup renders the new name under a new version
+    assert client.get(f"/api/photos/{renamed_photo}").json()["version"] != version
+    assert client.get(f"/api/photos/{renamed_photo}/file").status_code == 200
+    assert photo_file_cache.get((1, renamed_photo))["render"][1]["project_name"] == "After"
+
+def test_rename_keeps_versions_of_composited_photos(client):
+    project_id = create_project(client, "Before")
+    response = upload(client, project_id, jpeg(403))
+    assert response.status_code == 201
+    photo = response.json()
+
+    client.patch(f"/api/projects/{project_id}", json={"name": "After"})
+    assert client.get(f"/api/photos/{photo['id']}").json()["version"] == photo["version"]
+
+def rendered_file_exists(key: str) -> bool:
+    return render_cache.stat(render_cache.names(key)["full"]) is not None
+
+def test_delete_project_reports_counts_and_touches_only_the_owners_photos(client, as_user, lazy_rendering):
+    # Another user's photo, cached and rendered, in a project of their own
+    as_user(5)
+    others_photo = upload_rendered(client, create_project(client, "Theirs"), 404)
+    others_render = photo_file_cache.get((5, others_photo))["render"][0]
+
+    as_user(1)
+    project_id = create_project(client, "Doomed")
+    photo_ids = [upload_rendered(client, project_id, width) for width in (405, 406)]
+    renders = [photo_file_cache.get((1, photo_id))["render"][0] for photo_id in photo_ids]
+    # A row of the other user pointing at this project must survive its deletion
+    stray_id = str(uuid.uuid4())
+    with SessionLocal() as db:
+        db.add(models.Photo(id=stray_id, user_id=5, project_id=project_id, filename=f"photo-{stray_id}.jpg"))
+        db.commit()
+
+    response = client.delete(f"/api/projects/{project_id}", params={"delete_photos": "true"})
+    assert response.status_code == 200
+    assert response.json() == {"transferredPhotos": 0, "deletedPhotos": 2}
+
+    with SessionLocal() as db:
+        assert [db.get(models.Photo, photo_id) for photo_id in photo_ids] == [None, None]
+        assert db.get(models.Photo, stray_id) is not None
+    assert [photo_file_cache.get((1, photo_id)) for photo_id in photo_ids] == [None, None]
+    assert not any(rendered_file_exists(key) for key in renders)
+    assert photo_file_cache.get((5, others_photo)) is not None
+    assert rendered_file_exists(others_render)
+
+def test_delete_project_transfers_photos(client):
+    project_id = create_project(client, "Old")
+    target_id = create_project(client, "New")
+    photo_ids = [upload(client, project_id, jpeg(width)).json()["id"] for width in (407, 408, 409)]
+
+    response = client.delete(f"/api/projects/{project_id}", params={"transfer_project_id": target_id})
+    assert response.json() == {"transferredPhotos": 3, "deletedPhotos": 0}
+    assert {client.get(f"/api/photos/{photo_id}").json()["projectId"] for photo_id in photo_ids} == {target_id}
+    assert client.get(f"/api/projects/{project_id}").status_code == 404
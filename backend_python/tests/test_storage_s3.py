@@ -0,0 +1,74 @@
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from storage import S3Storage, shard_path
+
+BUCKET = "auditlens-test"
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # moto intercepts boto3; fake credentials keep botocore from looking for real ones
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield S3Storage(bucket=BUCKET, prefix="photos/", region="us-east-1", staging_dir=str(tmp_path / "staging"))
+
+def stage(store, name: str, data: bytes):
+    with open(store.staging_path(name), "wb") as f:
+        f.write(data)
+
+def test_staging_dir_is_created_on_first_use(store):
+    assert not os.path.exists(store.staging_dir)
+    store.staging_path("photo-a.jpg")
+    assert os.path.isdir(store.staging_dir)
+
+def test_publish_uploads_under_sharded_key(store):
+    stage(store, "photo-a.jpg", b"jpeg bytes")
+    store.publish(["photo-a.jpg"])
+
+    head = store.client.head_object(Bucket=BUCKET, Key="photos/" + shard_path("photo-a.jpg"))
+    assert head["ContentType"] == "image/jpeg"
+    # The staged copy is removed once uploaded
+    assert not os.path.exists(store.staging_path("photo-a.jpg"))
+
+def test_stat(store):
+    stage(store, "photo-a.jpg", b"0123456789")
+    store.publish(["photo-a.jpg"])
+
+    assert store.stat("photo-a.jpg").st_size == 10
+    assert store.stat("photo-missing.jpg") is None
+
+def test_iter_range(store):
+    stage(store, "photo-a.jpg", b"0123456789")
+    store.publish(["photo-a.jpg"])
+
+    assert b"".join(store.iter_range("photo-a.jpg", 2, 5)) == b"2345"
+    assert b"".join(store.iter_range("photo-a.jpg", 0, 9, chunk_size=3)) == b"0123456789"
+
+def test_fetch_and_release(store):
+    stage(store, "photo-a.jpg", b"jpeg bytes")
+    store.publish(["photo-a.jpg"])
+
+    path = store.fetch("photo-a.jpg")
+    with open(path, "rb") as f:
+        assert f.read() == b"jpeg bytes"
+    store.release(path)
+    assert not os.path.exists(path)
+    assert store.fetch("photo-missing.jpg") is None
+
+def test_delete(store):
+    names = [f"photo-{i}.jpg" for i in range(3)]
+    for name in names:
+        stage(store, name, name.encode())
+    store.publish(names)
+
+    store.delete(names[:2] + ["photo-missing.jpg"])
+    assert [store.stat(name) is None for name in names] == [True, True, False]
+
+def test_rejects_names_outside_the_prefix(store):
+    with pytest.raises(ValueError):
+        store.stat("../photo-a.jpg")
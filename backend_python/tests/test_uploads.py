@@ -0,0 +1,87 @@
+import os
+
+import crud_async
+from ingest_queue import ingest_queue
+from routers.photos import REPLAYED_HEADER
+from conftest import jpeg, create_project, upload
+
+def wait_until_done(client, photo_id: str) -> str:
+    return client.get(f"/api/photos/{photo_id}/status?wait=20").json()["status"]
+
+def test_idempotency_key_replays_the_first_photo(client):
+    project_id = create_project(client)
+    first = upload(client, project_id, jpeg(501), headers={"Idempotency-Key": "key-replay"})
+    assert first.status_code == 201
+
+    # The retry's body isn't looked at once the key is known
+    retry = upload(client, project_id, jpeg(502), headers={"Idempotency-Key": "key-replay"})
+    assert retry.status_code == 200
+    assert retry.headers[REPLAYED_HEADER] == "true"
+    assert retry.json()["id"] == first.json()["id"]
+
+def test_identical_upload_is_deduplicated_by_content(client):
+    project_id = create_project(client)
+    first = upload(client, project_id, jpeg(503), comment="same")
+    assert first.status_code == 201
+
+    same = upload(client, project_id, jpeg(503), comment="same")
+    assert same.status_code == 200
+    assert same.headers[REPLAYED_HEADER] == "true"
+    assert same.json()["id"] == first.json()["id"]
+
+    # A different overlay on the same bytes is a different photo
+    other = upload(client, project_id, jpeg(503), comment="different")
+    assert other.status_code == 201
+    assert other.json()["id"] != first.json()["id"]
+
+def test_failed_ingest_can_be_retried_with_the_same_key(client):
+    project_id = create_project(client)
+    headers = {"Idempotency-Key": "key-failed"}
+    broken = client.post(
+        "/api/photos?ingest=async",
+        data={"project_id": project_id},
+        files={"photo": ("photo.jpg", b"not a jpeg", "image/jpeg")},
+        headers=headers,
+    )
+    assert broken.status_code == 202
+    assert wait_until_done(client, broken.json()["id"]) == "failed"
+
+    retry = client.post(
+        "/api/photos?ingest=async",
+        data={"project_id": project_id},
+        files={"photo": ("photo.jpg", jpeg(504), "image/jpeg")},
+        headers=headers,
+    )
+    assert retry.status_code == 202
+    assert REPLAYED_HEADER not in retry.headers
+    assert retry.json()["id"] != broken.json()["id"]
+    assert wait_until_done(client, retry.json()["id"]) == "ready"
+
+    # The key now belongs to the photo that made it
+    replay = upload(client, project_id, jpeg(505), headers=headers)
+    assert replay.status_code == 200
+    assert replay.json()["id"] == retry.json()["id"]
+
+def test_async_upload_losing_a_key_race_replays_the_winner(client, monkeypatch):
+    project_id = create_project(client)
+    winner = upload(client, project_id, jpeg(506), headers={"Idempotency-Key": "key-race"})
+    assert winner.status_code == 201
+
+    # The first lookup misses, as if the other request hadn't committed yet
+    lookup = crud_async.get_photo_by_idempotency_key
+    calls = []
+    async def racing_lookup(*args):
+        calls.append(args)
+        return None if len(calls) == 1 else await lookup(*args)
+    monkeypatch.setattr(crud_async, "get_photo_by_idempotency_key", racing_lookup)
+
+    loser = client.post(
+        "/api/photos?ingest=async",
+        data={"project_id": project_id},
+        files={"photo": ("photo.jpg", jpeg(507), "image/jpeg")},
+        headers={"Idempotency-Key": "key-race"},
+    )
+    assert loser.status_code == 200
+    assert loser.json()["id"] == winner.json()["id"]
+    # The loser's job was never committed, so its files are gone
+    assert not [name for name in os.listdir(ingest_queue.directory) if not name.startswith(".")]
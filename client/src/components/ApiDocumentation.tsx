@@ -49,6 +49,14 @@ export function ApiDocumentation() {
 ]`}
                 </pre>
               </div>
+              <div className="mt-4">
+                <p className="text-sm font-medium mb-2">Pagination:</p>
+                <p className="text-sm text-muted-foreground">
+                  Newest first, <code>limit</code> (default 100) per page. When more remain, the response
+                  carries an <code>X-Next-Cursor</code> header; pass its value as <code>?cursor=</code> to get
+                  the next page. The body stays a plain array. <code>GET /api/photos</code> pages the same way.
+                </p>
+              </div>
             </CardContent>
           </Card>
 
@@ -90,6 +98,12 @@ export function ApiDocumentation() {
                 <div className="text-primary">GET</div>
                 <div className="mt-1">/api/projects/:projectId/photos</div>
               </div>
+              <div className="mt-4">
+                <p className="text-sm text-muted-foreground">
+                  Paginated like List Projects: up to <code>limit</code> (default 100) photos per page,
+                  with <code>X-Next-Cursor</code> while more remain.
+                </p>
+              </div>
             </CardContent>
           </Card>
         </TabsContent>
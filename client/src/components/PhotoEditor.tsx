@@ -8,6 +8,7 @@ import { LocationPicker } from "@/components/LocationPicker";
 import { PackagingSelector } from "@/components/PackagingSelector";
 import type { Sticker, Geolocation, Packaging } from "@/types/schema";
 import { useQuery } from "@tanstack/react-query";
+import { apiRequest } from "@/lib/queryClient";
 import { useTranslation } from "@/i18n";
 
 interface PhotoEditorProps {
@@ -22,6 +23,29 @@ interface PhotoEditorProps {
   onCancel: () => void;
 }
 
+// Times an upload is resent after a network error or a 5xx response
+const UPLOAD_RETRIES = 3;
+
+// Longest time to wait for a photo accepted with 202 to be composited in the background
+const PROCESSING_TIMEOUT_MS = 5 * 60 * 1000;
+
+// Long-polls the status endpoint of a photo accepted with 202 until it is ready or has failed
+async function waitUntilProcessed(statusUrl: string): Promise<void> {
+  const deadline = Date.now() + PROCESSING_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    const separator = statusUrl.includes("?") ? "&" : "?";
+    const res = await apiRequest("GET", `${statusUrl}${separator}wait=20`);
+    const { status } = await res.json();
+    if (status === "ready") {
+      return;
+    }
+    if (status === "failed") {
+      throw new Error("Photo processing failed");
+    }
+  }
+  throw new Error("Timed out waiting for the photo to be processed");
+}
+
 export function PhotoEditor({
   imageData,
   location,
@@ -279,6 +303,13 @@ export function PhotoEditor({
     setSelectedSticker(null);
   };
 
+  const failUpload = (error: unknown) => {
+    console.error("Upload error:", error);
+    alert(t('toasts.error'));
+    setIsUploading(false);
+    setUploadProgress(0);
+  };
+
   const handleUpload = async () => {
     setIsUploading(true);
     setUploadProgress(0);
@@ -358,33 +389,56 @@ export function PhotoEditor({
 
       formData.append("hide_date", hideDate.toString());
 
-      const xhr = new XMLHttpRequest();
-      xhr.upload.addEventListener("progress", (e) => {
-        if (e.lengthComputable) {
-          setUploadProgress(Math.round((e.loaded / e.total) * 100));
-        }
-      });
+      // One key per upload, resent with every retry so the server returns the photo it already created
+      const idempotencyKey = crypto.randomUUID();
 
-      xhr.addEventListener("load", () => {
-        if (xhr.status === 201) {
-          onUploadComplete();
-        } else {
-          console.error("Upload failed with status:", xhr.status, xhr.responseText);
-          throw new Error("Upload failed");
-        }
-      });
+      const send = (attempt: number) => {
+        const retryOrFail = (error: Error, delaySeconds: number) => {
+          if (attempt >= UPLOAD_RETRIES) {
+            failUpload(error);
+            return;
+          }
+          setUploadProgress(0);
+          setTimeout(() => send(attempt + 1), delaySeconds * 1000);
+        };
+
+        const xhr = new XMLHttpRequest();
+        xhr.upload.addEventListener("progress", (e) => {
+          if (e.lengthComputable) {
+            setUploadProgress(Math.round((e.loaded / e.total) * 100));
+          }
+        });
+
+        xhr.addEventListener("load", () => {
+          // 200 means the server already had this upload from an earlier attempt
+          if (xhr.status === 201 || xhr.status === 200) {
+            onUploadComplete();
+          } else if (xhr.status === 202) {
+            // Stored, but composited in the background: finish once the photo is ready
+            const statusUrl = xhr.getResponseHeader("Location") || `/api/photos/${JSON.parse(xhr.responseText).id}/status`;
+            waitUntilProcessed(statusUrl).then(onUploadComplete, failUpload);
+          } else if (xhr.status >= 500) {
+            // Busy (503 with Retry-After) or briefly unavailable: send the same upload again
+            const retryAfter = Number(xhr.getResponseHeader("Retry-After"));
+            retryOrFail(new Error(`Upload failed with status ${xhr.status}: ${xhr.responseText}`), retryAfter > 0 ? retryAfter : 2 ** attempt);
+          } else {
+            failUpload(new Error(`Upload failed with status ${xhr.status}: ${xhr.responseText}`));
+          }
+        });
 
-      xhr.addEventListener("error", () => {
-        throw new Error("Upload failed");
-      });
+        // The request may have reached the server even though the response was lost
+        xhr.addEventListener("error", () => {
+          retryOrFail(new Error("Upload failed"), 2 ** attempt);
+        });
+
+        xhr.open("POST", "/api/photos");
+        xhr.setRequestHeader("Idempotency-Key", idempotencyKey);
+        xhr.send(formData);
+      };
 
-      xhr.open("POST", "/api/photos");
-      xhr.send(formData);
+      send(0);
     } catch (error) {
-      console.error("Upload error:", error);
-      alert(t('toasts.error'));
-      setIsUploading(false);
-      setUploadProgress(0);
+      failUpload(error);
     }
   };
 
@@ -1,12 +1,12 @@
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
 import { Folder, Camera } from "lucide-react";
-import type { Project } from "@/types/schema";
+import type { ProjectSummary } from "@/types/schema";
 import { formatDistanceToNow } from "date-fns";
 import { useTranslation } from "@/i18n";
 
 interface ProjectCardProps {
-  project: Project & { photoCount: number };
+  project: ProjectSummary;
   onClick: () => void;
 }
 
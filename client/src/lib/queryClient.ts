@@ -23,6 +23,21 @@ export async function apiRequest(
   return res;
 }
 
+// Paginated listings answer with one page and an X-Next-Cursor header while more remain
+export async function fetchAllPages<T>(url: string): Promise<T[]> {
+  const items: T[] = [];
+  let cursor: string | null = null;
+  do {
+    const res = await fetch(cursor ? `${url}?cursor=${encodeURIComponent(cursor)}` : url, {
+      credentials: "include",
+    });
+    await throwIfResNotOk(res);
+    items.push(...(await res.json()));
+    cursor = res.headers.get("X-Next-Cursor");
+  } while (cursor);
+  return items;
+}
+
 type UnauthorizedBehavior = "returnNull" | "throw";
 export const getQueryFn: <T>(options: {
   on401: UnauthorizedBehavior;
@@ -41,10 +41,12 @@ export default function GalleryPage() {
                         <div
                             key={photo.id}
                             className="break-inside-avoid relative group rounded-xl overflow-hidden bg-card border shadow-sm hover:shadow-md transition-all cursor-pointer"
-                            onClick={() => window.open(`/api/photos/${photo.id}/file`, '_blank')}
+                            onClick={() => window.open(`/api/photos/${photo.id}/file?v=${photo.version}`, '_blank')}
                         >
                             <img
-                                src={`/api/photos/${photo.id}/file`}
+                                src={`/api/photos/${photo.id}/file?size=thumb&v=${photo.version}`}
+                                srcSet={`/api/photos/${photo.id}/file?size=thumb&v=${photo.version} 256w, /api/photos/${photo.id}/file?size=preview&v=${photo.version} 1024w`}
+                                sizes="(min-width: 1024px) 25vw, (min-width: 768px) 33vw, 50vw"
                                 alt={photo.comment || "Photo"}
                                 className="w-full h-auto object-cover"
                                 loading="lazy"
@@ -1,6 +1,6 @@
 import { useQuery, useMutation } from "@tanstack/react-query";
 import { useLocation } from "wouter";
-import { apiRequest, queryClient } from "@/lib/queryClient";
+import { apiRequest, fetchAllPages, queryClient } from "@/lib/queryClient";
 import { Card } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Skeleton } from "@/components/ui/skeleton";
@@ -46,6 +46,7 @@ export default function ProjectDetailPage({ params }: ProjectDetailPageProps) {
 
   const { data: photos, isLoading: isLoadingPhotos } = useQuery<Photo[]>({
     queryKey: ["/api/projects", projectId, "photos"],
+    queryFn: () => fetchAllPages<Photo>(`/api/projects/${projectId}/photos`),
   });
 
   const deletePhotoMutation = useMutation({
@@ -199,10 +200,12 @@ export default function ProjectDetailPage({ params }: ProjectDetailPageProps) {
             >
               <div
                 className="cursor-pointer"
-                onClick={() => window.open(`/api/photos/${photo.id}/file`, '_blank')}
+                onClick={() => window.open(`/api/photos/${photo.id}/file?v=${photo.version}`, '_blank')}
               >
                 <img
-                  src={`/api/photos/${photo.id}/file`}
+                  src={`/api/photos/${photo.id}/file?size=thumb&v=${photo.version}`}
+                  srcSet={`/api/photos/${photo.id}/file?size=thumb&v=${photo.version} 256w, /api/photos/${photo.id}/file?size=preview&v=${photo.version} 1024w`}
+                  sizes="(min-width: 1024px) 25vw, (min-width: 768px) 33vw, 50vw"
                   alt={photo.comment || "Project photo"}
                   className="w-full h-auto object-cover"
                   loading="lazy"
@@ -5,14 +5,14 @@ import { CreateProjectDialog } from "@/components/CreateProjectDialog";
 import { Card, CardContent } from "@/components/ui/card";
 import { Skeleton } from "@/components/ui/skeleton";
 import { FolderOpen, Plus } from "lucide-react";
-import type { Project } from "@/types/schema";
+import type { ProjectSummary } from "@/types/schema";
 import { useTranslation } from "@/i18n";
 
 export default function ProjectsPage() {
   const [, setLocation] = useLocation();
   const { t } = useTranslation();
 
-  const { data: projects, isLoading } = useQuery<(Project & { photoCount: number })[]>({
+  const { data: projects, isLoading } = useQuery<ProjectSummary[]>({
     queryKey: ["/api/projects"],
   });
 
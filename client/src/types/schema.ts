@@ -42,6 +42,13 @@ export interface Project {
     updatedAt: string;
 }
 
+// Project as listed by GET /api/projects
+export interface ProjectSummary extends Project {
+    photoCount: number;
+    lastPhotoAt: string | null;
+    coverPhotoId: string | null;
+}
+
 // Photo type
 export interface Photo {
     id: string;
@@ -54,6 +61,9 @@ export interface Photo {
     stickers: Sticker[];
     createdAt: string;
     packagingId?: string;
+    status?: "pending" | "ready" | "failed";
+    derivatives?: Record<string, string> | null;
+    version?: string;
 }
 
 // Zod schemas for validation